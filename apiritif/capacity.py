@@ -0,0 +1,191 @@
+"""
+Capacity search for apiritif-loadgen: step the load up until SLA is breached
+
+Copyright 2022 BlazeMeter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import json
+import threading
+import time
+
+from apiritif.control import apply_level
+from apiritif.schedule import CONCURRENCY
+from apiritif.stats import Summary
+from apiritif.utils import log
+
+EVALUATION_DELAY = 3  # seconds to wait for stats of plateau after its end (workers report them with delay)
+
+
+class Plateau(object):
+    def __init__(self, level, start_time, end_time):
+        self.level = level
+        self.start_time = start_time
+        self.end_time = end_time
+        self.summary = Summary()  # samples of measured part (after settle time)
+        self.passed = None  # None until evaluated
+        self.reason = ""
+
+    def measured(self, settle):
+        """
+        :return: (first, last) seconds of measurement window
+        """
+        return int(self.start_time + settle), int(self.end_time) - 1
+
+    def p95(self):
+        return self.summary.total().histogram.percentile(95)
+
+    def error_rate(self):
+        total = self.summary.total()
+        return 100.0 * total.failures / total.count if total.count else 0.0
+
+    def throughput(self, settle):
+        first, last = self.measured(settle)
+        return self.summary.total().count / float(max(last - first + 1, 1))
+
+    def to_dict(self, settle):
+        p95 = self.p95()
+        return {
+            "level": self.level, "start_time": self.start_time, "end_time": self.end_time,
+            "samples": self.summary.total().count, "throughput": round(self.throughput(settle), 3),
+            "p95_ms": None if p95 is None else round(1000 * p95, 3),
+            "error_rate": round(self.error_rate(), 3), "passed": self.passed, "reason": self.reason}
+
+
+class CapacitySearch(object):
+    """
+    Load driver which raises concurrency or arrival rate by equal steps. Every level is held for plateau
+    seconds, first settle seconds of it are ignored and p95 latency and error rate of the rest are checked
+    against thresholds. The search stops at the first breach (or at max level), the knee is the highest
+    level which still meets them.
+
+    Plateau is evaluated when its per-second stats are delivered, the next level is applied meanwhile,
+    so a breach is found a few seconds after the end of its plateau.
+    """
+
+    def __init__(self, control, capacities, target=CONCURRENCY, start=1, step=1, max_level=None, plateau=60,
+                 settle=10, sla_p95=0, sla_errors=0, report=None, weights=None):
+        """
+        :type control: apiritif.control.ControlBlock
+        :param weights: shares of workers, Balancer changes them in place
+        :param sla_p95: max p95 latency in milliseconds, 0 means no limit
+        :param sla_errors: max percent of failed samples, 0 means no limit
+        :param report: JSON file for capacity curve
+        """
+        if step <= 0:
+            raise ValueError("Step of capacity search must be positive")
+        if settle >= plateau:
+            raise ValueError("Settle time must be shorter than plateau")
+
+        self.control = control
+        self.capacities = capacities
+        self.target = target
+        self.start = start
+        self.step = step
+        self.max_level = max_level if max_level is not None else sum(capacities)
+        self.plateau = plateau
+        self.settle = settle
+        self.sla_p95 = sla_p95
+        self.sla_errors = sla_errors
+        self.report = report
+        self.weights = weights
+
+        self.plateaus = []
+        self.knee = None
+        self._climbing = True
+        self._lock = threading.Lock()
+
+    def add(self, second, summary):
+        """
+        Per-second summary of workers
+        """
+        with self._lock:
+            for plateau in self.plateaus:
+                first, last = plateau.measured(self.settle)
+                if first <= second <= last:
+                    plateau.summary.merge(summary)
+
+    def tick(self, now=None):
+        now = now or time.time()
+        if self.control.is_finished():
+            return
+
+        with self._lock:
+            if not self.plateaus:
+                self._start_plateau(self.start, now)
+                return
+
+            current = self.plateaus[-1]
+            if self._climbing and now >= current.end_time:
+                if current.level + self.step <= self.max_level:
+                    self._start_plateau(current.level + self.step, current.end_time)
+                else:
+                    self._climbing = False  # keep max level until it's evaluated
+
+            for plateau in self.plateaus:
+                if plateau.passed is None and now >= plateau.end_time + EVALUATION_DELAY:
+                    self._evaluate(plateau)
+                    if not plateau.passed:
+                        self._finish()
+                        return
+
+            if not self._climbing and self.plateaus[-1].passed is not None:
+                self._finish()
+
+    def _start_plateau(self, level, start_time):
+        log.info("Capacity search: %s level %s", self.target, level)
+        self.plateaus.append(Plateau(level, start_time, start_time + self.plateau))
+        apply_level(self.control, self.target, level, self.capacities, self.weights)
+
+    def _evaluate(self, plateau):
+        p95 = plateau.p95()
+        if not plateau.summary.total().count:
+            plateau.reason = "no samples"
+        elif self.sla_p95 and 1000 * p95 > self.sla_p95:
+            plateau.reason = "p95 %d ms > %s ms" % (1000 * p95, self.sla_p95)
+        elif self.sla_errors and plateau.error_rate() > self.sla_errors:
+            plateau.reason = "errors %.2f%% > %s%%" % (plateau.error_rate(), self.sla_errors)
+        plateau.passed = not plateau.reason
+        log.info("Capacity search: level %s %s%s", plateau.level, "passed" if plateau.passed else "failed: ",
+                 plateau.reason)
+
+    def _finish(self):
+        passed = [plateau for plateau in self.plateaus if plateau.passed]
+        self.knee = passed[-1].level if passed else None
+        log.info("Capacity curve:\n%s", "\n".join(self.curve()))
+        log.info("Capacity search is over, knee %s: %s", self.target, self.knee)
+        if self.report:
+            with open(self.report, "w") as fds:
+                json.dump(self.to_dict(), fds, indent=2)
+        self.control.finish()
+
+    def curve(self):
+        """
+        :return: lines of human readable table
+        """
+        template = "%10s %10s %10s %10s %10s  %s"
+        lines = [template % ("level", "samples", "hits/s", "p95, ms", "errors, %", "result")]
+        for plateau in self.plateaus:
+            if plateau.passed is None:
+                continue  # wasn't measured because the search has stopped
+            p95 = plateau.p95()
+            lines.append(template % (
+                plateau.level, plateau.summary.total().count, "%.2f" % plateau.throughput(self.settle),
+                int(1000 * p95) if p95 is not None else "", "%.2f" % plateau.error_rate(),
+                "passed" if plateau.passed else "failed: %s" % plateau.reason))
+        return lines
+
+    def to_dict(self):
+        return {
+            "target": self.target, "knee": self.knee, "sla_p95_ms": self.sla_p95, "sla_errors": self.sla_errors,
+            "plateaus": [plateau.to_dict(self.settle) for plateau in self.plateaus if plateau.passed is not None]}
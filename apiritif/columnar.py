@@ -0,0 +1,348 @@
+"""
+Compact binary result file of apiritif-loadgen: samples are stored in chunks of columns
+
+File starts with MAGIC, then chunks follow. Every chunk is framed by its length and CRC32 and compressed
+with zlib, so a file of crashed worker can be read up to its last complete chunk. Chunk contains:
+  * strings which first appear in this chunk (labels, URLs, paths, messages are stored once,
+    columns refer to them by number, 0 means None; when there are MAX_STRINGS of them, the table is reset
+    and the next chunk is flagged to start numbering over)
+  * one array per column of COLUMNS, samples and their subsamples are rows (parent refers to the row
+    of parent sample in the same chunk)
+  * optional blobs: JSON of bodies, headers and the rest of extras, assertions and traces per row
+
+Conversion to JTL and LDJSON:
+    python -m apiritif.columnar result-0.arb result-0.csv
+
+Copyright 2022 BlazeMeter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import array
+import json
+import struct
+import sys
+import zlib
+from optparse import OptionParser
+
+from apiritif import compression
+from apiritif.samples import Assertion, PathComponent, Sample
+from apiritif.utils import log
+
+EXTENSION = ".arb"
+MAGIC = b"APRTCOL1"
+CHUNK_ROWS = 10000  # rows are written as soon as there are so many of them, or on flush
+FRAME = struct.Struct("<II")  # compressed length and CRC32 of chunk
+COUNTS = struct.Struct("<IIIB")  # rows, new strings, length of blob section, flags
+CHUNK_RESET = 1  # strings of previous chunks are forgotten
+MAX_STRINGS = 100000  # e.g. unique URLs or error messages of long test mustn't grow the table endlessly
+LENGTH = struct.Struct("<I")
+
+STATUSES = [None, "PASSED", "FAILED", "BROKEN", "SKIPPED", "INTERRUPTED"]
+NO_TIME = -1
+FLAG_WARMUP = 1
+FLAG_SIZES = 2  # responseHeadersSize and responseBodySize are set, even if they are zero
+
+COLUMNS = [  # name and array type code
+    ("parent", "i"),
+    ("start_time", "q"),  # microseconds
+    ("duration", "q"),
+    ("intended_start", "q"),
+    ("status", "B"),
+    ("suite", "I"),  # strings
+    ("label", "I"),
+    ("path", "I"),
+    ("error", "I"),
+    ("message", "I"),
+    ("method", "I"),
+    ("url", "I"),
+    ("scenario", "I"),
+    ("code", "H"),  # 0 if it's not numeric
+    ("headers_size", "I"),
+    ("body_size", "I"),
+    ("all_threads", "I"),
+    ("grp_threads", "I"),
+    ("flags", "B"),
+]
+
+COLUMN_EXTRAS = ("intendedStartTime", "scenario", "responseMessage", "requestMethod", "requestURI", "responseCode",
+                 "responseHeadersSize", "responseBodySize", "warmup")
+
+
+def _to_micros(seconds):
+    return NO_TIME if seconds is None else int(round(seconds * 1000000))
+
+
+def _from_micros(micros):
+    return None if micros == NO_TIME else micros / 1000000.0
+
+
+def _as_code(value):
+    if isinstance(value, int) and not isinstance(value, bool) and 0 < value < 65536:
+        return value
+    return 0
+
+
+class ChunkEncoder(object):
+    """
+    Collects rows of samples and packs them into chunks, strings are interned until there are max_strings of them
+    """
+    max_strings = MAX_STRINGS
+
+    def __init__(self, blobs=False):
+        self.blobs = blobs
+        self.rows = 0
+        self._strings = {None: 0}
+        self._reset = False
+        self._new_strings = []
+        self._columns = {name: array.array(code) for name, code in COLUMNS}
+        self._blobs = []
+
+    def _intern(self, value):
+        if value not in self._strings:
+            self._strings[value] = len(self._strings)
+            self._new_strings.append(value)
+        return self._strings[value]
+
+    def add(self, sample, all_threads=0, grp_threads=0, parent=-1):
+        """
+        Add the sample with all its subsamples
+        """
+        row = self.rows
+        self.rows += 1
+        extras = sample.extras
+        path = json.dumps([[comp.type, comp.value] for comp in sample.path]) if sample.path else None
+        has_sizes = "responseHeadersSize" in extras or "responseBodySize" in extras
+        values = {
+            "parent": parent,
+            "start_time": _to_micros(sample.start_time),
+            "duration": _to_micros(sample.duration),
+            "intended_start": _to_micros(extras.get("intendedStartTime")),
+            "status": STATUSES.index(sample.status) if sample.status in STATUSES else 0,
+            "suite": self._intern(sample.test_suite),
+            "label": self._intern(sample.test_case),
+            "path": self._intern(path),
+            "error": self._intern(sample.error_msg),
+            "message": self._intern(extras.get("responseMessage")),
+            "method": self._intern(extras.get("requestMethod")),
+            "url": self._intern(extras.get("requestURI")),
+            "scenario": self._intern(extras.get("scenario")),
+            "code": _as_code(extras.get("responseCode")),
+            "headers_size": extras.get("responseHeadersSize", 0),
+            "body_size": extras.get("responseBodySize", 0),
+            "all_threads": all_threads,
+            "grp_threads": grp_threads,
+            "flags": (FLAG_WARMUP if extras.get("warmup") else 0) | (FLAG_SIZES if has_sizes else 0)}
+        for name, _ in COLUMNS:
+            self._columns[name].append(values[name])
+
+        if self.blobs:
+            self._blobs.append(self._encode_blob(sample))
+
+        for sub in sample.subsamples:
+            self.add(sub, all_threads, grp_threads, row)
+
+    def _encode_blob(self, sample):
+        rest = {key: value for key, value in sample.extras.items() if key not in COLUMN_EXTRAS}
+        if "responseCode" in sample.extras and not _as_code(sample.extras["responseCode"]):
+            rest["responseCode"] = sample.extras["responseCode"]
+        blob = {}
+        if rest:
+            blob["extras"] = rest
+        if sample.error_trace:
+            blob["error_trace"] = sample.error_trace
+        if sample.assertions:
+            blob["assertions"] = [[ass.name, ass.failed, ass.error_message, ass.error_trace, ass.extras['args'],
+                                   ass.extras['kwargs']] for ass in sample.assertions]
+        return json.dumps(blob).encode('utf-8') if blob else b""
+
+    def pop_chunk(self):
+        """
+        :return: framed chunk with rows added since previous one
+        """
+        strings = [value.encode('utf-8') for value in self._new_strings]
+        flags = CHUNK_RESET if self._reset else 0
+        parts = [COUNTS.pack(self.rows, len(strings), sum(len(blob) for blob in self._blobs), flags)]
+        for value in strings:
+            parts.append(LENGTH.pack(len(value)))
+            parts.append(value)
+        for name, _ in COLUMNS:
+            parts.append(self._to_bytes(self._columns[name]))
+        if any(self._blobs):
+            parts.append(self._to_bytes(array.array("I", [len(blob) for blob in self._blobs])))
+            parts.extend(self._blobs)
+
+        payload = zlib.compress(b"".join(parts))
+        self.rows = 0
+        self._new_strings = []
+        self._columns = {name: array.array(code) for name, code in COLUMNS}
+        self._blobs = []
+        self._reset = len(self._strings) > self.max_strings
+        if self._reset:
+            self._strings = {None: 0}
+        return FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+    @staticmethod
+    def _to_bytes(column):
+        if sys.byteorder == "big":  # file is little-endian
+            column = array.array(column.typecode, column)
+            column.byteswap()
+        return column.tobytes()
+
+
+class ColumnarReader(object):
+    """
+    Streaming reader, one chunk is in memory at once. Yields (sample, all_threads, grp_threads) of top level
+    samples, a file which isn't complete (e.g. worker has crashed) is read up to its last complete chunk.
+    """
+
+    def __init__(self, fds):
+        """
+        :param fds: file object opened in binary mode
+        """
+        self.fds = fds
+        self._strings = [None]
+        if self.fds.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Not a columnar result file: %s" % getattr(fds, "name", fds))
+
+    def __iter__(self):
+        while True:
+            frame = self.fds.read(FRAME.size)
+            if len(frame) < FRAME.size:
+                break
+            length, crc = FRAME.unpack(frame)
+            payload = self.fds.read(length)
+            if len(payload) < length:
+                log.warning("Result file is truncated, the last chunk is skipped")
+                break
+            if zlib.crc32(payload) != crc:
+                raise ValueError("Corrupted chunk in result file")
+            for record in self._read_chunk(zlib.decompress(payload)):
+                yield record
+
+    def _read_chunk(self, data):
+        rows, string_count, blobs_length, flags = COUNTS.unpack_from(data)
+        offset = COUNTS.size
+        if flags & CHUNK_RESET:
+            self._strings = [None]
+        for _ in range(string_count):
+            length, = LENGTH.unpack_from(data, offset)
+            offset += LENGTH.size
+            self._strings.append(data[offset:offset + length].decode('utf-8'))
+            offset += length
+
+        columns = {}
+        for name, code in COLUMNS:
+            column, offset = self._read_column(data, offset, code, rows)
+            columns[name] = column
+        blobs = None
+        if blobs_length:
+            lengths, offset = self._read_column(data, offset, "I", rows)
+            blobs = []
+            for length in lengths:
+                blobs.append(data[offset:offset + length])
+                offset += length
+
+        samples = []  # parent always precedes its subsamples
+        for row in range(rows):
+            samples.append(self._get_sample(columns, row, blobs[row] if blobs else b""))
+            if columns["parent"][row] >= 0:
+                samples[columns["parent"][row]].add_subsample(samples[row])
+
+        for row in range(rows):
+            if columns["parent"][row] < 0:
+                yield samples[row], columns["all_threads"][row], columns["grp_threads"][row]
+
+    @staticmethod
+    def _read_column(data, offset, code, rows):
+        column = array.array(code)
+        size = column.itemsize * rows
+        column.frombytes(data[offset:offset + size])
+        if sys.byteorder == "big":
+            column.byteswap()
+        return column, offset + size
+
+    def _get_sample(self, columns, row, blob):
+        strings = self._strings
+        sample = Sample(
+            test_suite=strings[columns["suite"][row]],
+            test_case=strings[columns["label"][row]],
+            status=STATUSES[columns["status"][row]],
+            start_time=_from_micros(columns["start_time"][row]),
+            duration=_from_micros(columns["duration"][row]),
+            error_msg=strings[columns["error"][row]])
+
+        path = strings[columns["path"][row]]
+        if path:
+            sample.path = [PathComponent(comp_type, value) for comp_type, value in json.loads(path)]
+
+        extras = sample.extras
+        if columns["intended_start"][row] != NO_TIME:
+            extras["intendedStartTime"] = _from_micros(columns["intended_start"][row])
+        for key, column in (("scenario", "scenario"), ("responseMessage", "message"),
+                            ("requestMethod", "method"), ("requestURI", "url")):
+            if columns[column][row]:
+                extras[key] = strings[columns[column][row]]
+        if columns["code"][row]:
+            extras["responseCode"] = columns["code"][row]
+        flags = columns["flags"][row]
+        if flags & FLAG_SIZES:
+            extras["responseHeadersSize"] = columns["headers_size"][row]
+            extras["responseBodySize"] = columns["body_size"][row]
+        if flags & FLAG_WARMUP:
+            extras["warmup"] = True
+
+        if blob:
+            blob = json.loads(blob.decode('utf-8'))
+            extras.update(blob.get("extras", {}))
+            sample.error_trace = blob.get("error_trace")
+            for name, failed, error_message, error_trace, args, kwargs in blob.get("assertions", []):
+                assertion = Assertion(name, {"args": args, "kwargs": kwargs})
+                if failed:
+                    assertion.set_failed(error_message, error_trace)
+                sample.assertions.append(assertion)
+        return sample
+
+
+def read_samples(filename):
+    """
+    :return: generator of (sample, all_threads, grp_threads)
+    """
+    with compression.open_input(filename) as fds:
+        for record in ColumnarReader(fds):
+            yield record
+
+
+def convert(source, target):
+    """
+    Convert columnar result file into JTL (CSV) or LDJSON, format is chosen by extension of target
+    """
+    from apiritif.loadgen import JTLSampleWriter, LDJSONSampleWriter  # loadgen uses this module
+
+    if compression.strip_extension(target).lower().endswith(".ldjson"):
+        writer = LDJSONSampleWriter(target)
+    else:
+        writer = JTLSampleWriter(target)
+
+    writer.write_all(read_samples(source))
+
+
+def main():
+    parser = OptionParser(usage="Usage: python -m apiritif.columnar result.arb result.csv|result.ldjson[.gz|.zst]")
+    opts, args = parser.parse_args()
+    if len(args) != 2:
+        parser.error("Source and target files are required")
+    convert(*args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""
+Compressed result files of apiritif-loadgen: result-%s.ldjson.gz, result-%s.csv.zst
+
+Data is compressed in independent blocks, a block ends when writer flushes the file (so it contains whole
+samples) or when it reaches the buffer size. Every block starts with its length, so a file of crashed worker
+is readable up to its last complete block and the blocks can be found without decompression and read in parallel.
+Blocks are valid gzip members (or zstd frames preceded by skippable frame), usual tools read the whole file.
+
+Copyright 2022 BlazeMeter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import gzip
+import io
+import os
+import struct
+import zlib
+
+from apiritif.utils import log
+
+try:
+    import zstandard
+except ImportError:  # optional dependency, only for .zst files
+    zstandard = None
+
+
+class GzipCodec(object):
+    """
+    Block is gzip member with its length in 'AP' subfield of extra header (like BGZF of bioinformatics)
+    """
+    extension = ".gz"
+    header = struct.Struct("<4sIBBH2sHI")
+    magic = b"\x1f\x8b\x08\x04"  # deflate, extra field is present
+    level = 6
+
+    def compress(self, data):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        body = compressor.compress(data) + compressor.flush()
+        trailer = struct.pack("<II", zlib.crc32(data), len(data) & 0xFFFFFFFF)
+        size = self.header.size + len(body) + len(trailer)
+        return self.header.pack(self.magic, 0, 0, 255, 8, b"AP", 4, size) + body + trailer
+
+    def get_block_size(self, header):
+        magic, _, _, _, _, subfield, _, size = self.header.unpack(header)
+        if magic != self.magic or subfield != b"AP":
+            raise ValueError("Not a block of apiritif result file")
+        return size
+
+    def decompress(self, block):
+        return zlib.decompress(block, 16 + zlib.MAX_WBITS)
+
+
+class ZstdCodec(object):
+    """
+    Block is zstd frame preceded by skippable frame with its length
+    """
+    extension = ".zst"
+    header = struct.Struct("<III")
+    magic = 0x184D2A51  # skippable frame, zstd tools ignore it
+    level = 3
+
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(level=self.level)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data):
+        frame = self._compressor.compress(data)
+        return self.header.pack(self.magic, 4, len(frame)) + frame
+
+    def get_block_size(self, header):
+        magic, _, size = self.header.unpack(header)
+        if magic != self.magic:
+            raise ValueError("Not a block of apiritif result file")
+        return self.header.size + size
+
+    def decompress(self, block):
+        return self._decompressor.decompress(block[self.header.size:])
+
+
+CODECS = (GzipCodec, ZstdCodec)
+
+
+def get_codec(filename):
+    """
+    :return: codec chosen by file extension, None for uncompressed file
+    """
+    for codec in CODECS:
+        if filename.lower().endswith(codec.extension):
+            if codec is ZstdCodec and zstandard is None:
+                raise ValueError("Compression of %s requires zstandard package: pip install zstandard" % filename)
+            return codec()
+    return None
+
+
+def strip_extension(filename):
+    """
+    'result-0.ldjson.gz' -> 'result-0.ldjson', format of result file is chosen by the rest of name
+    """
+    for codec in CODECS:
+        if filename.lower().endswith(codec.extension):
+            return filename[:-len(codec.extension)]
+    return filename
+
+
+class BlockWriter(object):
+    """
+    Binary output file which compresses data by blocks, a block ends on flush() or when it reaches block_size
+    """
+
+    def __init__(self, fds, codec, block_size):
+        self.fds = fds
+        self.codec = codec
+        self.block_size = block_size
+        self._parts = []
+        self._size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, data):
+        self._parts.append(data)
+        self._size += len(data)
+        if self._size >= self.block_size:
+            self._write_block()
+        return len(data)
+
+    def _write_block(self):
+        if self._size:
+            data = b"".join(self._parts)
+            self._parts = []
+            self._size = 0
+            self.fds.write(self.codec.compress(data))
+
+    def flush(self):
+        self._write_block()
+        self.fds.flush()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.fds.close()
+
+
+def open_output(filename, buffer_size):
+    """
+    :param buffer_size: KB of data kept in memory, compressed file gets blocks of this size
+    """
+    buffer_size = max(int(buffer_size * 1024), 1)
+    codec = get_codec(filename)
+    if codec is None:
+        return open(filename, "wb", buffering=buffer_size)
+    return BlockWriter(open(filename, "wb"), codec, buffer_size)
+
+
+def iter_blocks(fds, codec):
+    """
+    :return: generator of (offset, size) of complete blocks, nothing is decompressed
+    """
+    offset = fds.tell()
+    file_size = os.fstat(fds.fileno()).st_size
+    while offset < file_size:
+        fds.seek(offset)
+        header = fds.read(codec.header.size)
+        if len(header) < codec.header.size or offset + codec.get_block_size(header) > file_size:
+            log.warning("Result file is truncated, the last block is skipped")
+            break
+        size = codec.get_block_size(header)
+        yield offset, size
+        offset += size
+
+
+def get_blocks(filename):
+    """
+    Blocks to read in parallel with read_block()
+
+    :return: list of (offset, size)
+    """
+    with open(filename, "rb") as fds:
+        return list(iter_blocks(fds, get_codec(filename)))
+
+
+def read_block(filename, offset, size):
+    """
+    :return: decompressed data of block, it starts and ends on sample boundary
+    """
+    with open(filename, "rb") as fds:
+        fds.seek(offset)
+        return get_codec(filename).decompress(fds.read(size))
+
+
+class BlockReader(io.RawIOBase):
+    """
+    Decompressed data of block-framed file, one block is in memory at once
+    """
+
+    def __init__(self, fds, codec):
+        super(BlockReader, self).__init__()
+        self.fds = fds
+        self.codec = codec
+        self._blocks = iter_blocks(fds, codec)
+        self._data = b""
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        while self._pos >= len(self._data):
+            block = next(self._blocks, None)
+            if block is None:
+                return 0
+            offset, size = block
+            self.fds.seek(offset)
+            self._data = self.codec.decompress(self.fds.read(size))
+            self._pos = 0
+
+        count = min(len(buf), len(self._data) - self._pos)
+        buf[:count] = self._data[self._pos:self._pos + count]
+        self._pos += count
+        return count
+
+    def close(self):
+        self.fds.close()
+        super(BlockReader, self).close()
+
+
+def open_input(filename):
+    """
+    :return: binary file object with decompressed data
+    """
+    codec = get_codec(filename)
+    if codec is None:
+        return open(filename, "rb")
+
+    fds = open(filename, "rb")
+    try:
+        codec.get_block_size(fds.read(codec.header.size))
+    except (ValueError, struct.error):  # empty file or compressed by something else
+        fds.close()
+        if isinstance(codec, GzipCodec):
+            return gzip.open(filename, "rb")
+        return zstandard.open(filename, "rb")
+    fds.seek(0)
+    return io.BufferedReader(BlockReader(fds, codec))
@@ -0,0 +1,320 @@
+"""
+Load targets shared between apiritif-loadgen supervisor and its worker processes
+
+Copyright 2022 BlazeMeter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import json
+import multiprocessing
+import socket
+import time
+from threading import Thread
+
+from apiritif.schedule import CONCURRENCY, RATE
+from apiritif.utils import log
+
+REBALANCE_INTERVAL = 5  # seconds between moves, workers have to measure the effect of previous one
+REBALANCE_STEP = 0.1  # part of hot worker's VUs (or rate) moved at once
+REBALANCE_FLOOR = 0.1  # part of its initial weight (VU pool) which worker keeps whatever moves were
+
+
+def split_int(total, weights):
+    """
+    Split integer total proportionally to weights, sum of parts is exactly round(total)
+    """
+    weight_sum = float(sum(weights))
+    parts = []
+    progress = 0
+    done = 0
+    for weight in weights:
+        progress += weight
+        part = int(round(total * progress / weight_sum)) - done if weight_sum else 0
+        parts.append(part)
+        done += part
+
+    return parts
+
+
+def split_float(total, weights):
+    weight_sum = float(sum(weights))
+    return [total * weight / weight_sum if weight_sum else 0.0 for weight in weights]
+
+
+def split_capped(total, weights, caps):
+    """
+    Split integer total proportionally to weights, but no part exceeds its cap (the excess goes to others)
+    """
+    total = min(int(round(total)), sum(caps))
+    parts = [min(part, cap) for part, cap in zip(split_int(total, weights if sum(weights) else caps), caps)]
+    excess = total - sum(parts)
+    while excess > 0:
+        for idx, cap in enumerate(caps):
+            if excess and parts[idx] < cap:
+                parts[idx] += 1
+                excess -= 1
+
+    return parts
+
+
+class VUCounters(object):
+    """
+    Active VUs of every worker process and scenario in shared memory.
+
+    VU threads of all workers change their slots under the lock of shared array, so updates are atomic,
+    readers (result writers, supervisor) take lock-free snapshots.
+    Has to be passed into worker processes by inheritance, usually as part of ControlBlock.
+    """
+
+    def __init__(self, worker_count, scenario_count=1):
+        self.worker_count = worker_count
+        self.scenario_count = scenario_count
+        self._slots = multiprocessing.Array('i', worker_count * scenario_count)
+
+    def add(self, worker_index, delta, scenario=0):
+        with self._slots.get_lock():
+            self._slots[worker_index * self.scenario_count + scenario] += delta
+
+    def worker(self, worker_index):
+        start = worker_index * self.scenario_count
+        return sum(self._slots.get_obj()[start:start + self.scenario_count])
+
+    def scenario(self, scenario):
+        return sum(self._slots.get_obj()[scenario::self.scenario_count])
+
+    def total(self):
+        return sum(self._slots.get_obj())
+
+
+class ControlBlock(object):
+    """
+    Targets of every worker process kept in shared memory.
+
+    Supervisor is the only writer, workers just read their slots before each iteration,
+    so it's cheap enough for hot path and doesn't need locks. Counters of active VUs are the exception.
+    Has to be passed into worker processes by inheritance (see Pool initializer).
+    """
+
+    def __init__(self, worker_count, scenario_count=1):
+        self.worker_count = worker_count
+        self._concurrency = multiprocessing.RawArray('i', worker_count)
+        self._rate = multiprocessing.RawArray('d', worker_count)
+        self.vus = VUCounters(worker_count, scenario_count)  # written by VUs themselves
+        self._heat = multiprocessing.RawArray('d', worker_count)  # written by health monitors of workers
+        self._paused = multiprocessing.RawValue('i', 0)
+        self._finished = multiprocessing.RawValue('i', 0)
+
+    def concurrency(self, worker_index):
+        return self._concurrency[worker_index]
+
+    def rate(self, worker_index):
+        return self._rate[worker_index]
+
+    def set_concurrency(self, worker_index, concurrency):
+        self._concurrency[worker_index] = concurrency
+
+    def set_rate(self, worker_index, rate):
+        self._rate[worker_index] = rate
+
+    def active(self, worker_index):
+        return self.vus.worker(worker_index)
+
+    def heat(self, worker_index):
+        """
+        Load of worker process against saturation thresholds, 1.0 and more means it's saturated
+        """
+        return self._heat[worker_index]
+
+    def set_heat(self, worker_index, heat):
+        self._heat[worker_index] = heat
+
+    def is_paused(self):
+        return bool(self._paused.value)
+
+    def set_paused(self, paused):
+        self._paused.value = int(paused)
+
+    def is_finished(self):
+        return bool(self._finished.value)
+
+    def finish(self):
+        self._finished.value = 1
+
+
+def apply_level(control, target, level, capacities, weights=None):
+    """
+    Split total level of concurrency or rate between workers proportionally to their VU pools
+    (or to weights set by Balancer), concurrency of every worker is limited by its pool
+    """
+    if target == RATE:
+        for idx, rate in enumerate(split_float(level, weights or capacities)):
+            control.set_rate(idx, rate)
+    else:
+        for idx, concurrency in enumerate(split_capped(level, weights or capacities, capacities)):
+            control.set_concurrency(idx, concurrency)
+
+
+class ProfileDriver(object):
+    """
+    Moves worker targets along the load profile, levels are split between workers proportionally to their VU pools
+    """
+
+    def __init__(self, profile, control, capacities, weights=None):
+        """
+        :type profile: apiritif.schedule.LoadProfile
+        :type control: ControlBlock
+        :type capacities: list[int]
+        :param weights: shares of workers, Balancer changes them in place
+        """
+        self.profile = profile
+        self.control = control
+        self.capacities = capacities
+        self.weights = weights
+        self.start_time = None
+        self.level = None
+
+    def tick(self, now=None):
+        now = now or time.time()
+        if self.start_time is None:
+            self.start_time = now
+
+        level = self.profile.level_at(now - self.start_time)
+        if level is None:
+            if not self.control.is_finished():
+                log.info("Load profile is over")
+                self.control.finish()
+            return
+
+        if level != self.level:
+            log.debug("Profile %s level: %.3f", self.profile.target, level)
+            self.level = level
+            apply_level(self.control, self.profile.target, level, self.capacities, self.weights)
+
+
+class Balancer(object):
+    """
+    Moves load from saturated worker processes to cold ones, total concurrency (or rate) stays the same.
+
+    Health monitors of workers publish their heat (CPU load and scheduler lag against saturation thresholds)
+    into ControlBlock. Every interval the hottest saturated worker gives a step of its VUs (or rate)
+    to the coldest one which isn't saturated and has free VUs in its pool. The same part of total weight moves
+    between their shares (hot one keeps REBALANCE_FLOOR of its pool), so levels set later by profile,
+    capacity search or control commands are split the same way and idle workers of low levels get load later.
+    """
+
+    def __init__(self, control, capacities, target=CONCURRENCY, weights=None, interval=REBALANCE_INTERVAL,
+                 step=REBALANCE_STEP):
+        """
+        :type control: ControlBlock
+        :param weights: shares of workers shared with drivers, changed in place
+        :param step: part of hot worker's load moved at once
+        """
+        self.control = control
+        self.capacities = capacities
+        self.target = target
+        self.weights = weights if weights is not None else list(capacities)
+        self.interval = interval
+        self.step = step
+        self.moves = 0
+        self._last_time = None
+
+    def tick(self, now=None):
+        now = now or time.time()
+        if self._last_time is None:
+            self._last_time = now
+        if now - self._last_time < self.interval or self.control.is_finished():
+            return
+        self._last_time = now
+
+        workers = range(self.control.worker_count)
+        heats = [self.control.heat(idx) for idx in workers]
+        hot = max(workers, key=lambda idx: heats[idx])
+        if heats[hot] < 1.0:
+            return
+
+        if self.target == RATE:
+            loads = [self.control.rate(idx) for idx in workers]
+            colds = [idx for idx in workers if heats[idx] < 1.0]
+            delta = loads[hot] * self.step
+        else:
+            loads = [self.control.concurrency(idx) for idx in workers]
+            colds = [idx for idx in workers if heats[idx] < 1.0 and loads[idx] < self.capacities[idx]]
+            delta = min(max(int(loads[hot] * self.step), 1), loads[hot] - 1)
+
+        if not colds or delta <= 0:
+            return
+
+        cold = min(colds, key=lambda idx: heats[idx])
+        if self.target == RATE:
+            self.control.set_rate(hot, loads[hot] - delta)
+            self.control.set_rate(cold, loads[cold] + delta)
+        else:
+            delta = min(delta, self.capacities[cold] - loads[cold])
+            self.control.set_concurrency(hot, loads[hot] - delta)
+            self.control.set_concurrency(cold, loads[cold] + delta)
+        weight_sum = float(sum(self.weights))
+        shift = min(weight_sum * delta / sum(loads), self.weights[hot] - self.capacities[hot] * REBALANCE_FLOOR)
+        if shift > 0:
+            self.weights[hot] -= shift
+            self.weights[cold] += shift
+        self.moves += 1
+        log.info("Worker #%s is saturated (heat %.2f), %s %s moved to worker #%s (heat %.2f)",
+                 hot, heats[hot], delta if self.target == CONCURRENCY else "%.3f" % delta,
+                 "VUs" if self.target == CONCURRENCY else "rate", cold, heats[cold])
+
+
+class ControlServer(Thread):
+    """
+    Runtime control of the test over TCP: one text command per line (e.g. 'vus 100'), one JSON reply per line
+    """
+
+    def __init__(self, address, handler):
+        """
+        :param handler: callable(command, args) which returns dict for reply
+        """
+        super(ControlServer, self).__init__(name=self.__class__.__name__)
+        self.daemon = True
+        self.handler = handler
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(address)
+        self.server.listen(5)
+        self.address = self.server.getsockname()
+
+    def run(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:  # closed
+                break
+            client = Thread(target=self._serve, args=(conn,), name="ControlClient")
+            client.daemon = True
+            client.start()
+
+    def close(self):
+        self.server.close()
+
+    def _serve(self, conn):
+        with conn, conn.makefile("rwb") as stream:
+            for line in stream:
+                words = line.decode("utf-8").split()
+                if not words:
+                    continue
+
+                try:
+                    reply = self.handler(words[0].lower(), words[1:])
+                except (ValueError, TypeError) as exc:
+                    reply = {"error": str(exc)}
+
+                stream.write(json.dumps(reply).encode("utf-8") + b"\n")
+                stream.flush()
@@ -16,7 +16,6 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import re
-import threading
 
 import csv
 from io import open
@@ -26,7 +25,7 @@ from chardet.universaldetector import UniversalDetector
 import apiritif.thread as thread
 from apiritif.utils import NormalShutdown
 
-thread_data = threading.local()
+thread_data = thread.VULocal()
 
 
 class Reader(object):
@@ -0,0 +1,423 @@
+"""
+Distributed mode of apiritif-loadgen: controller splits the load between several agents and drives them over TCP
+
+Protocol is a sequence of JSON messages, one per line:
+    agent -> controller: hello (with number of CPUs)
+    controller -> agent: run (params, test bundle and slice of the load)
+    agent -> controller: ready (bundle unpacked, workers can be started)
+    controller -> agent: start (sent to all agents at once when every one is ready)
+    agent -> controller: stats (summary of one second), ..., finished (final summary) or error
+
+Copyright 2022 BlazeMeter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import base64
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import socket
+import sys
+import tempfile
+import time
+import traceback
+import zipfile
+from threading import Thread
+
+from apiritif.control import split_int, split_float
+from apiritif.loadgen import Params, Supervisor, STATS_DELAY, get_option_parser, get_report_name, options_to_params
+from apiritif.loadgen import setup_logging
+from apiritif.metrics import LiveMetrics, MetricsServer
+from apiritif.schedule import LoadProfile, Scenario
+from apiritif.stats import Summary, Timeline
+from apiritif.utils import log, request_shutdown, reset_shutdown, VERSION
+
+DEFAULT_PORT = 8500
+PARAMS = ("concurrency", "target_concurrency", "iterations", "ramp_up", "steps", "hold_for", "rate", "arrivals",
+          "pacing", "throughput", "deadline_grace", "warmup", "keep_warmup", "reuse_suite", "executor", "nice",
+          "memory_limit", "rebalance", "flush_interval", "buffer_size", "result_blobs", "aggregate", "verbose")
+FILE_PARAMS = ("health_report", "failures_report")  # templates of file names, agents put them next to result files
+LOCAL_OPTIONS = ("control_port", "cpu_affinity", "writer_cpu")  # they are about the box where they are given
+
+
+def parse_address(address, default_host="127.0.0.1"):
+    """
+    'host:port', 'host' or ':port' to (host, port)
+    """
+    host, _, port = address.rpartition(":") if ":" in address else (address, None, "")
+    return host or default_host, int(port) if port else DEFAULT_PORT
+
+
+def send_message(stream, message):
+    stream.write(json.dumps(message).encode("utf-8") + b"\n")
+    stream.flush()
+
+
+def read_message(stream, expected=None):
+    line = stream.readline()
+    if not line:
+        raise ConnectionError("Connection closed by other side")
+
+    message = json.loads(line.decode("utf-8"))
+    if message["type"] == "error":
+        raise RuntimeError("Remote error: %s" % message["message"])
+    if expected and message["type"] != expected:
+        raise RuntimeError("Unexpected message '%s' instead of '%s'" % (message["type"], expected))
+
+    return message
+
+
+def pack_bundle(paths):
+    """
+    Zip files and directories into base64 string, they are placed into root of archive by their base names
+
+    :return: bundle, names of paths inside of bundle
+    """
+    buf = io.BytesIO()
+    names = []
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as archive:
+        for path in paths:
+            path = os.path.abspath(path).rstrip(os.sep)
+            name = os.path.basename(path)
+            names.append(name)
+            if os.path.isdir(path):
+                for dir_path, _, filenames in os.walk(path):
+                    for filename in filenames:
+                        full_name = os.path.join(dir_path, filename)
+                        archive.write(full_name, os.path.join(name, os.path.relpath(full_name, path)))
+            else:
+                archive.write(path, name)
+
+    return base64.b64encode(buf.getvalue()).decode("ascii"), names
+
+
+def unpack_bundle(bundle, directory):
+    with zipfile.ZipFile(io.BytesIO(base64.b64decode(bundle))) as archive:
+        archive.extractall(directory)
+
+
+class Agent(object):
+    """
+    Runs slices of the load for controllers one by one, every run is a separate connection
+    """
+
+    def __init__(self, address, report_template="result-%s.csv"):
+        self.report_template = report_template
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(address)
+        self.server.listen(1)
+        self.address = self.server.getsockname()  # real port if it was 0
+
+    def close(self):
+        self.server.close()
+
+    def serve_forever(self):
+        log.info("Agent is listening on %s:%s", *self.address)
+        if not self.address[0].startswith("127."):
+            log.warning("Agent isn't authenticated, make sure only controllers can connect to its port")
+        while True:
+            try:
+                self.serve_once()
+            except (ConnectionError, RuntimeError) as exc:
+                log.warning("Run has failed: %s", exc)
+
+    def serve_once(self):
+        conn, peer = self.server.accept()
+        self._reset_shutdown()
+        log.info("Controller connected: %s:%s", *peer)
+        with conn, conn.makefile("rwb") as stream:
+            self._handle(stream)
+
+    @staticmethod
+    def _reset_shutdown():
+        """
+        Previous run might be stopped, it mustn't stop this one
+        """
+        reset_shutdown()
+        graceful_file = os.environ.get("GRACEFUL")
+        if graceful_file and os.path.exists(graceful_file):
+            log.info("Removing %s left by previous run", graceful_file)
+            os.remove(graceful_file)
+
+    def _handle(self, stream):
+        send_message(stream, {"type": "hello", "version": VERSION, "cpu_count": multiprocessing.cpu_count()})
+        task = read_message(stream, "run")
+        workdir = tempfile.mkdtemp(prefix="apiritif-agent-")
+        supervisor = None
+        try:
+            unpack_bundle(task["bundle"], workdir)
+            params = self._get_params(task, workdir)
+            stats_queue = multiprocessing.Queue()
+            supervisor = Supervisor(params, stats_queue)
+            send_message(stream, {"type": "ready"})
+
+            read_message(stream, "start")
+            log.info("Starting slice #%s: %s VUs, %s worker(s)", task["agent_index"], params.concurrency,
+                     params.worker_count)
+            supervisor.start()
+            self._forward_stats(stream, stats_queue, supervisor)
+            supervisor.join()
+            self._forward_stats(stream, stats_queue)
+
+            if supervisor.summary is None:
+                raise RuntimeError("Workers have failed, see agent log")
+
+            templates = [params.report] + [getattr(params, name) for name in FILE_PARAMS if getattr(params, name)]
+            reports = [get_report_name(template, idx, params.worker_count)
+                       for template in templates for idx in range(params.worker_count)]
+            send_message(stream, {"type": "finished", "summary": supervisor.summary.to_dict(), "reports": reports})
+        except ConnectionError:
+            raise
+        except BaseException as exc:
+            log.debug("Agent failure: %s", traceback.format_exc())
+            send_message(stream, {"type": "error", "message": "%s: %s" % (exc.__class__.__name__, exc)})
+            raise RuntimeError(str(exc))
+        finally:
+            if supervisor is not None and supervisor.is_alive():  # its tests mustn't outlive the run and workdir
+                request_shutdown("run has failed")
+                supervisor.join()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def _get_params(self, task, workdir):
+        params = Params()
+        for name in PARAMS:
+            setattr(params, name, task["params"][name])
+
+        params.thread_index = task["thread_index"]
+        params.tests = [os.path.join(workdir, name) for name in task["tests"]]
+        params.scenarios = [Scenario.from_dict(dict(scenario, script=test))
+                            for scenario, test in zip(task["scenarios"], params.tests)]
+        params.workdir = workdir
+        params.report = os.path.abspath(self.report_template)
+        for name in FILE_PARAMS:
+            if task["params"][name]:
+                setattr(params, name, os.path.join(os.path.dirname(params.report), task["params"][name]))
+        if task["profile"]:
+            params.profile = LoadProfile.from_dict(task["profile"])
+            params.profile.scale = task["share"]
+
+        workers = task["workers"]
+        params.worker_count = multiprocessing.cpu_count() if workers == "auto" else int(workers)
+        params.worker_count = max(min(params.worker_count, params.concurrency), 1)
+        return params
+
+    @staticmethod
+    def _forward_stats(stream, stats_queue, supervisor=None):
+        """
+        Send per-second summaries while supervisor works (or just the rest of them)
+        """
+        while True:
+            try:
+                second, summary = stats_queue.get(timeout=0.1)
+            except queue.Empty:
+                if supervisor is not None and supervisor.is_alive():
+                    continue
+                break
+
+            send_message(stream, {"type": "stats", "second": second, "summary": summary.to_dict()})
+
+
+class Controller(object):
+    """
+    Splits the load between agents proportionally to their CPUs, starts them together,
+    collects live per-second stats and final summaries
+    """
+
+    def __init__(self, params, agents, workers="1", profile=None, bundle=()):
+        """
+        :type params: Params
+        :param agents: list of (host, port)
+        :param workers: number of worker processes for every agent or 'auto'
+        :param profile: load profile as loaded from JSON
+        :param bundle: extra files and directories which tests need
+        """
+        self.params = params
+        self.agents = agents
+        self.workers = workers
+        self.profile = profile
+        self.bundle = list(bundle)
+
+        self.timeline = Timeline()  # seconds of all agents together
+        self.metrics = LiveMetrics() if params.metrics_port else None
+        self.summary = None
+        self.reports = {}
+        self._reported = set()
+        self._messages = queue.Queue()
+
+    def run(self):
+        with contextlib.ExitStack() as stack:  # opened connections are closed if one of agents isn't available
+            streams = []
+            for agent in self.agents:
+                conn = stack.enter_context(socket.create_connection(agent))
+                streams.append(stack.enter_context(conn.makefile("rwb")))
+            self._run(streams)
+
+    def _run(self, streams):
+        hellos = [read_message(stream, "hello") for stream in streams]
+        bundle, names = pack_bundle(self.params.tests + self.bundle)
+        tasks = self._get_tasks([hello["cpu_count"] for hello in hellos], bundle, names[:len(self.params.tests)])
+        for stream, task in zip(streams, tasks):
+            send_message(stream, task)
+        for stream in streams:
+            read_message(stream, "ready")
+
+        for stream in streams:  # as close in time as possible
+            send_message(stream, {"type": "start"})
+        log.info("Started %s agent(s)", len(streams))
+
+        for idx, stream in enumerate(streams):
+            reader = Thread(target=self._read_messages, args=(idx, stream), name="AgentReader-%s" % idx)
+            reader.daemon = True
+            reader.start()
+
+        self._gather(len(streams))
+
+    def _gather(self, agent_count):
+        metrics_server = None
+        if self.metrics:
+            metrics_server = MetricsServer(("127.0.0.1", self.params.metrics_port), self.metrics)
+            metrics_server.start()
+            log.info("Live metrics are served on http://%s:%s/", *metrics_server.address)
+        try:
+            self._gather_messages(agent_count)
+        finally:
+            if metrics_server:
+                metrics_server.close()
+
+    def _get_tasks(self, weights, bundle, tests):
+        concurrencies = split_int(self.params.concurrency, weights)
+        if min(concurrencies) < 1:
+            raise ValueError("Concurrency %s is too low for %s agents" % (self.params.concurrency, len(weights)))
+
+        targets = [None] * len(weights)  # active VUs of pools which are bigger (--max-concurrency)
+        if self.params.target_concurrency is not None:
+            targets = split_int(self.params.target_concurrency, concurrencies)
+        rates = split_float(self.params.rate, concurrencies)
+        throughputs = split_float(self.params.throughput, concurrencies)
+        iterations = [self.params.iterations] * len(weights)
+        if self.params.is_open_model() and self.params.iterations < sys.maxsize:
+            iterations = split_int(self.params.iterations, concurrencies)
+
+        thread_index = 0
+        for idx, concurrency in enumerate(concurrencies):
+            params = {name: getattr(self.params, name) for name in PARAMS}
+            params.update({name: os.path.basename(getattr(self.params, name) or "") for name in FILE_PARAMS})
+            params.update(concurrency=concurrency, target_concurrency=targets[idx], rate=rates[idx],
+                          throughput=throughputs[idx], iterations=iterations[idx])
+            yield {
+                "type": "run", "agent_index": idx, "thread_index": thread_index, "params": params,
+                "workers": self.workers, "profile": self.profile, "share": concurrency / float(self.params.concurrency),
+                "tests": tests, "scenarios": [scenario.to_dict() for scenario in self.params.scenarios],
+                "bundle": bundle}
+            thread_index += concurrency
+
+    def _read_messages(self, idx, stream):
+        try:
+            while True:
+                message = read_message(stream)
+                self._messages.put((idx, message))
+                if message["type"] == "finished":
+                    break
+        except (ConnectionError, RuntimeError) as exc:
+            self._messages.put((idx, {"type": "error", "message": str(exc)}))
+
+    def _gather_messages(self, agent_count):
+        self.summary = Summary()
+        finished = 0
+        while finished < agent_count:
+            try:
+                idx, message = self._messages.get(timeout=1)
+            except queue.Empty:
+                self._log_seconds(time.time() - STATS_DELAY - 1)
+                continue
+
+            if message["type"] == "stats":
+                summary = Summary.from_dict(message["summary"])
+                self.timeline.merge(message["second"], summary)
+                if self.metrics:
+                    self.metrics.add(message["second"], summary)
+            elif message["type"] == "finished":
+                finished += 1
+                self.summary.merge(Summary.from_dict(message["summary"]))
+                self.reports["%s:%s" % self.agents[idx]] = message["reports"]
+                log.info("Agent %s:%s finished, results: %s", self.agents[idx][0], self.agents[idx][1],
+                         ", ".join(message["reports"]))
+            else:
+                raise RuntimeError("Agent %s:%s has failed: %s" % (self.agents[idx] + (message["message"],)))
+
+        self._log_seconds()
+        log.info("Summary of %s agent(s):\n%s", agent_count, "\n".join(self.summary.report()))
+
+    def _log_seconds(self, before=None):
+        for second in sorted(self.timeline.seconds):
+            if second in self._reported or (before is not None and second >= before):
+                continue
+
+            self._reported.add(second)
+            total = self.timeline.seconds[second].total()
+            log.info("%s: %s samples, %s failed, avg %d ms", time.strftime("%H:%M:%S", time.localtime(second)),
+                     total.count, total.failures, int(1000 * total.elapsed_avg()))
+
+
+def get_controller_params(parser, opts, args):
+    if opts.search_step:  # agents would run their pools endlessly, nobody evaluates the plateaus
+        parser.error("Capacity search isn't supported in distributed mode")
+    for name in LOCAL_OPTIONS:
+        if getattr(opts, name) != parser.defaults[name]:
+            parser.error("--%s isn't supported in distributed mode" % name.replace("_", "-"))
+    return options_to_params(parser, opts, args)
+
+
+def main():
+    parser = get_option_parser()
+    parser.add_option('', '--agent', action='store', type="str", default=None,
+                      help="run as agent listening on [host]:port, host is 127.0.0.1 by default, "
+                           "anyone who can connect runs any code on the agent")
+    parser.add_option('', '--agents', action='store', type="str", default=None,
+                      help="run as controller of comma separated host:port agents")
+    parser.add_option('', '--bundle', action='append', default=[],
+                      help="file or directory which tests need on agents, may be repeated")
+    opts, args = parser.parse_args()
+
+    if opts.version:
+        print(VERSION)
+        sys.exit(0)
+
+    if opts.agent:
+        params = Params()
+        params.verbose = opts.verbose
+        setup_logging(params)
+        agent = Agent(parse_address(opts.agent), opts.result_file_template)  # only local by default
+        agent.serve_forever()
+    elif opts.agents:
+        params = get_controller_params(parser, opts, args)
+        setup_logging(params)
+        profile = None
+        if opts.profile:
+            with open(opts.profile) as fds:
+                profile = json.load(fds)
+
+        agents = [parse_address(address) for address in opts.agents.split(",")]
+        controller = Controller(params, agents, opts.workers, profile, opts.bundle)
+        controller.run()
+    else:
+        parser.error("Either --agent or --agents is required")
+
+
+if __name__ == '__main__':
+    main()
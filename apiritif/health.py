@@ -0,0 +1,177 @@
+"""
+Self-overhead of apiritif-loadgen worker: is it the server or the generator which is slow?
+
+Copyright 2022 BlazeMeter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import json
+import threading
+import time
+from threading import Thread
+
+from apiritif.utils import log
+
+INTERVAL = 1.0  # seconds between health records
+PROBE = 0.01  # sleep of GIL probe, the longer it oversleeps the longer threads wait for GIL
+LIGHT_PROBES = 5  # probes per interval when nobody records them, each one sleeps its part of the interval
+
+LAG_THRESHOLD = 0.1  # seconds of average scheduler lag
+GIL_THRESHOLD = 0.05  # seconds of average probe oversleep
+QUEUE_THRESHOLD = 1000  # samples waiting for writer
+CPU_THRESHOLD = 0.9  # share of one core used by the process, Python code can't get much more because of GIL
+
+monitor = None  # HealthMonitor of current worker process
+
+
+def record_lag(lag):
+    """
+    How late iteration has started against its schedule (pacing or arrival rate)
+    """
+    if monitor is not None:
+        monitor.add_lag(lag)
+
+
+def record_test_cpu(since):
+    """
+    CPU time of current thread spent in test code since given time.thread_time() mark
+    """
+    if monitor is not None:
+        monitor.add_test_cpu(time.thread_time() - since)
+
+
+def get_heat(record):
+    """
+    CPU load and scheduler lag against their thresholds, 1.0 and more means the process is saturated
+    """
+    heat = (record["cpu_load"] or 0.0) / CPU_THRESHOLD
+    if record["lag_avg"] is not None:
+        heat = max(heat, record["lag_avg"] / LAG_THRESHOLD)
+    return round(heat, 3)
+
+
+class HealthMonitor(Thread):
+    """
+    Periodically measures overhead of the worker process itself and warns when the generator is saturated:
+      * scheduler lag - intended vs actual iteration start
+      * GIL wait - how much a sleep of the monitor thread is overslept (short sleeps all the interval
+        for health report, a few longer ones otherwise, so the monitor doesn't add the overhead it measures)
+      * queue depth - samples waiting for writer thread
+      * CPU time of the process split between test code and the framework (runner, writer, scheduling)
+
+    Records are appended to JSON lines file, if given. Heat of the process is published in ControlBlock
+    for Balancer of the supervisor.
+    """
+
+    def __init__(self, writer, worker_index=0, filename=None, interval=INTERVAL, control=None):
+        """
+        :type writer: apiritif.loadgen.LDJSONSampleWriter
+        :type control: apiritif.control.ControlBlock
+        """
+        super(HealthMonitor, self).__init__(name=self.__class__.__name__)
+        self.daemon = True
+        self.writer = writer
+        self.worker_index = worker_index
+        self.filename = filename
+        self.interval = interval
+        self.control = control
+        self.saturated = False  # was it saturated at least once
+        self._saturated_now = False  # warning is logged when it becomes saturated, not every interval
+
+        self._lags = []
+        self._test_cpu = 0.0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def add_lag(self, lag):
+        with self._lock:
+            self._lags.append(lag)
+
+    def add_test_cpu(self, seconds):
+        with self._lock:
+            self._test_cpu += seconds
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def run(self):
+        fds = open(self.filename, "w") if self.filename else None
+        try:
+            while not self._stopped.is_set():
+                record = self._measure()
+                if fds:
+                    fds.write(json.dumps(record) + "\n")
+                    fds.flush()
+        finally:
+            if fds:
+                fds.close()
+
+    def _measure(self):
+        start_time = time.time()
+        start_cpu = time.process_time()
+        waits = []
+        end_time = start_time + self.interval
+        probe = PROBE if self.filename else self.interval / LIGHT_PROBES
+        while time.time() < end_time and not self._stopped.is_set():
+            sleep = min(probe, max(end_time - time.time(), PROBE))
+            before = time.perf_counter()
+            time.sleep(sleep)
+            waits.append(time.perf_counter() - before - sleep)
+
+        elapsed = time.time() - start_time
+        process_cpu = time.process_time() - start_cpu
+        with self._lock:
+            lags, self._lags = self._lags, []
+            test_cpu, self._test_cpu = self._test_cpu, 0.0
+
+        record = {
+            "timestamp": round(start_time, 3),
+            "worker": self.worker_index,
+            "vus": self.writer.vus.worker(self.worker_index) if self.writer.vus else None,
+            "iterations": len(lags) or None,
+            "lag_avg": round(sum(lags) / len(lags), 6) if lags else None,
+            "lag_max": round(max(lags), 6) if lags else None,
+            "gil_wait_avg": round(sum(waits) / len(waits), 6) if waits else None,
+            "gil_wait_max": round(max(waits), 6) if waits else None,
+            "queue_depth": self.writer.queue_size(),
+            "cpu_load": round(process_cpu / elapsed, 3) if elapsed else None,
+            "test_cpu": round(test_cpu, 6),
+            "framework_cpu": round(max(process_cpu - test_cpu, 0.0), 6)}
+        record["heat"] = get_heat(record)
+        record["saturated"] = self._check(record)
+        if self.control is not None:
+            self.control.set_heat(self.worker_index, record["heat"])
+        return record
+
+    def _check(self, record):
+        reasons = []
+        if record["lag_avg"] is not None and record["lag_avg"] > LAG_THRESHOLD:
+            reasons.append("iterations start %d ms late" % (1000 * record["lag_avg"]))
+        if record["gil_wait_avg"] is not None and record["gil_wait_avg"] > GIL_THRESHOLD:
+            reasons.append("threads wait %d ms for GIL" % (1000 * record["gil_wait_avg"]))
+        if record["queue_depth"] is not None and record["queue_depth"] > QUEUE_THRESHOLD:
+            reasons.append("%s samples wait for writer" % record["queue_depth"])
+        if record["cpu_load"] is not None and record["cpu_load"] > CPU_THRESHOLD:
+            reasons.append("process uses %d%% of CPU core" % (100 * record["cpu_load"]))
+
+        if reasons and not self._saturated_now:
+            log.warning("Load generator is saturated (worker #%s): %s, response times are affected by apiritif "
+                        "itself, use more workers or less VUs", self.worker_index, "; ".join(reasons))
+        elif reasons:
+            log.debug("Load generator is still saturated (worker #%s): %s", self.worker_index, "; ".join(reasons))
+        elif self._saturated_now:
+            log.info("Load generator isn't saturated any more (worker #%s)", self.worker_index)
+        self._saturated_now = bool(reasons)
+        self.saturated = self.saturated or self._saturated_now
+        return reasons
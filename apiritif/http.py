@@ -17,7 +17,6 @@ limitations under the License.
 """
 import copy
 import os
-import threading
 import time
 from functools import wraps
 from io import BytesIO
@@ -30,10 +29,10 @@ from requests.structures import CaseInsensitiveDict
 
 import apiritif
 from apiritif.ssl_adapter import SSLAdapter
-from apiritif.thread import get_from_thread_store, put_into_thread_store
+from apiritif.thread import VULocal, get_from_thread_store, put_into_thread_store
 from apiritif.utilities import *
-from apiritif.utils import (NormalShutdown, assert_not_regexp, assert_regexp,
-                            get_trace, graceful, headers_as_text, log)
+from apiritif.utils import (DeadlineExceeded, NormalShutdown, assert_not_regexp, assert_regexp, check_deadline,
+                            get_trace, graceful, headers_as_text, log, time_left)
 
 BODY_LIMIT = int(os.environ.get("APIRITIF_TRACE_BODY_EXCLIMIT", "1024"))
 
@@ -96,6 +95,8 @@ class HTTP(object):
         http.log.debug(
             msg, params, headers, cookies, data, json, files, allow_redirects, timeout
         )
+        check_deadline()
+        timeout = _limit_timeout(timeout)
 
         if headers is None:
             headers = {}
@@ -153,6 +154,7 @@ class HTTP(object):
             recorder.record_http_request_failure(
                 method, address, prepared, exc, session
             )
+            check_deadline()  # timeout might be cut by deadline
             raise TimeoutError("Connection to %s timed out" % address)
         except requests.exceptions.ConnectionError as exc:
             recorder.record_http_request_failure(
@@ -235,6 +237,7 @@ class HTTP(object):
         http.log.debug(
             msg, params, headers, cookies, data, json, files, allow_redirects, timeout
         )
+        check_deadline()
 
         if headers is None:
             headers = {}
@@ -348,6 +351,21 @@ class HTTP(object):
 http = HTTP()
 
 
+def _limit_timeout(timeout):
+    """
+    Request mustn't outlive test deadline
+    """
+    left = time_left()
+    if left is None:
+        return timeout
+    left = max(left, 0.001)
+    if isinstance(timeout, tuple):  # (connect, read)
+        return tuple(left if part is None else min(part, left) for part in timeout)
+    if timeout is None or timeout > left:
+        return left
+    return timeout
+
+
 class transaction(object):
     def __init__(self, name):
         self.name = name
@@ -361,6 +379,7 @@ class transaction(object):
         self._extras = {}
 
     def __enter__(self):
+        check_deadline()
         self.start()
         return self
 
@@ -458,7 +477,10 @@ class smart_transaction(transaction_logged):
         if exc_type:
             message = str(exc_val)
             exc = exc_type, exc_val, exc_tb
-            if isinstance(exc_val, AssertionError):
+            if isinstance(exc_val, DeadlineExceeded):
+                status = "interrupted"
+                self.controller.reportError(exc)
+            elif isinstance(exc_val, AssertionError):
                 status = "failed"
                 self.controller.addFailure(exc, is_transaction=True)
             else:
@@ -484,6 +506,8 @@ class smart_transaction(transaction_logged):
         elif graceful():  # and stage in ("setup", "main")
             raise NormalShutdown("graceful!")
 
+        if isinstance(exc_val, DeadlineExceeded):
+            return False  # the rest of iteration mustn't run
         return not self.func_mode  # don't reraise in load mode
 
 
@@ -587,7 +611,7 @@ class AssertionFailure(Event):
 
 
 class _EventRecorder(object):
-    local = threading.local()
+    local = VULocal()
 
     def __init__(self):
         self.log = log.getChild("recorder")
@@ -0,0 +1,117 @@
+"""
+CPU affinity, niceness and memory cap of apiritif-loadgen worker processes
+
+Copyright 2022 BlazeMeter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+
+from apiritif.utils import log
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+AUTO = "auto"
+
+
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def parse_cpus(spec):
+    """
+    'auto' (CPUs available for the process) or list like '0-3,6,8-9' to sorted list of CPU numbers
+    """
+    if spec == AUTO:
+        return available_cpus()
+
+    cpus = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if "-" in part:
+                first, last = part.split("-")
+                cpus.update(range(int(first), int(last) + 1))
+            else:
+                cpus.add(int(part))
+        except ValueError:
+            raise ValueError("Wrong CPU list: %s" % spec)
+
+    if not cpus:
+        raise ValueError("Wrong CPU list: %s" % spec)
+    return sorted(cpus)
+
+
+def split_cpus(cpus, worker_count, exclude=None):
+    """
+    Give every worker its own CPUs (equal contiguous chunks), or share them round robin if there are less CPUs
+
+    :param exclude: CPU reserved for something else (e.g. result writers)
+    :return: list of CPU lists, one per worker
+    """
+    cpus = [cpu for cpu in cpus if cpu != exclude] or list(cpus)
+    if len(cpus) < worker_count:
+        return [[cpus[idx % len(cpus)]] for idx in range(worker_count)]
+
+    chunks = []
+    for idx in range(worker_count):
+        start = idx * len(cpus) // worker_count
+        end = (idx + 1) * len(cpus) // worker_count
+        chunks.append(cpus[start:end])
+    return chunks
+
+
+def pin(cpus):
+    """
+    Bind calling thread (and threads it starts later) to given CPUs, if OS supports it
+    """
+    if not hasattr(os, "sched_setaffinity"):
+        log.warning("CPU affinity isn't supported on this platform, ignoring it")
+        return False
+
+    try:
+        os.sched_setaffinity(0, cpus)
+    except OSError as exc:
+        log.warning("Can't bind to CPUs %s: %s", cpus, exc)
+        return False
+    return True
+
+
+def isolate_process(cpus=None, nice=0, memory_limit=0):
+    """
+    Apply limits to current worker process, has to be called before it starts threads
+
+    :param cpus: list of CPUs or None
+    :param nice: niceness increment
+    :param memory_limit: max address space in megabytes, 0 means no limit
+    """
+    if cpus:
+        if pin(cpus):
+            log.debug("Worker process %s is bound to CPUs %s", os.getpid(), cpus)
+
+    if nice:
+        os.nice(nice)
+
+    if memory_limit:
+        if resource is None:
+            log.warning("Memory limit isn't supported on this platform, ignoring it")
+        else:
+            limit = int(memory_limit * 1024 * 1024)
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
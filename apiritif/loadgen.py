@@ -14,33 +14,82 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+import asyncio
+import collections
 import copy
+import functools
+import io
 import unicodecsv as csv
 import json
 import logging
+import math
 import multiprocessing
 import os
+import queue
+import signal
 import sys
+import threading
 import time
 import traceback
+import unittest
 from multiprocessing.pool import ThreadPool
 from optparse import OptionParser
-from threading import Thread
+from threading import Event, Thread
 
 from nose2.main import PluggableTestProgram
 from nose2.events import Plugin
 
 import apiritif
+import apiritif.columnar as columnar
+import apiritif.compression as compression
+import apiritif.health as health
+import apiritif.isolation as isolation
 import apiritif.thread as thread
 import apiritif.store as store
 from apiritif.action_plugins import ActionHandlerFactory, import_plugins
-from apiritif.utils import NormalShutdown, log, get_trace, VERSION, graceful
+from apiritif.capacity import CapacitySearch
+from apiritif.health import HealthMonitor
+from apiritif.metrics import LiveMetrics, MetricsServer
+from apiritif.control import Balancer, ControlBlock, ControlServer, ProfileDriver, VUCounters, apply_level
+from apiritif.control import split_int, split_float
+from apiritif.runner import AsyncRunner, DirectRunner, EXECUTORS, ASYNCIO, DIRECT, NOSE2
+from apiritif.schedule import ArrivalSchedule, LoadProfile, Pacer, DISTRIBUTIONS, CONSTANT, CONCURRENCY, RATE, TICK
+from apiritif.schedule import Scenario, mix_scenarios, sleep_until, sleep_async
+from apiritif.stats import Summary, Timeline
+from apiritif.utils import NormalShutdown, log, VERSION, graceful, wait_shutdown, handle_signals, GracefulWatcher
+from apiritif.utils import request_shutdown, DeadlineExceeded, set_deadline
 
 
-# TODO how to implement hits/s control/shape?
 # TODO: VU ID for script
 # TODO: disable assertions for load mode
 
+shared_control = None  # ControlBlock of the supervisor, inherited by worker processes
+shared_stats = None  # queue for per-second summaries of workers, if somebody listens to them live
+STATS_DELAY = 2  # seconds to wait for samples of long iterations before reporting the second
+ABANDON_DELAY = 1  # seconds after deadline to wait for VUs which don't reach interruption points
+KILL_DELAY = 10  # seconds after deadline to wait for worker processes before terminating them
+FLUSH_INTERVAL = 1.0  # seconds, the longest delay of result file data for tools which tail it
+BUFFER_SIZE = 64  # KB of encoded samples kept in memory between writes to result file
+BATCH_SIZE = 1000  # max samples taken by writer thread at once
+
+
+def init_worker(control, stats_queue=None, workdir=None, shutdown=None):
+    """
+    Pool initializer, the only way to pass shared memory into worker processes
+
+    :type control: ControlBlock
+    :type stats_queue: multiprocessing.Queue
+    :type shutdown: multiprocessing.Event
+    """
+    global shared_control, shared_stats
+    shared_control = control
+    shared_stats = stats_queue
+    if workdir:
+        os.chdir(workdir)
+    if shutdown is not None:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C is supervisor's business
+        GracefulWatcher(shutdown).start()  # lives as long as the process
+
 
 def spawn_worker(params):
     """
@@ -49,11 +98,32 @@ def spawn_worker(params):
     :type params: Params
     """
     setup_logging(params)
+    isolation.isolate_process(params.cpus, params.nice, params.memory_limit)
     log.info("Adding worker: idx=%s\tconcurrency=%s\tresults=%s", params.worker_index, params.concurrency,
              params.report)
-    worker = Worker(params)
-    worker.start()
+    try:
+        worker = Worker(params)
+        worker.start()
+    except Exception as exc:
+        failures = (exc, exc.__context__)  # thread pool may fail once more while cleaning up after it
+        if params.memory_limit and any("can't start new thread" in str(failure) for failure in failures):
+            log.error("Worker #%s can't start its threads within --memory-limit %s MB: it limits address space "
+                      "and every VU thread reserves its stack there (about 8 MB), raise the limit or use more workers",
+                      params.worker_index, params.memory_limit)
+        raise
     worker.join()
+    return worker.summary
+
+
+def get_report_name(template, worker_index, worker_count):
+    if "%s" in template:
+        return template % worker_index
+    elif worker_count > 1:  # every process needs its own file
+        name = compression.strip_extension(template)  # result.ldjson.gz -> result-1.ldjson.gz, format is kept
+        name, ext = os.path.splitext(name)
+        return "%s-%s%s%s" % (name, worker_index, ext, template[len(name) + len(ext):])
+    else:
+        return template
 
 
 class Params(object):
@@ -67,14 +137,76 @@ class Params(object):
         self.delay = 0
 
         self.concurrency = 1
+        self.target_concurrency = None  # active VUs at start if pool is bigger (room for runtime changes)
         self.iterations = 1
         self.ramp_up = 0
         self.steps = 0
         self.hold_for = 0
+        self.warmup = 0  # seconds at the start when VUs run as usual but their samples aren't reported
+        self.keep_warmup = False  # write warm-up samples tagged instead of dropping them
+
+        self.rate = 0  # target iterations per second, enables open model (concurrency is VU pool size then)
+        self.arrivals = CONSTANT
+        self.pacing = 0  # seconds between iteration starts of every VU in closed model
+        self.throughput = 0  # target iterations per second of closed model, spread across active VUs
+        self.profile = None  # LoadProfile, replaces ramp_up/steps/hold_for
+        self.deadline_grace = 0  # seconds to let iterations finish after planned duration before interrupting
+        self.reuse_suite = False  # build test suite once per VU instead of every iteration
+        self.executor = NOSE2  # direct: run tests without nose2, asyncio: VUs are tasks running coroutine tests
 
         self.verbose = False
+        self.workdir = None  # current dir of worker processes, e.g. unpacked tests of distributed agent
+        self.cpus = None  # CPUs for worker processes (supervisor splits them), None means no pinning
+        self.writer_cpu = None  # CPU dedicated to result writer threads of all workers
+        self.nice = 0  # niceness increment of worker processes
+        self.memory_limit = 0  # max address space (not memory use) of every worker process in MB, 0 means no limit
+        self.rebalance = False  # move VUs (or rate) from saturated worker processes to cold ones
+        self.flush_interval = FLUSH_INTERVAL
+        self.buffer_size = BUFFER_SIZE
+        self.result_blobs = False  # bodies and the rest of extras in binary result file
+        self.aggregate = 0  # seconds of time buckets written instead of samples, 0 means samples are written
+        self.failures_report = None  # JSON lines file for failed samples when results are aggregated
+        self.control_port = 0  # local TCP port for runtime commands, 0 means disabled
+        self.search_step = 0  # capacity search: level increment, 0 means the search is off
+        self.search_max = 0  # the highest level to try, 0 means VU pool size (concurrency) or unlimited (rate)
+        self.search_plateau = 60  # seconds of every level
+        self.search_settle = 10  # seconds of plateau which aren't measured
+        self.search_report = None  # JSON file for capacity curve
+        self.sla_p95 = 0  # max p95 latency in ms for capacity search, 0 means no limit
+        self.sla_errors = 0  # max percent of failed samples for capacity search, 0 means no limit
+        self.metrics_port = 0  # local HTTP port for live metrics, 0 means disabled
+        self.health_report = None  # JSON lines file for self-overhead records of worker
 
         self.tests = None
+        self.scenarios = []  # weighted mix of tests, empty means every test file is a scenario of equal weight
+        self.scenario = 0  # index of VU scenario
+
+    def get_scenarios(self):
+        return self.scenarios or [Scenario(test) for test in self.tests or []]
+
+    def is_open_model(self):
+        return bool(self.rate) or (self.profile is not None and self.profile.target == RATE)
+
+    def duration(self):
+        """
+        Planned length of the test, 0 means it's limited by iterations or stopped from outside.
+        Warm-up makes ramp-up and hold-for longer (their samples are measured after it), profile includes it.
+        """
+        if self.profile:
+            return self.profile.duration()
+        ramp_up = max([self.ramp_up] + [scenario.ramp_up for scenario in self.scenarios if scenario.ramp_up])
+        duration = ramp_up + self.hold_for
+        return duration + self.warmup if duration else 0
+
+    def deadline(self, start_time):
+        """
+        :return: timestamp when in-flight iterations are interrupted or None
+        """
+        duration = self.duration()
+        return start_time + duration + self.deadline_grace if duration else None
+
+    def active_concurrency(self):
+        return self.concurrency if self.target_concurrency is None else min(self.target_concurrency, self.concurrency)
 
     def __repr__(self):
         return "%s" % self.__dict__
@@ -88,31 +220,62 @@ class Supervisor(Thread):
     :type params: Params
     """
 
-    def __init__(self, params):
+    def __init__(self, params, stats_queue=None):
         super(Supervisor, self).__init__(target=self._start_workers)
         self.daemon = True
         self.name = self.__class__.__name__
 
         self.params = params
+        self.stats_queue = stats_queue
         self.workers = None
+        self.control = None
+        self.summary = None
+        self.capacities = []
+        self.weights = []  # shares of workers in levels set by drivers and commands, Balancer changes them
+        self.start_time = None
+        self.driver = None
+        self.balancer = None
+        self.control_server = None
+        self.metrics = None
+        self.metrics_server = None
 
     def _concurrency_slicer(self, ):
         total_concurrency = 0
         inc = self.params.concurrency / float(self.params.worker_count)
         assert inc >= 1
-        for idx in range(0, self.params.worker_count):
-            progress = (idx + 1) * inc
 
-            conc = int(round(progress - total_concurrency))
+        concurrencies = split_int(self.params.concurrency, [1] * self.params.worker_count)
+        rates = split_float(self.params.rate, concurrencies)
+        throughputs = split_float(self.params.throughput, concurrencies)
+        iterations = [self.params.iterations] * self.params.worker_count
+        if self.params.is_open_model() and self.params.iterations < sys.maxsize:
+            iterations = split_int(self.params.iterations, concurrencies)  # total number of arrivals in rate mode
+        targets = [None] * self.params.worker_count
+        if self.params.target_concurrency is not None:
+            targets = split_int(self.params.active_concurrency(), concurrencies)
+        cpus = [None] * self.params.worker_count
+        if self.params.cpus:
+            cpus = isolation.split_cpus(self.params.cpus, self.params.worker_count, self.params.writer_cpu)
+
+        for idx, conc in enumerate(concurrencies):
             assert conc > 0
 
             log.debug("Idx: %s, concurrency: %s", idx, conc)
 
             params = copy.deepcopy(self.params)
             params.worker_index = idx
-            params.thread_index = total_concurrency  # for subprocess it's index of its first thread
+            params.thread_index = self.params.thread_index + total_concurrency  # index of its first thread
             params.concurrency = conc
-            params.report = self.params.report % idx
+            params.target_concurrency = targets[idx]
+            params.rate = rates[idx]
+            params.throughput = throughputs[idx]
+            params.iterations = iterations[idx]
+            params.cpus = cpus[idx]
+            params.report = get_report_name(self.params.report, idx, self.params.worker_count)
+            if self.params.health_report:
+                params.health_report = get_report_name(self.params.health_report, idx, self.params.worker_count)
+            if self.params.failures_report:
+                params.failures_report = get_report_name(self.params.failures_report, idx, self.params.worker_count)
             params.worker_count = self.params.worker_count
 
             total_concurrency += conc
@@ -125,15 +288,170 @@ class Supervisor(Thread):
         log.info("Total workers: %s", self.params.worker_count)
 
         thread.set_total(self.params.concurrency)
-        self.workers = multiprocessing.Pool(processes=self.params.worker_count)
         args = list(self._concurrency_slicer())
 
+        self.control = ControlBlock(self.params.worker_count, max(len(self.params.get_scenarios()), 1))
+        self.capacities = [params.concurrency for params in args]
+        self.weights = list(self.capacities)
+        for params in args:
+            self.control.set_concurrency(params.worker_index, params.active_concurrency())
+            self.control.set_rate(params.worker_index, params.rate)
+
+        if self.params.profile:
+            self.driver = ProfileDriver(self.params.profile, self.control, self.capacities, self.weights)
+            self.driver.tick()
+        elif self.params.search_step:
+            self.driver = self._get_capacity_search()
+            self.driver.tick()
+
+        if self.params.rebalance and self.params.worker_count > 1:
+            target = RATE if self.params.is_open_model() else CONCURRENCY
+            self.balancer = Balancer(self.control, self.capacities, target, self.weights)
+
+        if self.params.control_port:
+            self.control_server = ControlServer(("127.0.0.1", self.params.control_port), self.handle_command)
+            self.control_server.start()
+            log.info("Control channel is listening on %s:%s", *self.control_server.address)
+
+        stats_queue = self.stats_queue
+        consumer = None
+        consumed = Event()
+        if self.params.metrics_port:
+            self.metrics = LiveMetrics()
+            self.metrics_server = MetricsServer(("127.0.0.1", self.params.metrics_port), self.metrics)
+            self.metrics_server.start()
+            log.info("Live metrics are served on http://%s:%s/", *self.metrics_server.address)
+        if self.metrics or isinstance(self.driver, CapacitySearch):
+            stats_queue = multiprocessing.Queue()  # workers -> live metrics and search -> outer listener if any
+            consumer = Thread(target=self._consume_stats, args=(stats_queue, consumed), name="StatsConsumer")
+            consumer.daemon = True
+            consumer.start()
+
+        self.start_time = time.time()
+        shutdown = multiprocessing.Event()
+        self.workers = multiprocessing.Pool(processes=self.params.worker_count, initializer=init_worker,
+                                            initargs=(self.control, stats_queue, self.params.workdir, shutdown))
+        deadline = self.params.deadline(self.start_time)
         try:
-            self.workers.map(spawn_worker, args)
+            with GracefulWatcher():
+                result = self.workers.map_async(spawn_worker, args)
+                while not result.ready():
+                    if graceful():
+                        shutdown.set()
+                    else:
+                        if self.driver:
+                            self.driver.tick()
+                        if self.balancer:
+                            self.balancer.tick()
+                    if deadline and time.time() > deadline + KILL_DELAY:
+                        break
+                    result.wait(TICK)
+
+            if result.ready():
+                self._report_summary(result.get())
+            else:  # workers didn't manage to stop even without waiting for their VUs
+                log.error("Workers are still running %ss after deadline, terminating them", KILL_DELAY)
+                self.workers.terminate()
+                self._report_summary([])
         finally:
+            if self.control_server:
+                self.control_server.close()
             self.workers.close()
             self.workers.join()
-        # TODO: watch the total test duration, if set, 'cause iteration might last very long
+            if consumer:
+                consumed.set()
+                consumer.join()
+            if self.metrics_server:
+                self.metrics_server.close()
+
+    def _consume_stats(self, source, consumed):
+        """
+        Feed live metrics with per-second summaries of workers until they are over and the queue is empty
+        """
+        while True:
+            try:
+                second, summary = source.get(timeout=TICK)
+            except queue.Empty:
+                if consumed.is_set():
+                    break
+                continue
+
+            if self.metrics:
+                self.metrics.add(second, summary)
+            if isinstance(self.driver, CapacitySearch):
+                self.driver.add(second, summary)
+            if self.stats_queue is not None:
+                self.stats_queue.put((second, summary))
+
+    def handle_command(self, command, args):
+        """
+        Runtime commands: vus N, rate N, pause, resume, status, stop
+        """
+        if command == "status":
+            return self.get_status()
+        elif command == "stop":
+            request_shutdown("stopped by control command")
+        elif command == "pause":
+            self.control.set_paused(True)
+            log.info("Load is paused")
+        elif command == "resume":
+            self.control.set_paused(False)
+            log.info("Load is resumed")
+        elif command in ("vus", "rate"):
+            if len(args) != 1:
+                raise ValueError("Usage: %s <number>" % command)
+            if self.driver:
+                raise ValueError("Targets are driven by load profile or capacity search")
+
+            if command == "vus":
+                vus = min(int(args[0]), sum(self.capacities))
+                if vus < 0:
+                    raise ValueError("Number of VUs can't be negative")
+                apply_level(self.control, CONCURRENCY, vus, self.capacities, self.weights)
+                log.info("Target concurrency is changed to %s", vus)
+            else:
+                if not self.params.is_open_model():
+                    raise ValueError("Rate can be changed only in rate mode")
+                rate = float(args[0])
+                if rate < 0:
+                    raise ValueError("Rate can't be negative")
+                apply_level(self.control, RATE, rate, self.capacities, self.weights)
+                log.info("Target rate is changed to %s", rate)
+        else:
+            raise ValueError("Unknown command: %s" % command)
+
+        return self.get_status()
+
+    def _get_capacity_search(self):
+        target = RATE if self.params.is_open_model() else CONCURRENCY
+        start = self.params.rate if target == RATE else self.params.active_concurrency()
+        return CapacitySearch(
+            self.control, self.capacities, target=target, start=start, step=self.params.search_step,
+            max_level=self.params.search_max or (None if target == CONCURRENCY else float("inf")),
+            plateau=self.params.search_plateau, settle=self.params.search_settle,
+            sla_p95=self.params.sla_p95, sla_errors=self.params.sla_errors, report=self.params.search_report,
+            weights=self.weights)
+
+    def get_status(self):
+        workers = range(self.control.worker_count)
+        return {
+            "elapsed": None if self.start_time is None else round(time.time() - self.start_time, 3),  # not started
+            "workers": self.control.worker_count,
+            "max_vus": sum(self.capacities),
+            "target_vus": sum(self.control.concurrency(idx) for idx in workers),
+            "active_vus": sum(self.control.active(idx) for idx in workers),
+            "target_rate": sum(self.control.rate(idx) for idx in workers) if self.params.is_open_model() else None,
+            "heat": [self.control.heat(idx) for idx in workers],
+            "paused": self.control.is_paused(),
+            "stopping": graceful()}
+
+    def _report_summary(self, worker_summaries):
+        self.summary = Summary()
+        for summary in worker_summaries:
+            if summary is not None:
+                self.summary.merge(summary)
+
+        log.info("Summary of %s worker(s):\n%s", self.params.worker_count, "\n".join(self.summary.report()))
 
 
 class ApiritifSession(PluggableTestProgram.sessionClass):
@@ -147,33 +465,189 @@ class ApiritifSession(PluggableTestProgram.sessionClass):
 
 
 class Worker(ThreadPool):
+    control = None
+    vus = None  # VUCounters, shared with supervisor and other workers if there are any
+    schedules = ()
+    scenarios = ()
+    pacer = None
+    summary = None
+    stats_queue = None
+    _driver = None
+    _abandoned = False  # some VUs ignored the deadline, their threads are left behind
+
     def __init__(self, params):
         """
         :type params: Params
         """
-        super(Worker, self).__init__(params.concurrency)
+        super(Worker, self).__init__(1 if params.executor == ASYNCIO else params.concurrency)
         self.params = params
-        if self.params.report.lower().endswith(".ldjson"):
+        report_format = compression.strip_extension(self.params.report).lower()  # result-0.ldjson.gz is LDJSON
+        if self.params.aggregate:
+            store.writer = AggregatingSampleWriter(self.params.report, self.params.aggregate,
+                                                   self.params.failures_report)
+        elif report_format.endswith(".ldjson"):
             store.writer = LDJSONSampleWriter(self.params.report)
+        elif report_format.endswith(columnar.EXTENSION):
+            store.writer = ColumnarSampleWriter(self.params.report, self.params.result_blobs)
         else:
             store.writer = JTLSampleWriter(self.params.report)
 
+        self.scenarios = self.params.get_scenarios()
+        scenario_count = max(len(self.scenarios), 1)
+        self.control = shared_control
+        self.stats_queue = shared_stats
+        if self.control is None and (self.params.profile or self.params.target_concurrency is not None):
+            self.control = ControlBlock(self.params.worker_count, scenario_count)  # standalone worker controls itself
+            self.control.set_concurrency(self.params.worker_index, self.params.active_concurrency())
+            self.control.set_rate(self.params.worker_index, self.params.rate)
+            if self.params.profile:
+                capacities = [0] * self.params.worker_count
+                capacities[self.params.worker_index] = self.params.concurrency
+                self._driver = ProfileDriver(self.params.profile, self.control, capacities)
+
+        self.vus = self.control.vus if self.control else VUCounters(self.params.worker_count, scenario_count)
+        store.writer.vus = self.vus
+
+        if self.params.is_open_model():
+            self.schedules = []  # every scenario has its share of the rate and its VUs serve it
+            weights = [scenario.weight for scenario in self.scenarios] or [1]
+            limit = self.params.iterations if self.params.iterations < sys.maxsize else 0
+            limits = split_int(limit, weights)
+            for idx, share in enumerate(split_float(1.0, weights)):
+                rate_source = None
+                if self.control:
+                    rate_source = functools.partial(self._get_target_rate, share=share)
+
+                self.schedules.append(ArrivalSchedule(
+                    rate=self.params.rate * share,
+                    distribution=self.params.arrivals,
+                    limit=limits[idx],
+                    duration=0 if self.params.profile else self.params.duration(),
+                    ramp_up=self._get_ramp_up(idx),
+                    steps=self.params.steps,
+                    rate_source=rate_source))
+        elif self.params.pacing or self.params.throughput:
+            self.pacer = Pacer(self.params.pacing, self.params.throughput,
+                               lambda: self.vus.worker(self.params.worker_index))
+
+    def _get_target_rate(self, timestamp, share=1.0):
+        if self.control.is_finished():
+            return None
+        if self.control.is_paused():
+            return 0
+        return self.control.rate(self.params.worker_index) * share
+
+    def _enter_scenario(self, params):
+        """
+        :return: arrival schedule of VU scenario or None
+        """
+        label = self.scenarios[params.scenario].label if len(self.scenarios) > 1 else None
+        thread.set_scenario(params.scenario, label)
+        return self.schedules[params.scenario] if self.schedules else None
+
+    def _get_ramp_up(self, scenario):
+        if self.scenarios and self.scenarios[scenario].ramp_up is not None:
+            return self.scenarios[scenario].ramp_up
+        return self.params.ramp_up
+
+    def _is_active(self, local_index):
+        """
+        VUs above the concurrency target are retired until the target grows up, all of them wait during pause
+        """
+        if not self.control:
+            return True
+        return local_index < self.control.concurrency(self.params.worker_index) and not self.control.is_paused()
+
+    def _set_vu_active(self, active):
+        if self.vus is not None:
+            self.vus.add(self.params.worker_index, 1 if active else -1, thread.get_scenario())
+
+    def _drive_profile(self):
+        while not self.control.is_finished() and not wait_shutdown(TICK):
+            self._driver.tick()
+
+    def _report_stats(self, stopped):
+        while not stopped.wait(1):
+            self._push_stats(time.time() - STATS_DELAY)
+
+    def _push_stats(self, before=None):
+        for second, summary in store.writer.timeline.pop(before):
+            self.stats_queue.put((second, summary))
+
     def start(self):
         import_plugins()
         params = list(self._get_thread_params())
-        with store.writer:  # writer must be closed finally
-            try:
-                self.map(self.run_nose, params)
-            finally:
-                self.close()
+        if self._driver:
+            self._driver.tick()
+            driver_thread = Thread(target=self._drive_profile, name="ProfileDriver")
+            driver_thread.daemon = True
+            driver_thread.start()
+
+        reporter = None
+        stats_stopped = Event()
+        if self.stats_queue is not None:
+            store.writer.timeline = Timeline()
+            reporter = Thread(target=self._report_stats, args=(stats_stopped,), name="StatsReporter")
+            reporter.daemon = True
+            reporter.start()
+
+        watcher = GracefulWatcher()
+        if shared_control is None:  # standalone worker, otherwise supervisor watches the file
+            watcher.start()
+
+        store.writer.warmup_end = time.time() + self.params.warmup
+        store.writer.keep_warmup = self.params.keep_warmup
+        store.writer.cpu = self.params.writer_cpu
+        store.writer.flush_interval = self.params.flush_interval
+        store.writer.buffer_size = self.params.buffer_size
+        health.monitor = HealthMonitor(store.writer, self.params.worker_index, self.params.health_report,
+                                       control=self.control)
+        health.monitor.start()
+
+        deadline = self.params.deadline(time.time())
+        set_deadline(deadline)
+        try:
+            with store.writer:  # writer must be closed finally
+                try:
+                    if self.params.executor == ASYNCIO:
+                        asyncio.run(self._run_async(params, deadline))
+                    else:
+                        self._run_threads(params, deadline)
+                finally:
+                    self.close()
+                    self.summary = store.writer.summary
+        finally:
+            set_deadline(None)
+            health.monitor.stop()
+            health.monitor = None
+            if watcher.is_alive():
+                watcher.stop()
+            if reporter:
+                stats_stopped.set()
+                reporter.join()
+                self._push_stats()  # the rest of seconds, writer thread is over already
+
+    def _run_threads(self, params_list, deadline):
+        result = self.map_async(self.run_nose, params_list)
+        if deadline is not None:
+            result.wait(max(deadline + ABANDON_DELAY - time.time(), 0))
+            if not result.ready():
+                log.warning("VUs are busy after deadline, abandoning them: %s", DeadlineExceeded.__name__)
+                self._abandoned = True  # threads are daemons, they die with the process
+                return
+
+        result.get()
 
     def close(self):
         log.info("Workers finished, awaiting result writer")
-        while not store.writer.is_queue_empty() and store.writer.is_alive():
-            time.sleep(0.1)
+        store.writer.wait_written()
         log.info("Results written, shutting down")
         super(Worker, self).close()
 
+    def join(self):
+        if not self._abandoned:
+            super(Worker, self).join()
+
     def run_nose(self, params):
         """
         :type params: Params
@@ -186,16 +660,20 @@ class Worker(ThreadPool):
         assert isinstance(params.tests, list)
         # argv.extend(['--with-apiritif', '--nocapture', '--exe', '--nologcapture'])
 
-        end_time = self.params.ramp_up + self.params.hold_for
+        end_time = self.params.duration() if not self.params.profile else 0
         end_time += time.time() if end_time else 0
-        time.sleep(params.delay)
-        store.writer.concurrency += 1
+        wait_shutdown(params.delay)
+        local_index = params.thread_index - self.params.thread_index
+        schedule = self._enter_scenario(params)
+        active = False
 
-        config = {"tests": params.tests}
+        config = {"tests": params.tests, "reuse_suite": params.reuse_suite}
         if params.verbose:
             config["verbosity"] = 3
 
         iteration = 0
+        start_time = None
+        program = None
         handlers = ActionHandlerFactory.create_all()
         log.debug(f'Action handlers created {handlers}')
         thread.put_into_thread_store(action_handlers=handlers)
@@ -203,39 +681,185 @@ class Worker(ThreadPool):
             handler.startup()
         try:
             while not graceful():
-                log.debug("Starting iteration:: index=%d,start_time=%.3f", iteration, time.time())
-                thread.set_iteration(iteration)
+                if self.control and self.control.is_finished():
+                    log.debug("[%s] load profile is over", params.worker_index)
+                    break
 
-                session = ApiritifSession()
-                config["session"] = session
-                ApiritifTestProgram(config=config)
+                if not self._is_active(local_index):
+                    if active:
+                        log.debug("[%s] VU #%s retired", params.worker_index, params.thread_index)
+                        self._set_vu_active(False)
+                        active = False
+                    if 0 < end_time <= time.time():
+                        break  # spare VU, the test is over
+                    wait_shutdown(TICK)
+                    continue
+
+                if not active:
+                    self._set_vu_active(True)
+                    active = True
+
+                scheduled_start = None
+                if schedule:
+                    scheduled_start = schedule.next_arrival()
+                    if scheduled_start is None:
+                        log.debug("[%s] arrival schedule is over: %s", params.worker_index, schedule.issued())
+                        break
+                    sleep_until(scheduled_start)
+                    if self.control and self.control.is_finished():
+                        break
+                elif self.pacer:
+                    scheduled_start = self.pacer.next_start(start_time)
+                    if 0 < end_time <= scheduled_start:
+                        break  # no time for one more iteration
+                    sleep_until(scheduled_start)
+                    if graceful():
+                        break
+
+                start_time = time.time()
+                log.debug("Starting iteration:: index=%d,start_time=%.3f", iteration, start_time)
+                thread.set_iteration(iteration)
+                thread.set_iteration_start(start_time, scheduled_start)
+                if scheduled_start is not None:
+                    health.record_lag(start_time - scheduled_start)
+
+                if params.executor == DIRECT:
+                    if program is None:
+                        program = DirectRunner(params.tests)  # discovers tests once, no nose2 machinery
+                        session = program.session
+                    program.run_iteration()
+                elif program is None or not params.reuse_suite:
+                    session = ApiritifSession()
+                    config["session"] = session
+                    program = ApiritifTestProgram(config=config)  # discovers and runs tests
+                else:
+                    program.runTests()  # same suite and plugins again, without loading and discovery
 
                 log.debug("Finishing iteration:: index=%d,end_time=%.3f", iteration, time.time())
                 iteration += 1
 
-                # reasons to stop
-                if session.stop_reason:
-                    if "Nothing to test." in session.stop_reason:
-                        raise RuntimeError("Nothing to test.")
-                    elif session.stop_reason.startswith(NormalShutdown.__name__):
-                        log.info(session.stop_reason)
-                    else:
-                        raise RuntimeError(f"Unknown stop_reason: {session.stop_reason}")
-                elif 0 < params.iterations <= iteration:
-                    log.debug("[%s] iteration limit reached: %s", params.worker_index, params.iterations)
-                elif 0 < end_time <= time.time():
-                    log.debug("[%s] duration limit reached: %s", params.worker_index, params.hold_for)
-                else:
-                    continue  # continue if no one is faced
+                if self._is_over(params, session, iteration, end_time):
+                    break
 
-                break
+        finally:
+            if active:
+                self._set_vu_active(False)
+
+            for handler in handlers:
+                handler.finalize()
+
+    async def _run_async(self, params_list, deadline=None):
+        vus = asyncio.gather(*[self.run_async_vu(params) for params in params_list])
+        timeout = None if deadline is None else max(deadline + ABANDON_DELAY - time.time(), 0)
+        try:
+            await asyncio.wait_for(vus, timeout)
+        except asyncio.TimeoutError:
+            log.warning("VUs are busy after deadline, cancelling them: %s", DeadlineExceeded.__name__)
+
+    async def run_async_vu(self, params):
+        """
+        The same as run_nose() but VU is asyncio task and tests are coroutines
+
+        :type params: Params
+        """
+        if not params.tests:
+            raise RuntimeError("Nothing to test.")
+
+        thread.init_vu_context()  # every task has its own copy of context
+        thread.set_index(params.thread_index)
+        log.debug("[%s] Starting asyncio iterations: %s", params.worker_index, params)
+
+        end_time = self.params.duration() if not self.params.profile else 0
+        end_time += time.time() if end_time else 0
+        await sleep_async(params.delay)
+        local_index = params.thread_index - self.params.thread_index
+        schedule = self._enter_scenario(params)
+        active = False
+
+        iteration = 0
+        start_time = None
+        handlers = ActionHandlerFactory.create_all()
+        thread.put_into_thread_store(action_handlers=handlers)
+        for handler in handlers:
+            handler.startup()
+        try:
+            runner = AsyncRunner(params.tests)
+            while not graceful():
+                if self.control and self.control.is_finished():
+                    log.debug("[%s] load profile is over", params.worker_index)
+                    break
+
+                if not self._is_active(local_index):
+                    if active:
+                        self._set_vu_active(False)
+                        active = False
+                    if 0 < end_time <= time.time():
+                        break  # spare VU, the test is over
+                    await sleep_async(TICK)
+                    continue
+
+                if not active:
+                    self._set_vu_active(True)
+                    active = True
+
+                scheduled_start = None
+                if schedule:
+                    scheduled_start = await schedule.next_arrival_async()
+                    if scheduled_start is None:
+                        break
+                    await sleep_async(scheduled_start - time.time())
+                    if self.control and self.control.is_finished():
+                        break
+                elif self.pacer:
+                    scheduled_start = self.pacer.next_start(start_time)
+                    if 0 < end_time <= scheduled_start:
+                        break
+                    await sleep_async(scheduled_start - time.time())
+                    if graceful():
+                        break
+
+                start_time = time.time()
+                thread.set_iteration(iteration)
+                thread.set_iteration_start(start_time, scheduled_start)
+                if scheduled_start is not None:
+                    health.record_lag(start_time - scheduled_start)
+                await runner.run_iteration()
+                iteration += 1
+
+                if self._is_over(params, runner.session, iteration, end_time):
+                    break
 
         finally:
-            store.writer.concurrency -= 1
+            if active:
+                self._set_vu_active(False)
 
             for handler in handlers:
                 handler.finalize()
 
+    def _is_over(self, params, session, iteration, end_time):
+        """
+        Reasons to stop VU after iteration
+        """
+        if session.stop_reason:
+            if "Nothing to test." in session.stop_reason:
+                raise RuntimeError("Nothing to test.")
+            elif session.stop_reason.startswith(NormalShutdown.__name__):
+                log.info(session.stop_reason)
+            elif session.stop_reason.startswith(DeadlineExceeded.__name__):
+                log.debug("[%s] %s", params.worker_index, session.stop_reason)
+            else:
+                raise RuntimeError(f"Unknown stop_reason: {session.stop_reason}")
+        elif self.schedules:
+            return False  # arrival schedule takes care of limits
+        elif 0 < params.iterations <= iteration:
+            log.debug("[%s] iteration limit reached: %s", params.worker_index, params.iterations)
+        elif 0 < end_time <= time.time():
+            log.debug("[%s] duration limit reached: %s", params.worker_index, params.hold_for)
+        else:
+            return False  # continue if no one is faced
+
+        return True
+
     def __reduce__(self):
         raise NotImplementedError()
 
@@ -243,15 +867,29 @@ class Worker(ThreadPool):
         if not self.params.steps or self.params.steps < 0:
             self.params.steps = sys.maxsize
 
-        step_granularity = self.params.ramp_up / self.params.steps
-        ramp_up_per_thread = self.params.ramp_up / self.params.concurrency
-        for thr_idx in range(self.params.concurrency):
-            offset = self.params.worker_index * ramp_up_per_thread / float(self.params.worker_count)
-            delay = offset + thr_idx * float(self.params.ramp_up) / self.params.concurrency
-            delay -= delay % step_granularity if step_granularity else 0
+        active_concurrency = max(self.params.active_concurrency(), 1)
+        weights = [scenario.weight for scenario in self.scenarios] or [1]
+        first = self.params.thread_index  # the mix is global, so workers and agents keep it together
+        mix = mix_scenarios(weights, first + self.params.concurrency)[first:]
+        counts = [mix[:active_concurrency].count(idx) for idx in range(len(weights))]
+        ranks = [0] * len(weights)  # every scenario ramps up its own VUs
+        for thr_idx, scenario in enumerate(mix):
+            if self.params.is_open_model() or self.params.profile or thr_idx >= active_concurrency:
+                delay = 0  # whole VU pool is available at once, ramp-up is applied to arrival rate or profile
+            else:
+                ramp_up = self._get_ramp_up(scenario)
+                step_granularity = ramp_up / self.params.steps
+                ramp_up_per_thread = ramp_up / counts[scenario]
+                offset = self.params.worker_index * ramp_up_per_thread / float(self.params.worker_count)
+                delay = offset + ranks[scenario] * ramp_up_per_thread
+                delay -= delay % step_granularity if step_granularity else 0
+                ranks[scenario] += 1
             params = copy.deepcopy(self.params)
             params.thread_index = self.params.thread_index + thr_idx
             params.delay = delay
+            params.scenario = scenario
+            if self.scenarios:
+                params.tests = [self.scenarios[scenario].script]
             yield params
 
 
@@ -280,6 +918,83 @@ class ApiritifTestProgram(PluggableTestProgram):
         self.loadPlugins()
         self.createTests()
 
+    def createTests(self):
+        super(ApiritifTestProgram, self).createTests()
+        if self.config.get("reuse_suite"):
+            self._keep_tests(self.test)
+
+    def _keep_tests(self, suite):
+        """
+        unittest suites drop tests after run to free memory, it's needed to run them again
+        """
+        if isinstance(suite, unittest.BaseTestSuite):
+            suite._cleanup = False
+            for test in suite:
+                self._keep_tests(test)
+
+
+class SampleQueue(object):
+    """
+    Samples on their way from VU threads to writer thread of the same process. Nothing is pickled,
+    writer takes them in batches and waits on condition (instead of polling) while there are none.
+    """
+
+    def __init__(self):
+        self._items = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._all_done = threading.Condition(self._lock)
+        self._unfinished = 0
+        self._closed = False
+
+    def put(self, item):
+        with self._lock:
+            self._items.append(item)
+            self._unfinished += 1
+            self._not_empty.notify()
+
+    def get_batch(self, limit=BATCH_SIZE, timeout=None):
+        """
+        Wait for items unless the queue is closed
+
+        :return: up to limit items, empty list on timeout
+        """
+        with self._lock:
+            if not self._items and not self._closed:
+                self._not_empty.wait(timeout)
+            return [self._items.popleft() for _ in range(min(limit, len(self._items)))]
+
+    def task_done(self, count):
+        with self._lock:
+            self._unfinished -= count
+            if self._unfinished <= 0:
+                self._all_done.notify_all()
+
+    def join(self, timeout=None):
+        """
+        Wait until every item which was put is processed
+
+        :return: True if they are
+        """
+        with self._lock:
+            if self._unfinished > 0:
+                self._all_done.wait(timeout)
+            return self._unfinished <= 0
+
+    def close(self):
+        """
+        Wake up the consumer, get_batch() doesn't wait any more
+        """
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+
+    def empty(self):
+        return not self._items
+
+    def qsize(self):
+        return len(self._items)
+
 
 class LDJSONSampleWriter(object):
     """
@@ -288,10 +1003,21 @@ class LDJSONSampleWriter(object):
 
     def __init__(self, output_file):
         super(LDJSONSampleWriter, self).__init__()
-        self.concurrency = 0
+        self.vus = None  # VUCounters of all workers, sampled when sample is finished
+        self.all_threads = 0
+        self.grp_threads = 0
+        self.warmup_end = 0  # samples started before are dropped (or tagged) and don't get into stats
+        self.keep_warmup = False
+        self.cpu = None  # writer thread is bound to this CPU
+        self.flush_interval = FLUSH_INTERVAL
+        self.buffer_size = BUFFER_SIZE
         self.output_file = output_file
         self.out_stream = None
-        self._samples_queue = multiprocessing.Queue()
+        self._last_flush = 0
+        self._dirty = False  # there is data which wasn't flushed
+        self.summary = Summary()
+        self.timeline = None  # per-second summaries, only for live reporting
+        self._samples_queue = SampleQueue()
 
         self._writing = False
         self._writer_thread = Thread(target=self._writer)
@@ -299,70 +1025,137 @@ class LDJSONSampleWriter(object):
         self._writer_thread.name = self.__class__.__name__
 
     def __enter__(self):
-        self.out_stream = open(self.output_file, "wb")
+        self.out_stream = compression.open_output(self.output_file, self.buffer_size)
+        self._write_header()
+        self._last_flush = time.time()
         self._writing = True
         self._writer_thread.start()
         return self
 
+    def _write_header(self):
+        pass
+
     def is_alive(self):
         return self._writer_thread.is_alive()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self._writing = False
-        self._writer_thread.join()
-        self.out_stream.close()
+        self._samples_queue.close()
+        try:
+            self._writer_thread.join()
+        finally:
+            self.out_stream.close()  # the rest of buffer is written even if something went wrong
 
     def add(self, sample, test_count, success_count):
-        self._samples_queue.put_nowait((sample, test_count, success_count))
+        if sample.start_time is not None and sample.start_time < self.warmup_end:
+            if not self.keep_warmup:
+                return
+            sample.extras["warmup"] = True
+
+        self._samples_queue.put((sample, test_count, success_count, self._get_threads()))
+
+    def _get_threads(self):
+        """
+        :return: active VUs of all workers and of the scenario of current VU
+        """
+        if self.vus is None:
+            return 0, 0
+        return self.vus.total(), self.vus.scenario(thread.get_scenario())
 
     def is_queue_empty(self):
         return self._samples_queue.empty()
 
+    def queue_size(self):
+        return self._samples_queue.qsize()
+
+    def wait_written(self):
+        """
+        Block until all queued samples are processed (or writer thread is over)
+        """
+        while not self._samples_queue.join(timeout=1) and self.is_alive():
+            pass
+
     def _writer(self):
+        if self.cpu is not None:
+            isolation.pin([self.cpu])
         while self._writing:
-            if self._samples_queue.empty():
-                time.sleep(0.1)
-
-            while not self._samples_queue.empty():
-                item = self._samples_queue.get(block=True)
-                try:
-                    sample, test_count, success_count = item
-                    self._write_sample(sample, test_count, success_count)
-                except BaseException as exc:
-                    log.debug("Processing sample failed: %s\n%s", str(exc), traceback.format_exc())
-                    log.warning("Couldn't process sample, skipping")
-                    continue
+            self._write_batch()
+        while not self._samples_queue.empty():  # samples which came while stopping
+            self._write_batch()
+        self._flush()
 
-    def _write_sample(self, sample, test_count, success_count):
-        line = json.dumps(sample.to_dict()) + "\n"
-        self.out_stream.write(line.encode('utf-8'))
-        self.out_stream.flush()
+    def _get_timeout(self):
+        """
+        :return: how long writer thread may wait for samples, None means until they come
+        """
+        if self._dirty:
+            return max(self._last_flush + self.flush_interval - time.time(), 0)
+        return None  # nothing to flush, just wait for samples
 
+    def _write_batch(self):
+        batch = self._samples_queue.get_batch(timeout=self._get_timeout())
 
-class JTLSampleWriter(LDJSONSampleWriter):
-    def __init__(self, output_file):
-        super(JTLSampleWriter, self).__init__(output_file)
+        lines = []
+        for sample, test_count, success_count, threads in batch:
+            try:
+                self.all_threads, self.grp_threads = threads
+                lines.append(self._encode_sample(sample, test_count, success_count))
+                if not sample.extras.get("warmup"):
+                    self._add_to_summary(sample)
+            except BaseException as exc:
+                log.debug("Processing sample failed: %s\n%s", str(exc), traceback.format_exc())
+                log.warning("Couldn't process sample, skipping")
+
+        if lines:
+            self.out_stream.write(b"".join(lines))  # file buffer goes to disk when it's full
+            self._dirty = True
+        if self._dirty and time.time() - self._last_flush >= self.flush_interval:
+            self._flush()
+        self._samples_queue.task_done(len(batch))
+
+    def _flush(self):
+        self.out_stream.flush()
+        self._dirty = False
+        self._last_flush = time.time()
 
-    def __enter__(self):
-        obj = super(JTLSampleWriter, self).__enter__()
+    def write_all(self, records):
+        """
+        Write result file at once without writer thread, e.g. to convert other file
 
-        fieldnames = ["timeStamp", "elapsed", "Latency", "label", "responseCode", "responseMessage", "success",
-                      "allThreads", "bytes"]
-        endline = '\n'  # \r will be preprended automatically because out_stream is opened in text mode
-        self.writer = csv.DictWriter(self.out_stream, fieldnames=fieldnames, dialect=csv.excel, lineterminator=endline,
-                                     encoding='utf-8')
-        self.writer.writeheader()
-        self.out_stream.flush()
+        :param records: iterable of (sample, all_threads, grp_threads)
+        """
+        with compression.open_output(self.output_file, self.buffer_size) as self.out_stream:
+            self._write_header()
+            for sample, all_threads, grp_threads in records:
+                self.all_threads, self.grp_threads = all_threads, grp_threads
+                self.out_stream.write(self._encode_sample(sample, 0, 0))
+            self._flush()
+
+    def _encode_sample(self, sample, test_count, success_count):
+        """
+        :return: bytes of result file for the sample
+        """
+        line = json.dumps(sample.to_dict()) + "\n"
+        return line.encode('utf-8')
 
-        return obj
+    def _add_to_summary(self, sample):
+        for values in self._get_stats_values(sample):
+            self.summary.add(*values)
+            if self.timeline is not None:
+                self.timeline.add(*values)
 
-    def _write_sample(self, sample, test_count, success_count):
+    def _get_stats_values(self, sample):
         """
-        :type sample: Sample
-        :type test_count: int
-        :type success_count: int
+        :return: generator of (label, start_time, elapsed, success, size, corrected) for Summary.add()
         """
-        self._write_request_subsamples(sample)
+        for sub in self._get_request_subsamples(sample):
+            if sub.start_time is None or sub.duration is None:
+                continue
+            size = sub.extras.get("responseHeadersSize", 0) + 2 + sub.extras.get("responseBodySize", 0)
+            corrected = None
+            if "intendedStartTime" in sub.extras:  # latency as user sees it, including time lost in the queue
+                corrected = sub.start_time + sub.duration - sub.extras["intendedStartTime"]
+            yield sub.test_case, sub.start_time, sub.duration, sub.status == "PASSED", size, corrected
 
     def _get_sample_type(self, sample):
         if sample.path:
@@ -371,14 +1164,51 @@ class JTLSampleWriter(LDJSONSampleWriter):
         else:
             return None
 
-    def _write_request_subsamples(self, sample):
+    def _get_request_subsamples(self, sample):
+        """
+        Requests and transactions are reported by their own, test case only if it doesn't contain any
+        """
         if self._get_sample_type(sample) == "request":
-            self._write_single_sample(sample)
+            yield sample
         elif sample.subsamples:
             for sub in sample.subsamples:
-                self._write_request_subsamples(sub)
+                for request_sample in self._get_request_subsamples(sub):
+                    yield request_sample
         else:
-            self._write_single_sample(sample)
+            yield sample
+
+
+class JTLSampleWriter(LDJSONSampleWriter):
+    def __init__(self, output_file):
+        super(JTLSampleWriter, self).__init__(output_file)
+
+        fieldnames = ["timeStamp", "elapsed", "Latency", "label", "responseCode", "responseMessage", "success",
+                      "allThreads", "grpThreads", "bytes"]
+        endline = '\n'  # \r will be preprended automatically because out_stream is opened in text mode
+        self._rows = io.BytesIO()  # rows of current sample, they go to result file in batches
+        self.writer = csv.DictWriter(self._rows, fieldnames=fieldnames, dialect=csv.excel, lineterminator=endline,
+                                     encoding='utf-8')
+
+    def _write_header(self):
+        self.writer.writeheader()
+        self.out_stream.write(self._pop_rows())
+        self.out_stream.flush()
+
+    def _pop_rows(self):
+        rows = self._rows.getvalue()
+        self._rows.seek(0)
+        self._rows.truncate()
+        return rows
+
+    def _encode_sample(self, sample, test_count, success_count):
+        """
+        :type sample: Sample
+        :type test_count: int
+        :type success_count: int
+        """
+        for request_sample in self._get_request_subsamples(sample):
+            self._write_single_sample(request_sample)
+        return self._pop_rows()
 
     def _write_single_sample(self, sample):
         """
@@ -407,10 +1237,137 @@ class JTLSampleWriter(LDJSONSampleWriter):
 
             "responseCode": sample.extras.get("responseCode"),
             "responseMessage": message,
-            "allThreads": self.concurrency,  # TODO: there will be a problem aggregating concurrency for rare samples
+            "allThreads": self.all_threads,
+            "grpThreads": self.grp_threads,
             "success": "true" if sample.status == "PASSED" else "false",
         })
-        self.out_stream.flush()
+
+
+class AggregatingSampleWriter(LDJSONSampleWriter):
+    """
+    Writes per-label stats of time buckets (by sample start time) instead of samples, JSON line per bucket:
+    {"timestamp": 1600000000, "interval": 1, "vus": 10, "labels": {...}, "start_time": ..., "end_time": ...}
+
+    Labels are LabelStats of apiritif.stats with mergeable histograms. Bucket is written STATS_DELAY seconds
+    after its end (and flushed within flush interval) whether samples come or not, late samples of written bucket
+    make one more line with the same timestamp, readers merge them (see read_buckets()).
+    """
+
+    def __init__(self, output_file, interval=1, failures_file=None):
+        """
+        :param interval: seconds of bucket
+        :param failures_file: JSON lines file for raw failed samples, None means they aren't kept
+        """
+        super(AggregatingSampleWriter, self).__init__(output_file)
+        self.interval = interval
+        self.failures_file = failures_file
+        self.failures_stream = None
+        self._buckets = {}  # timestamp -> Summary
+        self._vus = {}  # timestamp -> max active VUs of all workers
+
+    def _write_header(self):
+        if self.failures_file:
+            self.failures_stream = compression.open_output(self.failures_file, self.buffer_size)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            super(AggregatingSampleWriter, self).__exit__(exc_type, exc_val, exc_tb)
+        finally:
+            if self.failures_stream:
+                self.failures_stream.close()
+
+    def _writer(self):
+        super(AggregatingSampleWriter, self)._writer()
+        self.out_stream.write(self._pop_buckets())  # the rest of them
+        self._flush()
+
+    def _flush(self):
+        if self.failures_stream:
+            self.failures_stream.flush()
+        super(AggregatingSampleWriter, self)._flush()
+
+    def _encode_sample(self, sample, test_count, success_count):
+        if sample.extras.get("warmup"):
+            return b""
+
+        failed = False
+        for label, start_time, elapsed, success, size, corrected in self._get_stats_values(sample):
+            timestamp = int(start_time // self.interval * self.interval)
+            self._buckets.setdefault(timestamp, Summary()).add(label, start_time, elapsed, success, size, corrected)
+            self._vus[timestamp] = max(self._vus.get(timestamp, 0), self.all_threads)
+            failed = failed or not success
+
+        if failed and self.failures_stream:
+            self.failures_stream.write((json.dumps(sample.to_dict()) + "\n").encode('utf-8'))
+        return b""
+
+    def _get_timeout(self):
+        timeout = super(AggregatingSampleWriter, self)._get_timeout()
+        if self._buckets:  # wake up when the oldest bucket is over, even if no samples come
+            ready = max(min(self._buckets) + self.interval + STATS_DELAY - time.time(), 0)
+            timeout = ready if timeout is None else min(timeout, ready)
+        return timeout
+
+    def _write_batch(self):
+        super(AggregatingSampleWriter, self)._write_batch()
+        buckets = self._pop_buckets(before=time.time() - self.interval - STATS_DELAY)
+        if buckets:
+            self.out_stream.write(buckets)
+            self._dirty = True  # flushed by the next batch within flush interval
+
+    def _pop_buckets(self, before=None):
+        """
+        :return: encoded buckets which started before given time (all of them by default)
+        """
+        lines = []
+        for timestamp in sorted(self._buckets):
+            if before is not None and timestamp >= before:
+                break
+            bucket = self._buckets.pop(timestamp).to_dict()
+            bucket.update({"timestamp": timestamp, "interval": self.interval, "vus": self._vus.pop(timestamp)})
+            lines.append(json.dumps(bucket) + "\n")
+        return "".join(lines).encode('utf-8')
+
+
+def read_buckets(filename):
+    """
+    Read result file of AggregatingSampleWriter, lines of the same bucket are merged
+
+    :return: sorted list of (timestamp, Summary, vus)
+    """
+    buckets = {}
+    with compression.open_input(filename) as fds:
+        for line in fds:
+            data = json.loads(line)
+            summary, vus = buckets.get(data["timestamp"], (Summary(), 0))
+            summary.merge(Summary.from_dict(data))
+            buckets[data["timestamp"]] = summary, max(vus, data["vus"])
+    return [(timestamp, summary, vus) for timestamp, (summary, vus) in sorted(buckets.items())]
+
+
+class ColumnarSampleWriter(LDJSONSampleWriter):
+    """
+    Compact binary result file (see apiritif.columnar), rows are packed into a chunk until it's full
+    or until flush
+    """
+
+    def __init__(self, output_file, blobs=False):
+        super(ColumnarSampleWriter, self).__init__(output_file)
+        self._chunk = columnar.ChunkEncoder(blobs)
+
+    def _write_header(self):
+        self.out_stream.write(columnar.MAGIC)
+
+    def _encode_sample(self, sample, test_count, success_count):
+        self._chunk.add(sample, self.all_threads, self.grp_threads)
+        if self._chunk.rows >= columnar.CHUNK_ROWS:
+            return self._chunk.pop_chunk()
+        return b""
+
+    def _flush(self):
+        if self._chunk.rows:
+            self.out_stream.write(self._chunk.pop_chunk())
+        super(ColumnarSampleWriter, self)._flush()
 
 
 # noinspection PyPep8Naming
@@ -425,6 +1382,7 @@ class ApiritifPlugin(Plugin):
 
     def __init__(self):
         self.controller = store.SampleController(log=log, session=self.session)
+        self.cpu_mark = time.thread_time()
         apiritif.put_into_thread_store(controller=self.controller)
 
     def startTest(self, event):
@@ -445,11 +1403,13 @@ class ApiritifPlugin(Plugin):
             "test_fqn": test_fqn,
             "description": description,
             "class_method": class_method}
+        self.cpu_mark = time.thread_time()
         self.controller.startTest()
 
     def stopTest(self, event):
         #if not 'NormalShutdown' in self.session.stop_reason
         self.controller.stopTest()
+        health.record_test_cpu(self.cpu_mark)
 
     def reportError(self, event):
         """
@@ -458,21 +1418,9 @@ class ApiritifPlugin(Plugin):
         :param error:
         :return:
         """
-        error = event.testEvent.exc_info
-
         # test_dict will be None if startTest wasn't called (i.e. exception in setUp/setUpClass)
         # status=BROKEN
-        assertion_name = error[0].__name__
-        error_msg = str(error[1]).split('\n')[0]
-        error_trace = get_trace(error)
-        if isinstance(error[1], NormalShutdown):
-            self.session.set_stop_reason(f"{error[1].__class__.__name__} for vu #{thread.get_index()}: {error_msg}")
-            self.controller.current_sample = None   # partial data mustn't be written
-        else:
-            if self.controller.current_sample is not None:
-                self.controller.addError(assertion_name, error_msg, error_trace)
-            else:  # error in test infrastructure (e.g. module setup())
-                log.error("\n".join((assertion_name, error_msg, error_trace)))
+        self.controller.reportError(event.testEvent.exc_info)
 
     def reportFailure(self, event):
         """
@@ -501,16 +1449,89 @@ class ApiritifPlugin(Plugin):
             self.session.set_stop_reason("Nothing to test.")
 
 
-def cmdline_to_params():
+def get_option_parser():
     parser = OptionParser()
     parser.add_option('', '--concurrency', action='store', type="int", default=1)
+    parser.add_option('', '--max-concurrency', action='store', type="int", default=0,
+                      help="size of VU pool if it has to be bigger than --concurrency for runtime changes")
     parser.add_option('', '--iterations', action='store', type="int", default=sys.maxsize)
     parser.add_option('', '--ramp-up', action='store', type="float", default=0)
     parser.add_option('', '--steps', action='store', type="int", default=sys.maxsize)
     parser.add_option('', '--hold-for', action='store', type="float", default=0)
-    parser.add_option('', '--result-file-template', action='store', type="str", default="result-%s.csv")
+    parser.add_option('', '--warmup', action='store', type="float", default=0,
+                      help="seconds at the start of the test (ramp-up goes on) when samples aren't reported")
+    parser.add_option('', '--keep-warmup', action='store_true', default=False,
+                      help="write warm-up samples with 'warmup' extra instead of dropping them (stats skip them)")
+    parser.add_option('', '--rate', '--arrival-rate', dest="rate", action='store', type="float", default=0,
+                      help="target iterations per second, --concurrency sets max number of VUs in this mode")
+    parser.add_option('', '--arrival-distribution', dest="arrivals", action='store', type="choice",
+                      choices=DISTRIBUTIONS, default=CONSTANT, help="intervals between arrivals in rate mode")
+    parser.add_option('', '--pacing', action='store', type="float", default=0,
+                      help="seconds between iteration starts of every VU, the rest of time after iteration is slept")
+    parser.add_option('', '--throughput', action='store', type="float", default=0,
+                      help="target iterations per second spread across active VUs (closed model pacing)")
+    parser.add_option('', '--workers', action='store', type="str", default="1",
+                      help="number of worker processes or 'auto' to use all CPUs")
+    parser.add_option('', '--reuse-suite', action='store_true', default=False,
+                      help="load and discover tests once per VU and just run them again on every iteration")
+    parser.add_option('', '--executor', action='store', type="choice", choices=EXECUTORS, default=NOSE2,
+                      help="direct runs tests without nose2 plugins, "
+                           "asyncio runs VUs as tasks of one event loop for 'async def' tests")
+    parser.add_option('', '--deadline-grace', action='store', type="float", default=0,
+                      help="seconds to let iterations finish after ramp-up and hold-for before interrupting them")
+    parser.add_option('', '--profile', action='store', type="str", default=None,
+                      help="JSON file with load profile segments (replaces ramp-up, steps and hold-for)")
+    parser.add_option('', '--control-port', action='store', type="int", default=0,
+                      help="listen to runtime commands on this local port: vus, rate, pause, resume, status, stop")
+    parser.add_option('', '--search-step', action='store', type="float", default=0,
+                      help="capacity search: raise VUs (or --rate) by this step until SLA is breached")
+    parser.add_option('', '--search-max', action='store', type="float", default=0,
+                      help="the highest level of capacity search, VU pool size for VUs")
+    parser.add_option('', '--search-plateau', action='store', type="float", default=60,
+                      help="seconds to hold every level of capacity search")
+    parser.add_option('', '--search-settle', action='store', type="float", default=10,
+                      help="seconds at the start of every plateau which aren't measured")
+    parser.add_option('', '--search-report', action='store', type="str", default=None,
+                      help="JSON file for capacity curve and knee point")
+    parser.add_option('', '--sla-p95', action='store', type="float", default=0,
+                      help="max p95 latency in ms for capacity search")
+    parser.add_option('', '--sla-errors', action='store', type="float", default=0,
+                      help="max percent of failed samples for capacity search")
+    parser.add_option('', '--metrics-port', action='store', type="int", default=0,
+                      help="serve live per-label throughput, errors and latency percentiles as JSON on this port")
+    parser.add_option('', '--health-file-template', action='store', type="str", default=None,
+                      help="JSON lines file for generator self-overhead records (scheduler lag, GIL wait, etc)")
+    parser.add_option('', '--cpu-affinity', action='store', type="str", default=None,
+                      help="pin worker processes to CPUs: 'auto' or list like '0-3,6', split between workers")
+    parser.add_option('', '--writer-cpu', action='store', type="int", default=None,
+                      help="dedicated CPU for result writers, worker processes don't use it")
+    parser.add_option('', '--nice', action='store', type="int", default=0,
+                      help="niceness increment of worker processes")
+    parser.add_option('', '--memory-limit', action='store', type="float", default=0,
+                      help="max address space of every worker process, MB (it isn't memory use: "
+                           "every VU thread reserves about 8 MB of it for stack)")
+    parser.add_option('', '--rebalance', action='store_true', default=False,
+                      help="move VUs from saturated worker processes to cold ones, total stays the same")
+    parser.add_option('', '--flush-interval', action='store', type="float", default=FLUSH_INTERVAL,
+                      help="max seconds between writes of buffered samples to result file")
+    parser.add_option('', '--buffer-size', action='store', type="float", default=BUFFER_SIZE,
+                      help="KB of samples buffered before they are written to result file")
+    parser.add_option('', '--result-file-template', action='store', type="str", default="result-%s.csv",
+                      help="%s is replaced with worker number, extension chooses format: .csv, .ldjson or "
+                           + columnar.EXTENSION + " (compact binary), add .gz or .zst to compress it")
+    parser.add_option('', '--result-blobs', action='store_true', default=False,
+                      help="keep bodies, headers, assertions and traces in binary result file")
+    parser.add_option('', '--aggregate', action='store', type="int", default=0,
+                      help="write per-label stats of time buckets of given seconds to result file instead of samples")
+    parser.add_option('', '--failures-file-template', action='store', type="str", default=None,
+                      help="JSON lines file for raw failed samples when results are aggregated")
     parser.add_option('', '--verbose', action='store_true', default=False)
     parser.add_option('', "--version", action='store_true', default=False)
+    return parser
+
+
+def cmdline_to_params():
+    parser = get_option_parser()
     opts, args = parser.parse_args()
     log.debug("%s %s", opts, args)
 
@@ -518,18 +1539,97 @@ def cmdline_to_params():
         print(VERSION)
         sys.exit(0)
 
+    return options_to_params(parser, opts, args)
+
+
+def options_to_params(parser, opts, args):
     params = Params()
     params.concurrency = opts.concurrency
+    if opts.max_concurrency > opts.concurrency:
+        params.target_concurrency = opts.concurrency
+        params.concurrency = opts.max_concurrency
+    params.control_port = opts.control_port
+    params.metrics_port = opts.metrics_port
     params.ramp_up = opts.ramp_up
     params.steps = opts.steps
     params.iterations = opts.iterations
     params.hold_for = opts.hold_for
+    params.warmup = opts.warmup
+    params.keep_warmup = opts.keep_warmup
+    params.rate = opts.rate
+    params.arrivals = opts.arrivals
+    params.pacing = opts.pacing
+    params.throughput = opts.throughput
+    params.reuse_suite = opts.reuse_suite
+    params.executor = opts.executor
+    params.deadline_grace = opts.deadline_grace
+    if opts.search_step and not opts.profile:
+        params.search_step = opts.search_step
+        params.search_max = opts.search_max
+        params.search_plateau = opts.search_plateau
+        params.search_settle = opts.search_settle
+        params.search_report = opts.search_report
+        params.sla_p95 = opts.sla_p95
+        params.sla_errors = opts.sla_errors
+        if not params.is_open_model() and opts.search_max:
+            params.target_concurrency = params.active_concurrency()  # the search starts here
+            params.concurrency = max(params.concurrency, int(opts.search_max))
+        params.ramp_up = params.hold_for = 0  # the search decides when to stop
+        params.iterations = sys.maxsize
+    if opts.profile:
+        params.profile = LoadProfile.load(opts.profile)
+        params.target_concurrency = None  # the profile drives it
+        if params.profile.target == CONCURRENCY:
+            params.concurrency = max(int(math.ceil(params.profile.max_level())), 1)
+        params.rate = 0
+        params.ramp_up = params.hold_for = 0
 
     params.report = opts.result_file_template
-    params.tests = args
-    params.worker_count = 1  # min(params.concurrency, multiprocessing.cpu_count())
+    try:
+        compression.get_codec(params.report)  # fail early if compression isn't available
+    except ValueError as exc:
+        parser.error(str(exc))
+    params.health_report = opts.health_file_template
+    try:
+        params.scenarios = [Scenario.parse(arg) for arg in args]
+    except ValueError as exc:
+        parser.error(str(exc))
+    params.tests = [scenario.script for scenario in params.scenarios]
+    if opts.workers == "auto":
+        params.worker_count = multiprocessing.cpu_count()
+    else:
+        try:
+            params.worker_count = int(opts.workers)
+        except ValueError:
+            parser.error("Wrong number of workers: %s" % opts.workers)
+    params.worker_count = max(min(params.worker_count, params.concurrency), 1)
+    if opts.cpu_affinity or opts.writer_cpu is not None:
+        try:
+            params.cpus = isolation.parse_cpus(opts.cpu_affinity or isolation.AUTO)
+        except ValueError as exc:
+            parser.error(str(exc))
+    params.writer_cpu = opts.writer_cpu
+    params.nice = opts.nice
+    params.memory_limit = opts.memory_limit
+    params.rebalance = opts.rebalance
+    params.flush_interval = opts.flush_interval
+    params.buffer_size = opts.buffer_size
+    params.result_blobs = opts.result_blobs
+    params.aggregate = opts.aggregate
+    params.failures_report = opts.failures_file_template
+    closed = not (params.profile or params.search_step or params.is_open_model())
+    if params.rebalance and closed and params.target_concurrency is None and params.duration():
+        # VU pools need room for moved VUs, spare ones wait until the test is over
+        params.target_concurrency = params.concurrency
+        params.concurrency *= 2
     params.verbose = opts.verbose
 
+    mix = mix_scenarios([scenario.weight for scenario in params.scenarios], params.concurrency)
+    for idx, scenario in enumerate(params.scenarios):
+        if idx not in mix:
+            log.warning("Scenario %s gets no VUs of %s, raise concurrency or its weight", scenario.label,
+                        params.concurrency)
+
     return params
 
 
@@ -546,6 +1646,7 @@ def setup_logging(params):
 def main():
     cmd_params = cmdline_to_params()
     setup_logging(cmd_params)
+    handle_signals()
     supervisor = Supervisor(cmd_params)
     supervisor.start()
     supervisor.join()
@@ -0,0 +1,129 @@
+"""
+Live metrics of apiritif-loadgen run served over local HTTP
+
+Copyright 2022 BlazeMeter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+from apiritif.stats import Summary
+
+WINDOW = 60  # seconds of rolling statistics
+PERCENTILES = (50, 90, 99)
+
+
+class LiveMetrics(object):
+    """
+    Rolling window of per-second summaries which workers report while the test goes,
+    plus totals since start. Nothing is parsed from result files.
+    """
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.seconds = {}  # second -> Summary
+        self.total = Summary()
+        self._lock = threading.Lock()
+
+    def add(self, second, summary):
+        """
+        :type second: int
+        :type summary: Summary
+        """
+        with self._lock:
+            self.seconds.setdefault(second, Summary()).merge(summary)
+            self.total.merge(summary)
+            last = max(self.seconds)
+            for old in [old for old in self.seconds if old <= last - self.window]:
+                del self.seconds[old]
+
+    def snapshot(self):
+        with self._lock:
+            window = Summary()
+            for summary in self.seconds.values():
+                window.merge(summary)
+            span = max(self.seconds) - min(self.seconds) + 1 if self.seconds else 0
+            labels = sorted(set(window.labels) | set(self.total.labels))
+            return {
+                "window": span,
+                "last_second": max(self.seconds) if self.seconds else None,
+                "labels": {label: self._label_metrics(window, label, span) for label in labels},
+                "total": self._metrics(window.total(), self.total.total(), span)}
+
+    def _label_metrics(self, window, label, span):
+        total = self.total.labels[label]
+        return self._metrics(window.labels.get(label), total, span)
+
+    @staticmethod
+    def _metrics(stats, total, span):
+        """
+        :type stats: apiritif.stats.LabelStats
+        :type total: apiritif.stats.LabelStats
+        """
+        metrics = {"count": total.count, "failures": total.failures}
+        if stats is None or not stats.count:
+            metrics.update({"throughput": 0.0, "error_rate": 0.0})
+            return metrics
+
+        metrics["throughput"] = round(stats.count / float(span), 3)
+        metrics["error_rate"] = round(stats.failures / float(stats.count), 4)
+        metrics["avg_ms"] = round(1000 * stats.elapsed_avg(), 3)
+        for percent in PERCENTILES:
+            metrics["p%s_ms" % percent] = round(1000 * stats.histogram.percentile(percent), 3)
+        if stats.corrected is not None:
+            metrics["corrected_p99_ms"] = round(1000 * stats.corrected.percentile(99), 3)
+        return metrics
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+
+        body = json.dumps(self.server.metrics.snapshot()).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # polling clients mustn't flood the log
+
+
+class MetricsServer(Thread):
+    """
+    GET / (or /metrics) returns JSON snapshot of LiveMetrics
+    """
+
+    def __init__(self, address, metrics):
+        """
+        :type metrics: LiveMetrics
+        """
+        super(MetricsServer, self).__init__(name=self.__class__.__name__)
+        self.daemon = True
+        self.server = ThreadingHTTPServer(address, _MetricsHandler)
+        self.server.daemon_threads = True
+        self.server.metrics = metrics
+        self.address = self.server.server_address
+
+    def run(self):
+        self.server.serve_forever()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,391 @@
+"""
+Lightweight test runners for apiritif-loadgen which don't need nose2
+
+Copyright 2022 BlazeMeter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import asyncio
+import importlib
+import inspect
+import os
+import sys
+import threading
+import time
+import unittest
+
+import apiritif
+import apiritif.health as health
+import apiritif.store as store
+import apiritif.thread as thread
+from apiritif.utils import log, DeadlineExceeded
+
+NOSE2 = "nose2"
+DIRECT = "direct"
+ASYNCIO = "asyncio"
+EXECUTORS = (NOSE2, DIRECT, ASYNCIO)
+
+_modules_lock = threading.Lock()
+
+
+class RunnerSession(object):
+    """
+    The part of nose2 session which SampleController relies on
+    """
+
+    def __init__(self):
+        self.stop_reason = ""
+
+    def set_stop_reason(self, msg):
+        if not self.stop_reason:
+            self.stop_reason = msg
+
+
+class TestItem(object):
+    """
+    Test function or method, ids are the same as nose2 ones: module.Class.method
+    """
+
+    def __init__(self, module, name, cls=None):
+        self.module = module
+        self.cls = cls
+        self.name = name
+
+        func = getattr(cls or module, name)
+        container = cls.__name__ if cls else module.__name__.split('.')[-1]
+        self.test_info = {
+            "test_case": name,
+            "suite_name": container,
+            "test_fqn": "%s.%s" % (module.__name__, "%s.%s" % (cls.__name__, name) if cls else name),
+            "description": _short_description(func),
+            "class_method": name}
+
+    def __repr__(self):
+        return self.test_info["test_fqn"]
+
+
+class TestGroup(object):
+    """
+    Tests of one class (or module level functions) with their fixtures
+    """
+
+    def __init__(self, module, cls, items):
+        self.module = module
+        self.cls = cls
+        self.items = items
+
+
+def _short_description(func):
+    doc = (func.__doc__ or "").strip()
+    return doc.split("\n")[0].strip() or None
+
+
+def _is_test_class(obj):
+    return inspect.isclass(obj) and (issubclass(obj, unittest.TestCase) or obj.__name__.startswith("Test"))
+
+
+def load_modules(filenames):
+    """
+    Import test modules by file names like nose2 does: their directories become part of sys.path
+    """
+    modules = []
+    with _modules_lock:  # VUs of the worker start at the same time
+        for filename in filenames:
+            path = os.path.abspath(filename)
+            directory, name = os.path.split(path)
+            if os.path.isdir(path):
+                directory, name = os.path.split(path.rstrip(os.sep))
+            else:
+                name = os.path.splitext(name)[0]
+
+            if directory not in sys.path:
+                sys.path.insert(0, directory)
+            modules.append(importlib.import_module(name))
+
+    return modules
+
+
+def discover(filenames, accept):
+    """
+    :param accept: predicate for test functions and methods
+    :return: list of TestGroup in nose2 order
+    """
+    groups = []
+    for module in load_modules(filenames):
+        funcs = []
+        classes = []
+        for name, obj in sorted(vars(module).items()):
+            if getattr(obj, "__module__", None) != module.__name__:
+                continue  # imported from somewhere else
+
+            if name.startswith("test") and inspect.isfunction(obj) and accept(obj):
+                funcs.append(TestItem(module, name))
+            elif _is_test_class(obj):
+                names = [attr for attr in sorted(dir(obj))
+                         if attr.startswith("test") and accept(getattr(obj, attr))]
+                if names:
+                    classes.append(TestGroup(module, obj, [TestItem(module, attr, obj) for attr in names]))
+
+        groups.extend(classes)
+        if funcs:
+            groups.append(TestGroup(module, None, funcs))
+
+    return groups
+
+
+async def _call_async(func):
+    result = func()
+    if inspect.isawaitable(result):
+        await result
+
+
+class Runner(object):
+    """
+    Runs tests of single VU, reports samples through SampleController directly (without nose2 plugins).
+
+    Tests are discovered once, setUpModule/setUpClass are called every iteration
+    the same way nose2 does for freshly loaded suite.
+    """
+
+    def __init__(self, filenames, accept):
+        self.session = RunnerSession()
+        self.controller = store.SampleController(log=log, session=self.session)
+        apiritif.put_into_thread_store(controller=self.controller)
+        self.groups = discover(filenames, accept)
+        self.modules = []
+        for group in self.groups:
+            if group.module not in self.modules:
+                self.modules.append(group.module)
+
+    def _groups_of(self, module):
+        return [group for group in self.groups if group.module is module]
+
+    @staticmethod
+    def _get_instance(group, item):
+        if issubclass(group.cls, unittest.TestCase):
+            return group.cls(item.name)
+        return group.cls()
+
+    def _start_test(self, item):
+        thread.clean_transaction_handlers()
+        self.controller.test_info = item.test_info
+        self._cpu_mark = time.thread_time()
+        self.controller.startTest()
+
+    def _after_iteration(self):
+        if not self.controller.test_count:
+            self.session.set_stop_reason("Nothing to test.")
+
+
+class DirectRunner(Runner):
+    """
+    Plain sync tests, the lightest way to run iteration
+    """
+
+    def __init__(self, filenames):
+        super(DirectRunner, self).__init__(filenames, lambda func: not inspect.iscoroutinefunction(func))
+
+    def run_iteration(self):
+        for module in self.modules:
+            if self.session.stop_reason:
+                break
+
+            if self._fixture(getattr(module, "setUpModule", None)):
+                for group in self._groups_of(module):
+                    if not self.session.stop_reason:
+                        self._run_group(group)
+                self._fixture(getattr(module, "tearDownModule", None))
+
+        self._after_iteration()
+
+    def _run_group(self, group):
+        if group.cls is None:
+            for item in group.items:
+                if self.session.stop_reason:
+                    break
+                self._run_test(item, None, getattr(group.module, item.name))
+            return
+
+        if not self._fixture(getattr(group.cls, "setUpClass", None)):
+            return
+
+        for item in group.items:
+            if self.session.stop_reason:
+                break
+            instance = self._get_instance(group, item)
+            self._run_test(item, instance, getattr(instance, item.name))
+
+        self._fixture(getattr(group.cls, "tearDownClass", None))
+
+    def _fixture(self, func):
+        """
+        :return: False if fixture has failed
+        """
+        if func is None:
+            return True
+
+        try:
+            func()
+        except BaseException:
+            self.controller.reportError(sys.exc_info())  # no current sample, it's just logged
+            return False
+
+        return True
+
+    def _run_test(self, item, instance, func):
+        self._start_test(item)
+        try:
+            self._hook(instance, "setUp")
+        except unittest.SkipTest:
+            pass
+        except BaseException:
+            self.controller.reportError(sys.exc_info())
+        else:
+            failure_exception = getattr(instance, "failureException", AssertionError)
+            try:
+                func()
+            except unittest.SkipTest:
+                pass  # sample stays SKIPPED
+            except failure_exception:
+                self.controller.addFailure(sys.exc_info())
+            except BaseException:
+                self.controller.reportError(sys.exc_info())
+            else:
+                self.controller.addSuccess()
+
+            try:
+                self._hook(instance, "tearDown")
+                self._hook(instance, "doCleanups")
+            except BaseException:
+                self.controller.reportError(sys.exc_info())
+
+        self.controller.stopTest()
+        health.record_test_cpu(self._cpu_mark)
+
+    @staticmethod
+    def _hook(instance, name):
+        hook = getattr(instance, name, None)
+        if hook is not None:
+            hook()
+
+
+class AsyncRunner(Runner):
+    """
+    Coroutine tests, setup/teardown methods may be either sync or async
+    """
+
+    def __init__(self, filenames):
+        super(AsyncRunner, self).__init__(filenames, inspect.iscoroutinefunction)
+
+    async def run_iteration(self):
+        for module in self.modules:
+            if self.session.stop_reason:
+                break
+
+            if await self._fixture(getattr(module, "setUpModule", None)):
+                for group in self._groups_of(module):
+                    if not self.session.stop_reason:
+                        await self._run_group(group)
+                await self._fixture(getattr(module, "tearDownModule", None))
+
+        self._after_iteration()
+
+    async def _run_group(self, group):
+        if group.cls is None:
+            for item in group.items:
+                if self.session.stop_reason:
+                    break
+                await self._run_test(item, None, getattr(group.module, item.name))
+            return
+
+        if not await self._fixture(getattr(group.cls, "setUpClass", None)):
+            return
+
+        for item in group.items:
+            if self.session.stop_reason:
+                break
+            instance = self._get_instance(group, item)
+            await self._run_test(item, instance, getattr(instance, item.name))
+
+        await self._fixture(getattr(group.cls, "tearDownClass", None))
+
+    async def _fixture(self, func):
+        if func is None:
+            return True
+
+        try:
+            await _call_async(func)
+        except asyncio.CancelledError:
+            raise
+        except BaseException:
+            self.controller.reportError(sys.exc_info())
+            return False
+
+        return True
+
+    async def _run_test(self, item, instance, func):
+        self._start_test(item)
+        try:
+            await self._run_steps(instance, func)
+        except asyncio.CancelledError:  # VU is cancelled at deadline, the sample is cut off
+            self._interrupt()
+            raise
+
+        self.controller.stopTest()  # CPU time of test isn't recorded, the thread is shared by all coroutines
+
+    async def _run_steps(self, instance, func):
+        try:
+            await self._hook(instance, "setUp")
+            await self._hook(instance, "asyncSetUp")
+        except unittest.SkipTest:
+            pass
+        except asyncio.CancelledError:
+            raise
+        except BaseException:
+            self.controller.reportError(sys.exc_info())
+        else:
+            failure_exception = getattr(instance, "failureException", AssertionError)
+            try:
+                await func()
+            except unittest.SkipTest:
+                pass
+            except asyncio.CancelledError:
+                raise
+            except failure_exception:
+                self.controller.addFailure(sys.exc_info())
+            except BaseException:
+                self.controller.reportError(sys.exc_info())
+            else:
+                self.controller.addSuccess()
+
+            try:
+                await self._hook(instance, "asyncTearDown")
+                await self._hook(instance, "tearDown")
+                await self._hook(instance, "doCleanups")
+            except asyncio.CancelledError:
+                raise
+            except BaseException:
+                self.controller.reportError(sys.exc_info())
+
+    def _interrupt(self):
+        try:
+            raise DeadlineExceeded("Iteration is cancelled at deadline")
+        except DeadlineExceeded:
+            self.controller.reportError(sys.exc_info())
+        self.controller.stopTest()
+
+    @staticmethod
+    async def _hook(instance, name):
+        hook = getattr(instance, name, None)
+        if hook is not None:
+            await _call_async(hook)
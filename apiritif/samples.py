@@ -62,7 +62,7 @@ class Sample(object):
                  error_msg=None, error_trace=None):
         self.test_suite = test_suite  # test label (test method name)
         self.test_case = test_case  # test suite name (class name)
-        self.status = status  # test status (PASSED/FAILED/BROKEN/SKIPPED)
+        self.status = status  # test status (PASSED/FAILED/BROKEN/SKIPPED/INTERRUPTED)
         self.start_time = start_time  # test start time
         self.duration = duration  # test duration
         self.error_msg = error_msg  # short error message
@@ -73,6 +73,24 @@ class Sample(object):
         self.path = []  # sample path (i.e. [package, package, module, suite, case, transaction])
         self.parent_sample = None  # pointer to parent sample
 
+    def set_intended_start(self, lag):
+        """
+        Moment when the sample would have started if iteration wasn't late, for the whole tree of samples
+        """
+        if self.start_time is not None:
+            self.extras["intendedStartTime"] = self.start_time - lag
+        for sample in self.subsamples:
+            sample.set_intended_start(lag)
+
+    def set_scenario(self, label):
+        """
+        Labels of the whole tree of samples get scenario prefix, the same requests of different scenarios differ
+        """
+        self.extras["scenario"] = label
+        self.test_case = "%s: %s" % (label, self.test_case)
+        for sample in self.subsamples:
+            sample.set_scenario(label)
+
     def set_failed(self, error_msg, error_trace):
         current = self
         while current is not None:
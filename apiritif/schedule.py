@@ -0,0 +1,474 @@
+"""
+Iteration scheduling for apiritif-loadgen
+
+Copyright 2022 BlazeMeter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import asyncio
+import json
+import math
+import os
+import random
+import threading
+import time
+
+from apiritif.utils import graceful, wait_shutdown
+
+CONSTANT = "constant"
+POISSON = "poisson"
+DISTRIBUTIONS = (CONSTANT, POISSON)
+
+TICK = 0.1  # granularity of rate integration, seconds
+
+
+class ArrivalSchedule(object):
+    """
+    Source of iteration start times for open model (arrival rate) load.
+
+    All VUs of the worker take slots from the same schedule and wait until the slot comes,
+    so the rate doesn't depend on response times while there are free VUs in the pool.
+    Arrival N happens when integral of rate over time reaches N (constant intervals)
+    or sum of N exponential variables (poisson), so rate may change along the way.
+    """
+
+    def __init__(self, rate, distribution=CONSTANT, limit=0, duration=0, ramp_up=0, steps=0, seed=None,
+                 rate_source=None):
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError("Unknown arrival distribution: %s" % distribution)
+
+        self.rate = rate
+        self.rate_source = rate_source  # callable(timestamp) to get current rate from outside, None means it's over
+        self.distribution = distribution
+        self.limit = limit  # max number of arrivals, 0 means unlimited
+        self.duration = duration  # schedule length in seconds (ramp-up included), 0 means unlimited
+        self.ramp_up = ramp_up
+        self.steps = steps
+
+        self.start_time = None
+        self._next = None
+        self._pending = 0  # part of the gap which is postponed because of zero rate
+        self._issued = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+
+    def start(self, start_time=None):
+        with self._lock:
+            self._start(start_time)
+
+    def _start(self, start_time=None):
+        if self.start_time is None:
+            self.start_time = time.time() if start_time is None else start_time
+            self._next = self.start_time
+            self._advance(self._initial_gap())
+
+    def rate_at(self, timestamp):
+        """
+        Target arrival rate at given moment or None if schedule is over
+        """
+        elapsed = timestamp - self.start_time
+        if 0 < self.duration <= elapsed:
+            return None
+
+        rate = self.rate
+        if self.rate_source:
+            rate = self.rate_source(timestamp)
+            if rate is None:
+                return None
+
+        if self.ramp_up and elapsed < self.ramp_up:
+            progress = elapsed / self.ramp_up
+            if self.steps:
+                progress = math.ceil(progress * self.steps) / self.steps
+            return rate * progress
+
+        return rate
+
+    def next_arrival(self):
+        """
+        Reserve next arrival slot
+
+        :return: timestamp when iteration is supposed to start or None if schedule is exhausted
+        """
+        while not graceful():
+            arrival, retry_time = self._reserve()
+            if retry_time is None:
+                return arrival
+
+            sleep_until(retry_time)  # rate is zero for now, look at it later
+
+    async def next_arrival_async(self):
+        """
+        Same as next_arrival() but doesn't block event loop while rate is zero
+        """
+        while not graceful():
+            arrival, retry_time = self._reserve()
+            if retry_time is None:
+                return arrival
+
+            await sleep_async(retry_time - time.time())
+
+    def _reserve(self):
+        """
+        :return: (arrival, None) or (None, time to look at the schedule again)
+        """
+        with self._lock:
+            self._start()
+            if self._pending:
+                self._advance(self._pending)
+
+            if 0 < self.limit <= self._issued or self._next is None:
+                return None, None
+
+            if not self._pending:
+                arrival = self._next
+                self._issued += 1
+                self._advance(self._gap())
+                return arrival, None
+
+            return None, self._next
+
+    def _initial_gap(self):
+        if self.distribution == POISSON:
+            return self._gap()
+        return 0
+
+    def _gap(self):
+        if self.distribution == POISSON:
+            return self._random.expovariate(1.0)
+        return 1.0
+
+    def _advance(self, amount):
+        """
+        Move next arrival forward until the rate integral reaches amount
+        """
+        timestamp = self._next
+        horizon = time.time() + TICK
+        while amount > 0:
+            rate = self.rate_at(timestamp)
+            if rate is None:
+                self._next = None
+                self._pending = 0
+                return
+
+            if rate <= 0 and timestamp > horizon:
+                break  # rate may be changed from outside, don't go too far
+
+            if rate * TICK >= amount:
+                timestamp += amount / rate
+                amount = 0
+            else:
+                timestamp += TICK
+                amount -= rate * TICK
+
+        if self.rate_at(timestamp) is None:
+            timestamp = None
+        self._next = timestamp
+        self._pending = amount
+
+    def issued(self):
+        return self._issued
+
+
+class Pacer(object):
+    """
+    Cadence of closed model VUs: iteration starts every interval seconds since the start of previous one,
+    the time left after the iteration is slept.
+
+    With throughput set, interval is recalculated before every iteration as number of active VUs divided
+    by target throughput (like JMeter's Constant Throughput Timer), so the total rate stays the same
+    when VUs come and go. Late iteration (response time is longer than interval) isn't caught up.
+    """
+
+    def __init__(self, interval=0, throughput=0, active_source=None):
+        self.interval = interval  # seconds between iteration starts of one VU
+        self.throughput = throughput  # target iterations per second of all active VUs
+        self.active_source = active_source  # callable to get current number of active VUs
+
+    def get_interval(self):
+        if self.throughput:
+            active = self.active_source() if self.active_source else 1
+            return max(active, 1) / float(self.throughput)
+        return self.interval
+
+    def next_start(self, last_start):
+        """
+        :param last_start: actual start of previous iteration of the VU, None for the first one
+        :return: timestamp when next iteration is supposed to start, may be in the past for late VU
+        """
+        if last_start is None:
+            return time.time()
+        return last_start + self.get_interval()
+
+
+def sleep_until(timestamp):
+    delay = timestamp - time.time()
+    if delay > 0:
+        wait_shutdown(delay)
+
+
+async def sleep_async(delay):
+    """
+    asyncio.sleep() which is interrupted by shutdown (with TICK precision)
+    """
+    end_time = time.time() + delay
+    while not graceful() and time.time() < end_time:
+        await asyncio.sleep(min(TICK, end_time - time.time()))
+
+
+CONCURRENCY = "concurrency"
+RATE = "rate"
+
+
+class Segment(object):
+    def __init__(self, duration):
+        self.duration = float(duration)
+        if self.duration <= 0:
+            raise ValueError("Duration of profile segment must be positive")
+
+    def level(self, offset, base):
+        """
+        :param offset: seconds since start of segment
+        :param base: level at the end of previous segment
+        """
+        raise NotImplementedError()
+
+    def end_level(self, base):
+        return self.level(self.duration, base)
+
+    def max_level(self, base):
+        return max(base, self.end_level(base))
+
+
+class RampSegment(Segment):
+    def __init__(self, duration, to, start=None):
+        super(RampSegment, self).__init__(duration)
+        self.to = float(to)
+        self.start = start
+
+    def level(self, offset, base):
+        start = base if self.start is None else float(self.start)
+        return start + (self.to - start) * min(offset / self.duration, 1.0)
+
+    def max_level(self, base):
+        start = base if self.start is None else float(self.start)
+        return max(start, self.to)
+
+
+class HoldSegment(Segment):
+    def __init__(self, duration, level=None):
+        super(HoldSegment, self).__init__(duration)
+        self.hold_level = level
+
+    def level(self, offset, base):
+        return base if self.hold_level is None else float(self.hold_level)
+
+
+class StepSegment(Segment):
+    """ change level from previous one to target with several equal steps, first step is made at once """
+
+    def __init__(self, duration, to, steps=1):
+        super(StepSegment, self).__init__(duration)
+        self.to = float(to)
+        self.steps = int(steps)
+        if self.steps < 1:
+            raise ValueError("Number of steps must be positive")
+
+    def level(self, offset, base):
+        step = min(int(offset * self.steps / self.duration) + 1, self.steps)
+        return base + (self.to - base) * step / self.steps
+
+
+class SpikeSegment(Segment):
+    """ jump to peak level (or rise to it during 'rise' seconds) and return to previous level at the end """
+
+    def __init__(self, duration, to, rise=0):
+        super(SpikeSegment, self).__init__(duration)
+        self.to = float(to)
+        self.rise = float(rise)
+
+    def level(self, offset, base):
+        if offset >= self.duration:
+            return base
+        if self.rise and offset < self.rise:
+            return base + (self.to - base) * offset / self.rise
+        return self.to
+
+    def max_level(self, base):
+        return max(base, self.to)
+
+
+class SineSegment(Segment):
+    def __init__(self, duration, amplitude, period, base=None):
+        super(SineSegment, self).__init__(duration)
+        self.amplitude = float(amplitude)
+        self.period = float(period)
+        self.base = base
+
+    def level(self, offset, base):
+        middle = base if self.base is None else float(self.base)
+        return max(middle + self.amplitude * math.sin(2 * math.pi * offset / self.period), 0.0)
+
+    def end_level(self, base):
+        return base if self.base is None else float(self.base)
+
+    def max_level(self, base):
+        middle = base if self.base is None else float(self.base)
+        return max(base, middle + abs(self.amplitude))
+
+
+SEGMENTS = {
+    "ramp": RampSegment,
+    "hold": HoldSegment,
+    "step": StepSegment,
+    "spike": SpikeSegment,
+    "sine": SineSegment,
+}
+
+
+class LoadProfile(object):
+    """
+    Piecewise load shape: level of concurrency or arrival rate as function of time since start
+
+    Every segment continues from the level where previous one ended, e.g.::
+
+        {"target": "concurrency", "segments": [
+            {"type": "ramp", "duration": 60, "to": 50},
+            {"type": "hold", "duration": 600},
+            {"type": "spike", "duration": 30, "to": 200},
+            {"type": "sine", "duration": 300, "amplitude": 20, "period": 60},
+            {"type": "step", "duration": 90, "to": 20, "steps": 3}]}
+    """
+
+    def __init__(self, segments, target=CONCURRENCY, start=0, scale=1.0):
+        if target not in (CONCURRENCY, RATE):
+            raise ValueError("Unknown profile target: %s" % target)
+        if not segments:
+            raise ValueError("Profile must have at least one segment")
+
+        self.target = target
+        self.segments = segments
+        self.start = float(start)
+        self.scale = scale  # share of the load for one of several distributed agents
+
+    @classmethod
+    def from_dict(cls, data):
+        segments = []
+        for segment in data.get("segments", []):
+            segment = dict(segment)
+            segment_type = segment.pop("type", None)
+            if segment_type not in SEGMENTS:
+                raise ValueError("Unknown profile segment type: %s" % segment_type)
+            if "from" in segment:
+                segment["start"] = segment.pop("from")
+            try:
+                segments.append(SEGMENTS[segment_type](**segment))
+            except TypeError as exc:
+                raise ValueError("Wrong parameters of %s segment: %s" % (segment_type, exc))
+
+        return cls(segments, target=data.get("target", CONCURRENCY), start=data.get("start", 0))
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as fds:
+            return cls.from_dict(json.load(fds))
+
+    def duration(self):
+        return sum(segment.duration for segment in self.segments)
+
+    def level_at(self, elapsed):
+        """
+        :return: target level or None if profile is over
+        """
+        base = self.start
+        for segment in self.segments:
+            if elapsed < segment.duration:
+                return segment.level(max(elapsed, 0), base) * self.scale
+            elapsed -= segment.duration
+            base = segment.end_level(base)
+
+        return None
+
+    def max_level(self):
+        base = self.start
+        max_level = base
+        for segment in self.segments:
+            max_level = max(max_level, segment.max_level(base))
+            base = segment.end_level(base)
+
+        return max_level * self.scale
+
+
+class Scenario(object):
+    """
+    Test script with its share of VUs (closed model) or arrival rate (open model) in the mix of scenarios
+    """
+
+    def __init__(self, script, weight=1.0, ramp_up=None, label=None):
+        """
+        :param ramp_up: own ramp-up of scenario VUs, None means common one
+        :param label: prefix of sample labels, name of script by default
+        """
+        if weight <= 0:
+            raise ValueError("Weight of scenario must be positive: %s" % script)
+
+        self.script = script
+        self.weight = weight
+        self.ramp_up = ramp_up
+        self.label = label or os.path.splitext(os.path.basename(script.rstrip("/\\")))[0]
+
+    @classmethod
+    def parse(cls, spec):
+        """
+        'script.py[:weight[:ramp_up]]', e.g. 'browse.py:70' or 'checkout.py:5:60'
+        """
+        parts = spec.split(":")
+        numbers = []
+        while len(parts) > 1 and len(numbers) < 2:
+            try:
+                numbers.insert(0, float(parts[-1]))
+            except ValueError:
+                break  # part of path (e.g. drive letter)
+            parts.pop()
+
+        weight = numbers[0] if numbers else 1.0
+        ramp_up = numbers[1] if len(numbers) > 1 else None
+        return cls(":".join(parts), weight, ramp_up)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["script"], data["weight"], data["ramp_up"], data["label"])
+
+    def to_dict(self):
+        return {"script": self.script, "weight": self.weight, "ramp_up": self.ramp_up, "label": self.label}
+
+    def __repr__(self):
+        return "Scenario(%r)" % self.to_dict()
+
+
+def mix_scenarios(weights, count):
+    """
+    Scenario index for each of count VU slots, interleaved (smooth weighted round robin)
+    so every prefix of slots follows the weights as close as possible
+    """
+    total = float(sum(weights))
+    current = [0.0] * len(weights)
+    mix = []
+    for _ in range(count):
+        for idx, weight in enumerate(weights):
+            current[idx] += weight
+        chosen = max(range(len(weights)), key=lambda idx: current[idx])
+        current[chosen] -= total
+        mix.append(chosen)
+
+    return mix
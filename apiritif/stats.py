@@ -0,0 +1,255 @@
+"""
+Aggregated statistics of samples for apiritif-loadgen
+
+Copyright 2022 BlazeMeter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import math
+import threading
+
+HISTOGRAM_MIN = 0.000001  # seconds, smaller values fall into the first bucket
+HISTOGRAM_BASE = 1.01  # bucket bounds grow by 1%, so percentiles are accurate within 1%
+
+
+class Histogram(object):
+    """
+    Distribution of elapsed times in logarithmic buckets, can be merged between workers
+    """
+
+    def __init__(self):
+        self.buckets = {}  # bucket index -> count
+
+    @staticmethod
+    def _bucket(value):
+        if value <= HISTOGRAM_MIN:
+            return 0
+        return int(math.ceil(math.log(value / HISTOGRAM_MIN) / math.log(HISTOGRAM_BASE)))
+
+    @staticmethod
+    def _upper_bound(bucket):
+        return HISTOGRAM_MIN * HISTOGRAM_BASE ** bucket
+
+    def add(self, value):
+        bucket = self._bucket(value)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def merge(self, other):
+        """
+        :type other: Histogram
+        """
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+
+    def count(self):
+        return sum(self.buckets.values())
+
+    def percentile(self, percent):
+        """
+        :return: value which isn't exceeded by given percent of samples or None if there are no samples
+        """
+        count = self.count()
+        if not count:
+            return None
+
+        rank = max(int(math.ceil(count * percent / 100.0)), 1)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return self._upper_bound(bucket)
+
+    def to_dict(self):
+        return {str(bucket): count for bucket, count in self.buckets.items()}  # JSON keys are strings
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        histogram.buckets = {int(bucket): count for bucket, count in data.items()}
+        return histogram
+
+
+class LabelStats(object):
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.bytes = 0
+        self.elapsed_sum = 0.0
+        self.elapsed_min = None
+        self.elapsed_max = None
+        self.histogram = Histogram()
+        self.corrected = None  # Histogram of latencies measured from intended start (coordinated omission)
+
+    def add(self, elapsed, success, size=0, corrected=None):
+        self.count += 1
+        if not success:
+            self.failures += 1
+        self.bytes += size
+        self.elapsed_sum += elapsed
+        if self.elapsed_min is None or elapsed < self.elapsed_min:
+            self.elapsed_min = elapsed
+        if self.elapsed_max is None or elapsed > self.elapsed_max:
+            self.elapsed_max = elapsed
+        self.histogram.add(elapsed)
+        if corrected is not None:
+            if self.corrected is None:
+                self.corrected = Histogram()
+            self.corrected.add(corrected)
+
+    def merge(self, other):
+        """
+        :type other: LabelStats
+        """
+        self.count += other.count
+        self.failures += other.failures
+        self.bytes += other.bytes
+        self.elapsed_sum += other.elapsed_sum
+        if other.elapsed_min is not None and (self.elapsed_min is None or other.elapsed_min < self.elapsed_min):
+            self.elapsed_min = other.elapsed_min
+        if other.elapsed_max is not None and (self.elapsed_max is None or other.elapsed_max > self.elapsed_max):
+            self.elapsed_max = other.elapsed_max
+        self.histogram.merge(other.histogram)
+        if other.corrected is not None:
+            if self.corrected is None:
+                self.corrected = Histogram()
+            self.corrected.merge(other.corrected)
+
+    def elapsed_avg(self):
+        return self.elapsed_sum / self.count if self.count else 0.0
+
+    def to_dict(self):
+        return {
+            "count": self.count, "failures": self.failures, "bytes": self.bytes,
+            "elapsed_sum": self.elapsed_sum, "elapsed_min": self.elapsed_min, "elapsed_max": self.elapsed_max,
+            "histogram": self.histogram.to_dict(),
+            "corrected": None if self.corrected is None else self.corrected.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        for key, value in data.items():
+            if key in ("histogram", "corrected"):
+                value = None if value is None else Histogram.from_dict(value)
+            setattr(stats, key, value)
+        return stats
+
+
+class Summary(object):
+    """
+    Per-label totals of the run, can be merged between workers
+    """
+
+    def __init__(self):
+        self.labels = {}
+        self.start_time = None
+        self.end_time = None
+
+    def add(self, label, start_time, elapsed, success, size=0, corrected=None):
+        stats = self.labels.get(label)
+        if stats is None:
+            stats = self.labels[label] = LabelStats()
+        stats.add(elapsed, success, size, corrected)
+
+        if self.start_time is None or start_time < self.start_time:
+            self.start_time = start_time
+        end_time = start_time + elapsed
+        if self.end_time is None or end_time > self.end_time:
+            self.end_time = end_time
+
+    def merge(self, other):
+        """
+        :type other: Summary
+        """
+        for label, stats in other.labels.items():
+            self.labels.setdefault(label, LabelStats()).merge(stats)
+
+        if other.start_time is not None and (self.start_time is None or other.start_time < self.start_time):
+            self.start_time = other.start_time
+        if other.end_time is not None and (self.end_time is None or other.end_time > self.end_time):
+            self.end_time = other.end_time
+
+    def to_dict(self):
+        return {
+            "labels": {label: stats.to_dict() for label, stats in self.labels.items()},
+            "start_time": self.start_time,
+            "end_time": self.end_time}
+
+    @classmethod
+    def from_dict(cls, data):
+        summary = cls()
+        summary.labels = {label: LabelStats.from_dict(stats) for label, stats in data["labels"].items()}
+        summary.start_time = data["start_time"]
+        summary.end_time = data["end_time"]
+        return summary
+
+    def total(self):
+        total = LabelStats()
+        for stats in self.labels.values():
+            total.merge(stats)
+        return total
+
+    def duration(self):
+        if self.start_time is None:
+            return 0.0
+        return self.end_time - self.start_time
+
+    def report(self):
+        """
+        :return: lines of human readable table
+        """
+        duration = self.duration()
+        corrected = any(stats.corrected is not None for stats in self.labels.values())
+        template = "%-40s %10s %10s %10s %10s %10s %10s %10s" + (" %10s" if corrected else "")
+        header = ("label", "count", "failed", "hits/s", "avg, ms", "min, ms", "max, ms", "p99, ms")
+        lines = [template % (header + (("cor.p99",) if corrected else ()))]
+        rows = sorted(self.labels.items()) + [("TOTAL", self.total())]
+        for label, stats in rows:
+            row = (
+                label[:40], stats.count, stats.failures,
+                "%.2f" % (stats.count / duration if duration else 0),
+                int(1000 * stats.elapsed_avg()),
+                int(1000 * (stats.elapsed_min or 0)),
+                int(1000 * (stats.elapsed_max or 0)),
+                int(1000 * (stats.histogram.percentile(99) or 0)))
+            if corrected:
+                row += (int(1000 * (stats.corrected.percentile(99) or 0)) if stats.corrected else "",)
+            lines.append(template % row)
+        return lines
+
+
+class Timeline(object):
+    """
+    Summaries of every second (by sample start time) for live reporting.
+    Writer thread adds samples while reporter takes finished seconds away.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self._lock = threading.Lock()
+
+    def add(self, label, start_time, elapsed, success, size=0, corrected=None):
+        with self._lock:
+            second = self.seconds.setdefault(int(start_time), Summary())
+            second.add(label, start_time, elapsed, success, size, corrected)
+
+    def merge(self, second, summary):
+        with self._lock:
+            self.seconds.setdefault(second, Summary()).merge(summary)
+
+    def pop(self, before=None):
+        """
+        :return: sorted (second, Summary) pairs older than 'before' (all of them by default)
+        """
+        with self._lock:
+            seconds = sorted(second for second in self.seconds if before is None or second < before)
+            return [(second, self.seconds.pop(second)) for second in seconds]
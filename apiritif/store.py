@@ -3,8 +3,9 @@ import time
 import traceback
 
 import apiritif
+import apiritif.thread as thread
 from apiritif.samples import ApiritifSampleExtractor, Sample, PathComponent
-from apiritif.utils import get_trace
+from apiritif.utils import DeadlineExceeded, NormalShutdown, get_trace
 
 writer = None
 
@@ -22,6 +23,7 @@ class SampleController(object):
         self.end_time = None
         self.test_info = {}
         self.session = session
+        self.interrupted = False  # by deadline, the rest of iteration isn't written
 
     def startTest(self):
         self.current_sample = Sample(
@@ -33,6 +35,12 @@ class SampleController(object):
             "full_name": self.test_info["test_fqn"],
             "description": self.test_info["description"]
         })
+        scheduled_start = thread.get_scheduled_start()
+        if scheduled_start is not None:  # open model or pacing: keep both moments to see scheduler lag
+            self.current_sample.extras.update({
+                "scheduledStartTime": scheduled_start,
+                "iterationStartTime": thread.get_iteration_start()
+            })
         if "." in self.test_info["class_method"]:  # TestClass.test_method
             class_name, method_name = self.test_info["class_method"].split('.')[:2]
             self.current_sample.path.extend([
@@ -61,6 +69,28 @@ class SampleController(object):
             self.current_sample.add_assertion(assertion_name, {"args": [], "kwargs": {}})
             self.current_sample.set_assertion_failed(assertion_name, error_msg, error_trace)
 
+    def reportError(self, error):
+        """
+        Uncaught exception of test, NormalShutdown stops VU
+        """
+        assertion_name = error[0].__name__
+        error_msg = str(error[1]).split('\n')[0]
+        error_trace = get_trace(error)
+        if isinstance(error[1], NormalShutdown):
+            self.session.set_stop_reason(f"{error[1].__class__.__name__} for vu #{thread.get_index()}: {error_msg}")
+            self.current_sample = None  # partial data mustn't be written
+        elif isinstance(error[1], DeadlineExceeded):
+            self.interrupted = True
+            if self.current_sample is not None:  # written as cut-off sample
+                self.current_sample.status = "INTERRUPTED"
+                self.current_sample.error_msg = error_msg
+                self.current_sample.error_trace = error_trace
+        else:
+            if self.current_sample is not None:
+                self.addError(assertion_name, error_msg, error_trace)
+            else:  # error in test infrastructure (e.g. module setup())
+                self.log.error("\n".join((assertion_name, error_msg, error_trace)))
+
     def addSuccess(self, is_transaction=False):
         if self.tran_mode == is_transaction:
             self.current_sample.status = "PASSED"
@@ -76,6 +106,8 @@ class SampleController(object):
                 self._process_sample(self.current_sample)
 
             self.current_sample = None
+            if self.interrupted:
+                self.session.set_stop_reason(f"{DeadlineExceeded.__name__} for vu #{thread.get_index()}")
 
     def _process_apiritif_samples(self, sample):
         samples = []
@@ -97,4 +129,10 @@ class SampleController(object):
         return len(samples)
 
     def _process_sample(self, sample):
+        lag = thread.get_start_lag()
+        if lag is not None:  # requests of late iteration are late too (coordinated omission)
+            sample.set_intended_start(lag)
+        label = thread.get_scenario_label()
+        if label:
+            sample.set_scenario(label)
         writer.add(sample, self.test_count, self.success_count)
@@ -14,12 +14,56 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+from contextvars import ContextVar
 from threading import local
 
 from apiritif.action_plugins import BaseActionHandler
 
+_vu_context = ContextVar("apiritif_vu", default=None)
+
+
+class VULocal(object):
+    """
+    Replacement of threading.local which is separate for every VU: thread of ThreadPool or asyncio task
+    """
+
+    def __init__(self):
+        object.__setattr__(self, "_thread_data", local())
+
+    def _get_data(self):
+        vu_data = _vu_context.get()
+        if vu_data is None:
+            return self._thread_data
+
+        data = vu_data.get(id(self))
+        if data is None:
+            data = vu_data[id(self)] = _Namespace()
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._get_data(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._get_data(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self._get_data(), name)
+
+
+class _Namespace(object):
+    pass
+
+
+def init_vu_context():
+    """
+    Has to be called at the beginning of asyncio task which represents VU.
+    Task works with a copy of context, so it doesn't affect other ones.
+    """
+    _vu_context.set({})
+
+
 _total = 1
-_thread_local = local()
+_thread_local = VULocal()
 
 
 def set_total(total):
@@ -41,6 +85,22 @@ def get_index():
     return index
 
 
+def set_scenario(scenario, label=None):
+    """
+    :param label: prefix of sample labels when several scenarios are mixed
+    """
+    _thread_local.scenario = scenario
+    _thread_local.scenario_label = label
+
+
+def get_scenario():
+    return getattr(_thread_local, "scenario", 0)
+
+
+def get_scenario_label():
+    return getattr(_thread_local, "scenario_label", None)
+
+
 def set_iteration(iteration):
     _thread_local.iteration = iteration
 
@@ -50,6 +110,29 @@ def get_iteration():
     return iteration
 
 
+def set_iteration_start(actual, scheduled=None):
+    _thread_local.iteration_start = actual
+    _thread_local.scheduled_start = scheduled
+
+
+def get_iteration_start():
+    return getattr(_thread_local, "iteration_start", None)
+
+
+def get_scheduled_start():
+    return getattr(_thread_local, "scheduled_start", None)
+
+
+def get_start_lag():
+    """
+    How late current iteration has started against its schedule, None if there is no schedule
+    """
+    scheduled = get_scheduled_start()
+    if scheduled is None:
+        return None
+    return max(get_iteration_start() - scheduled, 0.0)
+
+
 def get_stage():
     return get_from_thread_store("stage")
 
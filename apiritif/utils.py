@@ -17,6 +17,9 @@ import os
 import sys
 import re
 import logging
+import signal
+import threading
+import time
 import traceback
 
 VERSION = "1.1.3"
@@ -36,15 +39,140 @@ def get_trace(error):
     return ''.join(lines).rstrip()
 
 
+GRACEFUL_POLL = 0.1  # interval of GRACEFUL file checks, seconds
+
+_shutdown = threading.Event()  # the only thing hot paths look at
+_watchers = 0  # somebody sets _shutdown for us, there's no need to look at GRACEFUL file in graceful()
+
+
 def graceful():
+    if _shutdown.is_set():
+        return True
+    if not _watchers:  # e.g. functional mode, nobody watches the file
+        return _graceful_file_exists()
+    return False
+
+
+def _graceful_file_exists():
     graceful_file_name = os.environ.get('GRACEFUL')
     graceful_flag = graceful_file_name and os.path.exists(graceful_file_name)
     return graceful_flag
 
+
+def request_shutdown(reason):
+    """
+    Stop the test gracefully: VUs finish their transactions and teardown steps
+    """
+    if not _shutdown.is_set():
+        log.info("Graceful shutdown: %s", reason)
+        _shutdown.set()
+
+
+def reset_shutdown():
+    _shutdown.clear()
+
+
+def wait_shutdown(timeout):
+    """
+    Interruptible sleep
+
+    :return: True if shutdown is requested
+    """
+    return _shutdown.wait(timeout)
+
+
+class GracefulWatcher(threading.Thread):
+    """
+    Sets shutdown flag when GRACEFUL file appears or when event of parent process is set,
+    so graceful() doesn't need to look at the file every time
+    """
+
+    def __init__(self, event=None):
+        """
+        :type event: multiprocessing.Event
+        """
+        super(GracefulWatcher, self).__init__(name=self.__class__.__name__)
+        self.daemon = True
+        self.event = event
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set() and not _shutdown.is_set():
+            if self.event is not None:
+                if self.event.wait(GRACEFUL_POLL):
+                    request_shutdown("requested by parent process")
+            elif _graceful_file_exists():
+                request_shutdown("%s is found" % os.environ.get('GRACEFUL'))
+            else:
+                _shutdown.wait(GRACEFUL_POLL)
+
+    def start(self):
+        global _watchers
+        _watchers += 1
+        super(GracefulWatcher, self).start()
+
+    def stop(self):
+        global _watchers
+        _watchers -= 1
+        self._stopped.set()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def handle_signals():
+    """
+    SIGTERM and the first SIGINT stop the test gracefully, the second SIGINT interrupts it.
+    Has to be called from the main thread.
+    """
+
+    def handler(signum, frame):
+        if signum == signal.SIGINT and _shutdown.is_set():
+            raise KeyboardInterrupt()
+        request_shutdown("signal %s" % signum)
+
+    signal.signal(signal.SIGTERM, handler)
+    signal.signal(signal.SIGINT, handler)
+
+
 class NormalShutdown(BaseException):
     pass
 
 
+class DeadlineExceeded(BaseException):
+    """
+    Test has run out of its time, the iteration is cut off
+    """
+    pass
+
+
+_deadline = None  # timestamp when in-flight iterations have to be interrupted
+
+
+def set_deadline(timestamp):
+    global _deadline
+    _deadline = timestamp
+
+
+def time_left():
+    """
+    :return: seconds until deadline or None if there is no deadline
+    """
+    return None if _deadline is None else _deadline - time.time()
+
+
+def check_deadline():
+    """
+    Cooperative interruption point, called before transactions and requests
+    """
+    if _deadline is not None and time.time() >= _deadline:
+        raise DeadlineExceeded("Test deadline is reached")
+
+
 def headers_as_text(headers_dict):
     return "\n".join("%s: %s" % (key, value) for key, value in headers_dict.items())
 
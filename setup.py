@@ -36,6 +36,9 @@ setup(
     download_url='https://github.com/Blazemeter/apiritif',
     docs_url='https://github.com/Blazemeter/apiritif',
     install_requires=requirements,
+    extras_require={
+        'zstd': ['zstandard'],
+    },
     entry_points={
         'pytest11': [
             'pytest_apiritif = apiritif.pytest_plugin',
@@ -0,0 +1,23 @@
+import asyncio
+import unittest
+
+import apiritif
+from apiritif.thread import get_index, get_iteration
+
+
+class TestAsyncRequests(unittest.IsolatedAsyncioTestCase):
+    async def test_transactions(self):
+        """ Transactions of concurrent VUs """
+        vu_index = get_index()
+        with apiritif.transaction("vu-%s" % vu_index):
+            await asyncio.sleep(0.01)
+            self.assertEqual(vu_index, get_index())  # other VUs have run meanwhile
+
+    def test_sync(self):
+        pass  # isn't coroutine, asyncio executor skips it
+
+
+async def test_function():
+    iteration = get_iteration()
+    await asyncio.sleep(0.01)
+    assert iteration == get_iteration()
@@ -0,0 +1,6 @@
+import asyncio
+
+
+async def test_async_steps():
+    for _ in range(100):
+        await asyncio.sleep(0.1)  # no interruption points, VU is cancelled
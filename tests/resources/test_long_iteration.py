@@ -0,0 +1,12 @@
+import time
+import unittest
+
+import apiritif
+
+
+class TestLongIteration(unittest.TestCase):
+    def test_steps(self):
+        """ Iteration is much longer than test duration """
+        for step in range(100):
+            with apiritif.transaction("step-%s" % step):
+                time.sleep(0.1)
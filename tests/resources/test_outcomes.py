@@ -0,0 +1,26 @@
+import unittest
+
+import apiritif
+
+
+class TestOutcomes(unittest.TestCase):
+    def setUp(self):
+        self.value = 1
+
+    def test_1_success(self):
+        """ Passed test """
+        with apiritif.transaction("tran"):
+            self.assertEqual(1, self.value)
+
+    def test_2_failure(self):
+        self.assertEqual(2, self.value)
+
+    def test_3_error(self):
+        raise ValueError("broken")
+
+    def test_4_skip(self):
+        self.skipTest("not now")
+
+
+def test_function():
+    pass
@@ -0,0 +1,78 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from apiritif.capacity import CapacitySearch, EVALUATION_DELAY
+from apiritif.control import ControlBlock
+from apiritif.schedule import RATE
+from apiritif.stats import Summary
+
+
+def _second(count, elapsed, failures=0):
+    summary = Summary()
+    for idx in range(count):
+        summary.add("login", 0, elapsed, idx >= failures)
+    return summary
+
+
+class TestCapacitySearch(TestCase):
+    def _run(self, search, latency, until=1000):
+        """
+        Emulate the run: latency(level) is response time of the system under test
+        """
+        now = 100
+        while not search.control.is_finished() and now < until:
+            search.tick(now)
+            level = search.plateaus[-1].level
+            search.add(now, _second(10, latency(level)))
+            now += 1
+        return now
+
+    def test_knee(self):
+        control = ControlBlock(2)
+        report = tempfile.NamedTemporaryFile(suffix=".json", delete=False).name
+        search = CapacitySearch(control, [10, 10], start=2, step=2, plateau=10, settle=3, sla_p95=500,
+                                report=report)
+        try:
+            end = self._run(search, lambda level: 0.1 * level)  # 0.6 s at 6 VUs
+            with open(report) as fds:
+                result = json.load(fds)
+        finally:
+            os.remove(report)
+
+        self.assertTrue(control.is_finished())
+        self.assertEqual(4, search.knee)
+        self.assertEqual(4, result["knee"])
+        self.assertEqual([2, 4, 6], [plateau["level"] for plateau in result["plateaus"]])
+        self.assertEqual([True, True, False], [plateau["passed"] for plateau in result["plateaus"]])
+        self.assertEqual(70, result["plateaus"][0]["samples"])  # 7 measured seconds
+        self.assertEqual(10, result["plateaus"][0]["throughput"])
+        self.assertEqual(130 + EVALUATION_DELAY + 1, end)  # breach is found soon after the plateau
+        self.assertEqual(4, len(search.curve()))
+
+    def test_max_level(self):
+        control = ControlBlock(1)
+        search = CapacitySearch(control, [5], target=RATE, start=10, step=10, max_level=30, plateau=5, settle=1)
+        self._run(search, lambda level: 0.01)
+        self.assertEqual(30, search.knee)
+        self.assertEqual(30, control.rate(0))
+
+    def test_errors(self):
+        control = ControlBlock(1)
+        search = CapacitySearch(control, [5], start=1, step=1, plateau=5, settle=1, sla_errors=5)
+        now = 100
+        while not control.is_finished():
+            search.tick(now)
+            level = search.plateaus[-1].level
+            search.add(now, _second(10, 0.1, failures=level - 1))  # 10% errors at level 2
+            now += 1
+
+        self.assertEqual(1, search.knee)
+        self.assertIn("errors", search.plateaus[1].reason)
+        self.assertEqual(3, control.concurrency(0))  # next levels were applied until the breach was found
+
+    def test_wrong_settings(self):
+        control = ControlBlock(1)
+        self.assertRaises(ValueError, CapacitySearch, control, [1], step=0)
+        self.assertRaises(ValueError, CapacitySearch, control, [1], step=1, plateau=5, settle=5)
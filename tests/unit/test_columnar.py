@@ -0,0 +1,142 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from apiritif import columnar
+from apiritif.columnar import ChunkEncoder, ColumnarReader, convert, read_samples
+from apiritif.loadgen import ColumnarSampleWriter, JTLSampleWriter, LDJSONSampleWriter
+from apiritif.samples import PathComponent, Sample
+
+
+def get_sample(idx, status="PASSED"):
+    sample = Sample(test_suite="TestSuite", test_case="test_%s" % idx, status=status, start_time=1000.5 + idx,
+                    duration=0.25)
+    sample.path = [PathComponent("module", "test_module"), PathComponent("method", "test_%s" % idx)]
+    sample.extras = {"full_name": "test_module.TestSuite.test_%s" % idx, "intendedStartTime": 1000.0 + idx}
+
+    request = Sample(test_suite="test_%s" % idx, test_case="http://blazedemo.com/", status=status,
+                     start_time=1000.5 + idx, duration=0.125)
+    request.path = sample.path + [PathComponent("request", "http://blazedemo.com/")]
+    request.extras = {"requestMethod": "GET", "requestURI": "http://blazedemo.com/", "responseCode": 200,
+                      "responseMessage": "OK", "responseHeadersSize": 100, "responseBodySize": 1000,
+                      "responseBody": "<html>%s</html>" % idx, "requestHeaders": {"Accept": "*/*"}}
+    request.add_assertion("status", {"args": [200], "kwargs": {}})
+    if status != "PASSED":
+        request.set_assertion_failed("status", "Status code isn't 200", "Traceback: ...")
+    sample.add_subsample(request)
+    return sample
+
+
+class TestColumnar(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def _write(self, samples, blobs=False):
+        filename = os.path.join(self.tmpdir, "result.arb")
+        writer = ColumnarSampleWriter(filename, blobs)
+        writer.write_all((sample, 4, 2) for sample in samples)
+        return filename
+
+    def test_round_trip(self):
+        samples = [get_sample(idx, "PASSED" if idx % 3 else "FAILED") for idx in range(10)]
+        encoder = ChunkEncoder(blobs=True)
+        data = [columnar.MAGIC]
+        for idx, sample in enumerate(samples):
+            encoder.add(sample, idx, 1)
+            if idx % 4 == 3:
+                data.append(encoder.pop_chunk())  # strings of the first chunk are used by the next ones
+        data.append(encoder.pop_chunk())
+
+        filename = os.path.join(self.tmpdir, "result.arb")
+        with open(filename, "wb") as fds:
+            fds.write(b"".join(data))
+
+        records = list(read_samples(filename))
+        self.assertEqual([(idx, 1) for idx in range(10)], [(threads, grp) for _, threads, grp in records])
+        for original, (sample, _, _) in zip(samples, records):
+            self.assertEqual(original.to_dict(), sample.to_dict())
+            self.assertIs(sample, sample.subsamples[0].parent_sample)
+
+    def test_strings_reset(self):
+        samples = [get_sample(idx) for idx in range(6)]  # every one has its own label, path and URL
+        encoder = ChunkEncoder(blobs=True)
+        encoder.max_strings = 10
+        data = [columnar.MAGIC]
+        resets = 0
+        for sample in samples:
+            encoder.add(sample)
+            data.append(encoder.pop_chunk())
+            resets += encoder._reset
+        self.assertEqual(3, resets)  # table gets more than 10 strings with every two samples
+
+        filename = os.path.join(self.tmpdir, "result.arb")
+        with open(filename, "wb") as fds:
+            fds.write(b"".join(data))
+
+        records = list(read_samples(filename))
+        self.assertEqual([sample.to_dict() for sample in samples], [sample.to_dict() for sample, _, _ in records])
+
+    def test_no_blobs(self):
+        sample = read_samples(self._write([get_sample(1, "FAILED")])).__next__()[0]
+        request = sample.subsamples[0]
+        self.assertEqual("FAILED", request.status)
+        self.assertEqual("Status code isn't 200", request.error_msg)
+        self.assertEqual({"requestMethod": "GET", "requestURI": "http://blazedemo.com/", "responseCode": 200,
+                          "responseMessage": "OK", "responseHeadersSize": 100, "responseBodySize": 1000},
+                         request.extras)  # no bodies and headers
+        self.assertEqual([], request.assertions)
+        self.assertEqual("request", request.path[-1].type)
+
+    def test_truncated(self):
+        filename = os.path.join(self.tmpdir, "result.arb")
+        encoder = ChunkEncoder()
+        with open(filename, "wb") as fds:
+            fds.write(columnar.MAGIC)
+            for idx in range(3):
+                encoder.add(get_sample(idx))
+                fds.write(encoder.pop_chunk())
+            fds.truncate(fds.tell() - 5)  # crash while writing the last chunk
+
+        self.assertEqual(["test_0", "test_1"], [sample.test_case for sample, _, _ in read_samples(filename)])
+
+        with open(filename, "rb") as fds:
+            data = bytearray(fds.read())
+        data[len(columnar.MAGIC) + columnar.FRAME.size + 1] ^= 0xFF
+        with open(filename, "wb") as fds:
+            fds.write(data)
+        self.assertRaises(ValueError, list, read_samples(filename))
+
+        with open(filename, "wb") as fds:
+            fds.write(b"timeStamp,elapsed,Latency,label,responseCode,responseMessage,success\n")
+        with open(filename, "rb") as fds:
+            self.assertRaises(ValueError, ColumnarReader, fds)
+
+    def test_convert(self):
+        samples = [get_sample(idx, "PASSED" if idx % 2 else "FAILED") for idx in range(20)]
+        source = self._write(samples, blobs=True)
+
+        for ext, writer_class in ((".csv", JTLSampleWriter), (".ldjson", LDJSONSampleWriter)):
+            converted = os.path.join(self.tmpdir, "converted" + ext)
+            expected = os.path.join(self.tmpdir, "expected" + ext)
+            convert(source, converted)
+            writer_class(expected).write_all((sample, 4, 2) for sample in samples)
+            with open(converted) as fds, open(expected) as expected_fds:
+                if ext == ".csv":
+                    self.assertEqual(expected_fds.read(), fds.read())
+                else:  # order of extras differs
+                    self.assertEqual([json.loads(line) for line in expected_fds], [json.loads(line) for line in fds])
+
+        with open(os.path.join(self.tmpdir, "converted.ldjson")) as fds:
+            ldjson_size = len(fds.read())
+        self.assertLess(os.path.getsize(self._write(samples * 50)), ldjson_size * 50 / 10)
+
+    def test_writer(self):
+        filename = os.path.join(self.tmpdir, "result.arb")
+        writer = ColumnarSampleWriter(filename)
+        with writer:
+            for idx in range(5):
+                writer.add(get_sample(idx), idx, idx)
+        self.assertEqual(["test_%s" % idx for idx in range(5)],
+                         [sample.test_case for sample, _, _ in read_samples(filename)])
+        self.assertEqual(5, writer.summary.total().count)
@@ -0,0 +1,72 @@
+import gzip
+import os
+import tempfile
+from unittest import TestCase, skipIf, skipUnless
+
+from apiritif import compression
+from apiritif.compression import get_blocks, get_codec, open_input, open_output, read_block, strip_extension
+
+
+def write_blocks(filename, blocks):
+    with open_output(filename, 1) as fds:
+        for block in blocks:
+            fds.write(block)
+            fds.flush()
+
+
+class TestCompression(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.blocks = [("line %s\n" % idx * (idx + 1)).encode() for idx in range(5)]
+
+    def _check_file(self, filename):
+        write_blocks(filename, self.blocks)
+        with open_input(filename) as fds:
+            self.assertEqual(b"".join(self.blocks), fds.read())
+
+        blocks = get_blocks(filename)
+        self.assertEqual(5, len(blocks))
+        self.assertEqual(self.blocks, [read_block(filename, offset, size) for offset, size in blocks])
+
+        offset, size = blocks[-1]
+        with open(filename, "r+b") as fds:
+            fds.truncate(offset + size - 1)  # crash while writing the last block
+        with open_input(filename) as fds:
+            self.assertEqual(b"".join(self.blocks[:-1]), fds.read())
+
+    def test_strip_extension(self):
+        self.assertEqual("result-0.ldjson", strip_extension("result-0.ldjson.gz"))
+        self.assertEqual("result-0.csv", strip_extension("result-0.csv.ZST"))
+        self.assertEqual("result-0.csv", strip_extension("result-0.csv"))
+        self.assertIsNone(get_codec("result-0.csv"))
+
+    def test_gzip(self):
+        filename = os.path.join(self.tmpdir, "result.ldjson.gz")
+        write_blocks(filename, self.blocks)
+        with gzip.open(filename) as fds:  # blocks are usual gzip members
+            self.assertEqual(b"".join(self.blocks), fds.read())
+        self._check_file(filename)
+
+    def test_block_size(self):
+        filename = os.path.join(self.tmpdir, "result.csv.gz")
+        with open_output(filename, 1) as fds:
+            for _ in range(10):
+                fds.write(b"x" * 300)  # block is written when it reaches 1 KB
+        self.assertEqual(3, len(get_blocks(filename)))
+        with open_input(filename) as fds:
+            self.assertEqual(b"x" * 3000, fds.read())
+
+    def test_foreign_gzip(self):
+        filename = os.path.join(self.tmpdir, "result.csv.gz")
+        with gzip.open(filename, "wb") as fds:
+            fds.write(b"compressed by gzip")
+        with open_input(filename) as fds:
+            self.assertEqual(b"compressed by gzip", fds.read())
+
+    @skipUnless(compression.zstandard, "zstandard isn't installed")
+    def test_zstd(self):
+        self._check_file(os.path.join(self.tmpdir, "result.ldjson.zst"))
+
+    @skipIf(compression.zstandard, "zstandard is installed")
+    def test_no_zstd(self):
+        self.assertRaises(ValueError, get_codec, "result.ldjson.zst")
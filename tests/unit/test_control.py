@@ -0,0 +1,140 @@
+import json
+import socket
+from unittest import TestCase
+
+from apiritif.control import Balancer, ControlBlock, ControlServer, ProfileDriver, VUCounters, apply_level
+from apiritif.control import REBALANCE_FLOOR
+from apiritif.control import split_capped, split_int, split_float
+from apiritif.schedule import LoadProfile, RATE
+
+
+class TestControl(TestCase):
+    def test_split(self):
+        self.assertEqual([3, 4, 3], split_int(10, [1, 1, 1]))
+        self.assertEqual([0, 1, 0], split_int(1, [1, 1, 1]))
+        self.assertEqual([0, 7], split_int(7, [0, 5]))
+        self.assertEqual(100, sum(split_int(100, [3, 7, 11, 1])))
+        self.assertEqual([2.5, 7.5], split_float(10, [1, 3]))
+        self.assertEqual([2, 8], split_capped(10, [1, 1], [2, 10]))
+        self.assertEqual([2, 10], split_capped(15, [1, 1], [2, 10]))
+        self.assertEqual([1, 1], split_capped(2, [0, 0], [5, 5]))
+
+    def test_profile_driver(self):
+        profile = LoadProfile.from_dict({"segments": [
+            {"type": "ramp", "duration": 10, "to": 10},
+            {"type": "hold", "duration": 10}]})
+        control = ControlBlock(2)
+        driver = ProfileDriver(profile, control, [5, 5])
+
+        driver.tick(now=100)
+        self.assertEqual([0, 0], [control.concurrency(0), control.concurrency(1)])
+        driver.tick(now=105)
+        self.assertEqual([2, 3], [control.concurrency(0), control.concurrency(1)])
+        driver.tick(now=115)
+        self.assertEqual([5, 5], [control.concurrency(0), control.concurrency(1)])
+        self.assertFalse(control.is_finished())
+        driver.tick(now=120)
+        self.assertTrue(control.is_finished())
+
+    def test_rate_profile_driver(self):
+        profile = LoadProfile.from_dict({"target": "rate", "segments": [{"type": "hold", "duration": 1, "level": 9}]})
+        control = ControlBlock(2)
+        driver = ProfileDriver(profile, control, [1, 2])
+        driver.tick(now=100)
+        self.assertEqual([3, 6], [control.rate(0), control.rate(1)])
+
+    def test_balancer(self):
+        control = ControlBlock(3)
+        capacities = [10, 10, 4]
+        weights = list(capacities)
+        apply_level(control, "concurrency", 15, capacities, weights)
+        self.assertEqual([6, 6, 3], [control.concurrency(idx) for idx in range(3)])
+
+        balancer = Balancer(control, capacities, weights=weights, interval=5)
+        control.set_heat(0, 1.5)
+        control.set_heat(1, 0.7)
+        control.set_heat(2, 0.2)
+        balancer.tick(now=100)
+        balancer.tick(now=102)
+        self.assertEqual(0, balancer.moves)  # interval isn't over
+
+        balancer.tick(now=105)
+        self.assertEqual([5, 6, 4], [control.concurrency(idx) for idx in range(3)])
+        balancer.tick(now=110)  # the coldest one has no free VUs
+        self.assertEqual([4, 7, 4], [control.concurrency(idx) for idx in range(3)])
+        self.assertEqual(15, sum(control.concurrency(idx) for idx in range(3)))
+
+        self.assertEqual([6.8, 11.6, 5.6], [round(weight, 3) for weight in weights])  # 1/15 of total weight per VU
+        apply_level(control, "concurrency", 20, capacities, weights)  # driver keeps new shares
+        self.assertEqual([7, 9, 4], [control.concurrency(idx) for idx in range(3)])
+
+        control.set_heat(0, 0.5)
+        balancer.tick(now=115)  # nobody is saturated
+        self.assertEqual(2, balancer.moves)
+
+    def test_rate_balancer(self):
+        control = ControlBlock(2)
+        control.set_rate(0, 10)
+        control.set_rate(1, 10)
+        control.set_heat(1, 3)
+        balancer = Balancer(control, [5, 5], target=RATE, interval=0)
+        balancer.tick(now=100)
+        self.assertEqual([11, 9], [control.rate(0), control.rate(1)])
+        self.assertEqual([5.5, 4.5], balancer.weights)
+
+    def test_balancer_low_level(self):
+        control = ControlBlock(3)
+        capacities = [10, 10, 1]
+        weights = list(capacities)
+        apply_level(control, "concurrency", 3, capacities, weights)
+        self.assertEqual([1, 2, 0], [control.concurrency(idx) for idx in range(3)])
+
+        balancer = Balancer(control, capacities, weights=weights, interval=0)
+        control.set_heat(1, 1.5)
+        control.set_heat(2, 0.5)
+        balancer.tick(now=100)
+        self.assertEqual([2, 1, 0], [control.concurrency(idx) for idx in range(3)])
+        self.assertEqual(1, weights[2])  # idle worker keeps its share
+
+        apply_level(control, "concurrency", 15, capacities, weights)
+        self.assertEqual([10, 4, 1], [control.concurrency(idx) for idx in range(3)])
+
+        for now in range(101, 120):
+            balancer.tick(now=now)
+        self.assertGreaterEqual(weights[1], capacities[1] * REBALANCE_FLOOR)
+
+    def test_vu_counters(self):
+        counters = VUCounters(2, scenario_count=3)
+        counters.add(0, 1)
+        counters.add(0, 1, scenario=2)
+        counters.add(1, 2, scenario=2)
+        counters.add(1, -1, scenario=2)
+        self.assertEqual([2, 1], [counters.worker(0), counters.worker(1)])
+        self.assertEqual([1, 0, 2], [counters.scenario(idx) for idx in range(3)])
+        self.assertEqual(3, counters.total())
+
+        control = ControlBlock(2)
+        control.vus.add(1, 5)
+        self.assertEqual([0, 5], [control.active(0), control.active(1)])
+
+    def test_control_server(self):
+        control = ControlBlock(1)
+
+        def handler(command, args):
+            if command == "pause":
+                control.set_paused(True)
+            elif command != "status":
+                raise ValueError("Unknown command: %s" % command)
+            return {"paused": control.is_paused()}
+
+        server = ControlServer(("127.0.0.1", 0), handler)
+        server.start()
+        try:
+            with socket.create_connection(server.address) as conn, conn.makefile("rwb") as stream:
+                stream.write(b"status\n\nPAUSE\nwrong\n")
+                stream.flush()
+                self.assertEqual({"paused": False}, json.loads(stream.readline()))
+                self.assertEqual({"paused": True}, json.loads(stream.readline()))  # empty line is skipped
+                self.assertEqual({"error": "Unknown command: wrong"}, json.loads(stream.readline()))
+        finally:
+            server.close()
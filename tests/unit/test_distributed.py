@@ -0,0 +1,220 @@
+import io
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+from contextlib import redirect_stderr
+from unittest import TestCase
+
+from apiritif.distributed import Agent, Controller, pack_bundle, unpack_bundle, parse_address, get_controller_params
+from apiritif.distributed import read_message, send_message
+from apiritif.loadgen import Params, get_option_parser
+from apiritif.utils import request_shutdown, reset_shutdown
+from tests.unit import RESOURCES_DIR
+
+
+class TestDistributed(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _start_agent(self, idx):
+        agent = Agent(("127.0.0.1", 0), os.path.join(self.tmp_dir, "agent%s-%%s.ldjson" % idx))
+        agent_thread = threading.Thread(target=self._serve, args=(agent,))
+        agent_thread.daemon = True
+        agent_thread.start()
+        return agent, agent_thread
+
+    @staticmethod
+    def _serve(agent):
+        try:
+            agent.serve_once()
+        except ConnectionError:
+            pass  # controller has refused to run
+
+    def test_parse_address(self):
+        self.assertEqual(("host", 1234), parse_address("host:1234"))
+        self.assertEqual(("0.0.0.0", 1234), parse_address(":1234", "0.0.0.0"))
+        self.assertEqual(("127.0.0.1", 1234), parse_address(":1234"))  # agent isn't exposed unless asked
+        self.assertEqual(("host", 8500), parse_address("host"))
+
+    def test_bundle(self):
+        bundle, names = pack_bundle([os.path.join(RESOURCES_DIR, "test_dummy.py"), os.path.join(RESOURCES_DIR, "data")])
+        self.assertEqual(["test_dummy.py", "data"], names)
+
+        unpack_bundle(bundle, self.tmp_dir)
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir, "test_dummy.py")))
+        self.assertTrue(os.listdir(os.path.join(self.tmp_dir, "data")))
+
+    def test_two_agents(self):
+        agents = [self._start_agent(idx) for idx in range(2)]
+
+        params = Params()
+        params.concurrency = 3
+        params.iterations = 2
+        params.tests = [os.path.join(RESOURCES_DIR, "test_dummy.py")]
+
+        controller = Controller(params, [agent.address for agent, _ in agents])
+        controller.run()
+        for agent, agent_thread in agents:
+            agent_thread.join(5)
+            agent.close()
+
+        self.assertEqual(12, controller.summary.total().count)  # 3 VUs, 2 iterations, 2 samples each
+        live_count = sum(summary.total().count for summary in controller.timeline.seconds.values())
+        self.assertEqual(12, live_count)
+
+        reports = sorted(report for reports in controller.reports.values() for report in reports)
+        self.assertEqual(2, len(reports))
+        with open(reports[0]) as fds:
+            first = fds.readlines()
+        with open(reports[1]) as fds:
+            second = fds.readlines()
+        self.assertEqual({4, 8}, {len(first), len(second)})  # 3 VUs split as 1 + 2 or 2 + 1
+
+    def test_too_many_agents(self):
+        agents = [self._start_agent(idx) for idx in range(2)]
+        params = Params()
+        params.concurrency = 1
+        params.tests = [os.path.join(RESOURCES_DIR, "test_dummy.py")]
+
+        controller = Controller(params, [agent.address for agent, _ in agents])
+        self.assertRaises(ValueError, controller.run)
+        for agent, _ in agents:
+            agent.close()
+
+    def test_target_concurrency(self):
+        params = Params()
+        params.concurrency = 50  # --max-concurrency 50 --concurrency 10
+        params.target_concurrency = 10
+        params.tests = [os.path.join(RESOURCES_DIR, "test_dummy.py")]
+
+        controller = Controller(params, [("box1", 8500), ("box2", 8500)])
+        tasks = list(controller._get_tasks([1, 1], "", ["test_dummy.py"]))
+        self.assertEqual([25, 25], [task["params"]["concurrency"] for task in tasks])
+        self.assertEqual([5, 5], [task["params"]["target_concurrency"] for task in tasks])
+
+        params.target_concurrency = None
+        tasks = list(controller._get_tasks([1, 1], "", ["test_dummy.py"]))
+        self.assertEqual([None, None], [task["params"]["target_concurrency"] for task in tasks])
+
+    def test_rebalance(self):
+        params = Params()
+        params.concurrency = 20  # --rebalance --hold-for 60 --concurrency 10
+        params.target_concurrency = 10
+        params.rebalance = True
+        params.hold_for = 60
+        params.tests = [os.path.join(RESOURCES_DIR, "test_dummy.py")]
+
+        controller = Controller(params, [("box1", 8500), ("box2", 8500)])
+        tasks = list(controller._get_tasks([1, 1], "", ["test_dummy.py"]))
+        self.assertEqual([5, 5], [task["params"]["target_concurrency"] for task in tasks])
+        self.assertEqual([True, True], [task["params"]["rebalance"] for task in tasks])
+
+        agent = Agent(("127.0.0.1", 0), os.path.join(self.tmp_dir, "result-%s.ldjson"))
+        agent_params = agent._get_params(dict(tasks[0], workers="2"), self.tmp_dir)
+        agent.close()
+        self.assertEqual((10, 5, True), (agent_params.concurrency, agent_params.target_concurrency,
+                                         agent_params.rebalance))
+
+    def test_no_capacity_search(self):
+        parser = get_option_parser()
+        test = os.path.join(RESOURCES_DIR, "test_dummy.py")
+        opts, args = parser.parse_args(["--concurrency", "10", "--search-step", "5", "--sla-p95", "500", test])
+        with redirect_stderr(io.StringIO()):
+            self.assertRaises(SystemExit, get_controller_params, parser, opts, args)
+
+        opts, args = parser.parse_args(["--concurrency", "10", "--hold-for", "60", test])
+        self.assertEqual(10, get_controller_params(parser, opts, args).concurrency)
+
+    def test_local_options(self):
+        parser = get_option_parser()
+        test = os.path.join(RESOURCES_DIR, "test_dummy.py")
+        for option in (["--control-port", "8501"], ["--cpu-affinity", "auto"], ["--writer-cpu", "0"]):
+            opts, args = parser.parse_args(["--concurrency", "10"] + option + [test])
+            with redirect_stderr(io.StringIO()):
+                self.assertRaises(SystemExit, get_controller_params, parser, opts, args)
+
+    def test_file_params(self):
+        params = Params()
+        params.concurrency = 4
+        params.health_report = "/home/user/health-%s.ldjson"
+        params.tests = [os.path.join(RESOURCES_DIR, "test_dummy.py")]
+
+        controller = Controller(params, [("box1", 8500), ("box2", 8500)])
+        task = next(controller._get_tasks([1, 1], "", ["test_dummy.py"]))
+        self.assertEqual("health-%s.ldjson", task["params"]["health_report"])  # path of controller box is dropped
+
+        agent = Agent(("127.0.0.1", 0), os.path.join(self.tmp_dir, "result-%s.ldjson"))
+        agent_params = agent._get_params(dict(task, workers="1"), self.tmp_dir)
+        agent.close()
+        self.assertEqual(os.path.join(self.tmp_dir, "health-%s.ldjson"), agent_params.health_report)
+        self.assertIsNone(agent_params.failures_report)
+
+    def test_unavailable_agent(self):
+        agent, agent_thread = self._start_agent(0)
+        closed = socket.socket()
+        closed.bind(("127.0.0.1", 0))
+        address = closed.getsockname()
+        closed.close()  # nobody listens there
+
+        params = Params()
+        params.concurrency = 2
+        params.tests = [os.path.join(RESOURCES_DIR, "test_dummy.py")]
+        controller = Controller(params, [agent.address, address])
+        self.assertRaises(ConnectionError, controller.run)
+        agent_thread.join(5)
+        self.assertFalse(agent_thread.is_alive())  # connection to the first agent is closed
+        agent.close()
+
+    def test_controller_disconnected(self):
+        agent, agent_thread = self._start_agent(0)
+        params = Params()
+        params.concurrency = 1
+        params.iterations = sys.maxsize
+        params.hold_for = 30
+        params.tests = [os.path.join(RESOURCES_DIR, "test_dummy.py")]
+        controller = Controller(params, [agent.address])
+        try:
+            with socket.create_connection(agent.address) as conn, conn.makefile("rwb") as stream:
+                hello = read_message(stream, "hello")
+                bundle, names = pack_bundle(params.tests)
+                send_message(stream, next(controller._get_tasks([hello["cpu_count"]], bundle, names)))
+                read_message(stream, "ready")
+                send_message(stream, {"type": "start"})
+                read_message(stream, "stats")
+                conn.shutdown(socket.SHUT_RDWR)  # controller is gone in the middle of the run (forked workers share fd)
+
+            agent_thread.join(20)
+            self.assertFalse(agent_thread.is_alive())
+            self.assertNotIn("Supervisor", [thread.name for thread in threading.enumerate()])  # workers are stopped
+        finally:
+            agent.close()
+            reset_shutdown()
+
+    def test_shutdown_is_reset(self):
+        request_shutdown("previous run was stopped")
+        graceful_file = os.path.join(self.tmp_dir, "graceful")
+        with open(graceful_file, "w"):
+            pass
+        os.environ["GRACEFUL"] = graceful_file
+        try:
+            agent, agent_thread = self._start_agent(0)
+            params = Params()
+            params.concurrency = 1
+            params.iterations = 2
+            params.tests = [os.path.join(RESOURCES_DIR, "test_dummy.py")]
+            controller = Controller(params, [agent.address])
+            controller.run()
+            agent_thread.join(5)
+            agent.close()
+        finally:
+            del os.environ["GRACEFUL"]
+            reset_shutdown()
+
+        self.assertEqual(4, controller.summary.total().count)
+        self.assertFalse(os.path.exists(graceful_file))
@@ -0,0 +1,111 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+import apiritif.health as health
+from apiritif.control import ControlBlock, VUCounters
+from apiritif.health import HealthMonitor
+
+
+class DummyWriter(object):
+    def __init__(self):
+        self.vus = VUCounters(1)
+        self.queue = 0
+
+    def queue_size(self):
+        return self.queue
+
+
+class TestHealthMonitor(TestCase):
+    def test_records(self):
+        writer = DummyWriter()
+        writer.vus.add(0, 3)
+        filename = tempfile.NamedTemporaryFile(delete=False).name
+        health.monitor = HealthMonitor(writer, filename=filename, interval=0.2)
+        try:
+            health.monitor.start()
+            health.record_lag(0.01)
+            health.record_lag(0.03)
+            health.record_test_cpu(time.thread_time())
+            time.sleep(0.3)
+            health.monitor.stop()
+            self.assertFalse(health.monitor.saturated)
+
+            with open(filename) as fds:
+                records = [json.loads(line) for line in fds]
+        finally:
+            health.monitor = None
+            os.remove(filename)
+
+        self.assertEqual(2, len(records))
+        first = records[0]
+        self.assertEqual(3, first["vus"])
+        self.assertEqual(2, first["iterations"])
+        self.assertAlmostEqual(0.02, first["lag_avg"])
+        self.assertEqual(0.03, first["lag_max"])
+        self.assertEqual(0, first["queue_depth"])
+        self.assertLess(first["gil_wait_avg"], health.GIL_THRESHOLD)
+        self.assertEqual([], first["saturated"])
+        self.assertIsNone(records[1]["lag_avg"])
+
+    def test_saturation(self):
+        writer = DummyWriter()
+        writer.queue = 5000
+        monitor = HealthMonitor(writer, interval=0.05)
+        monitor.add_lag(1.5)
+        with self.assertLogs("apiritif", "WARNING"):
+            record = monitor._measure()
+
+        self.assertTrue(monitor.saturated)
+        self.assertEqual(["iterations start 1500 ms late", "5000 samples wait for writer"], record["saturated"])
+
+        with self.assertLogs("apiritif", "DEBUG") as logs:
+            record = monitor._measure()
+        self.assertEqual(["5000 samples wait for writer"], record["saturated"])
+        self.assertEqual(["DEBUG"], [entry.levelname for entry in logs.records])  # warned already
+
+        writer.queue = 0
+        with self.assertLogs("apiritif", "INFO") as logs:
+            record = monitor._measure()
+        self.assertEqual([], record["saturated"])
+        self.assertIn("isn't saturated any more", logs.output[0])
+        self.assertTrue(monitor.saturated)  # at least once
+
+    def test_heat(self):
+        control = ControlBlock(2)
+        monitor = HealthMonitor(DummyWriter(), worker_index=1, interval=0.05, control=control)
+        monitor.add_lag(0.2)
+        with self.assertLogs("apiritif", "WARNING"):
+            record = monitor._measure()
+
+        self.assertGreaterEqual(record["heat"], 2.0)  # lag is twice as long as threshold
+        self.assertEqual([0.0, record["heat"]], [control.heat(0), control.heat(1)])
+        self.assertEqual(0.5, health.get_heat({"cpu_load": health.CPU_THRESHOLD / 2, "lag_avg": None}))
+
+    def test_probes(self):
+        sleeps = []
+        saved_sleep = time.sleep
+
+        def sleep(seconds):
+            if threading.current_thread() is threading.main_thread():  # leftovers of other tests may sleep too
+                sleeps.append(seconds)
+            saved_sleep(seconds)
+
+        time.sleep = sleep
+        try:
+            HealthMonitor(DummyWriter(), interval=0.2)._measure()
+            light = len(sleeps)
+            del sleeps[:]
+            HealthMonitor(DummyWriter(), filename=os.devnull, interval=0.2)._measure()
+        finally:
+            time.sleep = saved_sleep
+
+        self.assertLessEqual(light, health.LIGHT_PROBES + 1)  # nobody records GIL wait, a few probes are enough
+        self.assertGreater(len(sleeps), 10)  # 10 ms probes all the interval for health report
+
+    def test_no_monitor(self):
+        health.record_lag(1)  # just ignored
+        health.record_test_cpu(0)
@@ -0,0 +1,39 @@
+import multiprocessing
+import os
+from unittest import TestCase, skipUnless
+
+from apiritif.isolation import available_cpus, isolate_process, parse_cpus, split_cpus
+
+
+def isolated_state(cpus, nice, memory_limit):
+    import resource  # POSIX only
+
+    before = os.nice(0)
+    isolate_process(cpus, nice, memory_limit)
+    return sorted(os.sched_getaffinity(0)), os.nice(0) - before, resource.getrlimit(resource.RLIMIT_AS)[0]
+
+
+class TestIsolation(TestCase):
+    def test_parse_cpus(self):
+        self.assertEqual([0, 1, 2, 3, 6, 8, 9], parse_cpus("0-3,6, 8-9"))
+        self.assertEqual([1, 2], parse_cpus("2,1,2"))
+        self.assertEqual(available_cpus(), parse_cpus("auto"))
+        self.assertRaises(ValueError, parse_cpus, "")
+        self.assertRaises(ValueError, parse_cpus, "1-x")
+
+    def test_split_cpus(self):
+        self.assertEqual([[0, 1], [2, 3]], split_cpus([0, 1, 2, 3], 2))
+        self.assertEqual([[0], [1, 2]], split_cpus([0, 1, 2], 2))
+        self.assertEqual([[1], [2], [3]], split_cpus([0, 1, 2, 3], 3, exclude=0))
+        self.assertEqual([[0], [1], [0]], split_cpus([0, 1], 3))
+        self.assertEqual([[0], [0]], split_cpus([0], 2, exclude=0))  # nothing else to use
+
+    @skipUnless(hasattr(os, "sched_setaffinity") and hasattr(os, "nice"), "no process limits on this platform")
+    def test_isolate_process(self):
+        cpu = available_cpus()[0]
+        with multiprocessing.Pool(1) as pool:  # limits can't be undone, so apply them to another process
+            cpus, nice, memory = pool.apply(isolated_state, ([cpu], 1, 4096))
+
+        self.assertEqual([cpu], cpus)
+        self.assertEqual(1, nice)
+        self.assertEqual(4096 * 1024 * 1024, memory)
@@ -1,16 +1,31 @@
 import copy
+import csv
+import gzip
+import json
 import logging
+import multiprocessing
 import os
+import socket
+import sys
 import tempfile
 import time
 import threading
-from unittest import TestCase
+import urllib.request
+from unittest import TestCase, skipUnless
 from multiprocessing.pool import CLOSE
 
 import apiritif
 from apiritif import store, thread
 from apiritif.samples import Sample
-from apiritif.loadgen import Worker, Params, Supervisor, JTLSampleWriter
+from apiritif.loadgen import Worker, Params, Supervisor, JTLSampleWriter, LDJSONSampleWriter, SampleQueue
+from apiritif.loadgen import AggregatingSampleWriter, ColumnarSampleWriter, STATS_DELAY, get_report_name, read_buckets
+from apiritif.loadgen import get_option_parser, options_to_params
+from apiritif.columnar import read_samples
+from apiritif.control import ControlBlock, ControlServer
+from apiritif.isolation import available_cpus
+from apiritif.schedule import LoadProfile, Scenario
+from apiritif.stats import Summary
+from apiritif.utils import graceful, request_shutdown, reset_shutdown
 from tests.unit import RESOURCES_DIR
 
 dummy_tests = [os.path.join(RESOURCES_DIR, "test_dummy.py")]
@@ -36,6 +51,121 @@ class TestLoadGen(TestCase):
         worker = Worker(params)
         worker.run_nose(params)
 
+    def _graceful_run(self, target):
+        graceful_file = os.path.join(tempfile.mkdtemp(), "graceful")
+        os.environ["GRACEFUL"] = graceful_file
+        timer = threading.Timer(1, lambda: open(graceful_file, "w").close())
+        try:
+            timer.start()
+            start_time = time.time()
+            target()
+            return time.time() - start_time
+        finally:
+            timer.cancel()
+            del os.environ["GRACEFUL"]
+            os.remove(graceful_file)
+            reset_shutdown()
+
+    def test_graceful_worker(self):
+        outfile = tempfile.NamedTemporaryFile()
+        params = Params()
+        params.concurrency = 3
+        params.iterations = sys.maxsize
+        params.ramp_up = 10  # the last VU waits for its start meanwhile
+        params.hold_for = 30
+        params.report = outfile.name
+        params.tests = dummy_tests
+
+        def run():
+            worker = Worker(params)
+            worker.start()
+            worker.join()
+
+        self.assertLess(self._graceful_run(run), 5)
+        self.assertFalse(graceful())
+
+    def test_graceful_supervisor(self):
+        outfile = tempfile.NamedTemporaryFile()
+        params = Params()
+        params.concurrency = 2
+        params.worker_count = 2
+        params.iterations = sys.maxsize
+        params.hold_for = 30
+        params.report = outfile.name + "%s"
+        params.tests = dummy_tests
+
+        def run():
+            supervisor = Supervisor(params)
+            supervisor.start()
+            supervisor.join()
+
+        self.assertLess(self._graceful_run(run), 5)
+
+    def test_control_channel(self):
+        outfile = tempfile.NamedTemporaryFile()
+        params = Params()
+        params.concurrency = 4
+        params.target_concurrency = 1
+        params.worker_count = 2
+        params.iterations = sys.maxsize
+        params.hold_for = 30
+        params.report = outfile.name + "%s"
+        params.tests = dummy_tests
+        with socket.socket() as sock:  # find free port
+            sock.bind(("127.0.0.1", 0))
+            params.control_port = sock.getsockname()[1]
+
+        supervisor = Supervisor(params)
+        supervisor.start()
+        try:
+            for _ in range(50):
+                if supervisor.control_server:
+                    break
+                time.sleep(0.1)
+
+            with socket.create_connection(supervisor.control_server.address) as conn:
+                stream = conn.makefile("rwb")
+
+                def command(line):
+                    stream.write(line.encode() + b"\n")
+                    stream.flush()
+                    return json.loads(stream.readline())
+
+                self.assertEqual(1, command("status")["target_vus"])
+                self.assertEqual(3, command("vus 3")["target_vus"])
+                time.sleep(1)
+                self.assertEqual(3, command("status")["active_vus"])
+                self.assertEqual(4, command("vus 100")["target_vus"])  # limited by pool size
+                self.assertIn("error", command("rate 10"))
+                self.assertIn("error", command("dance"))
+
+                self.assertTrue(command("pause")["paused"])
+                time.sleep(1)
+                self.assertEqual(0, command("status")["active_vus"])
+                self.assertFalse(command("resume")["paused"])
+
+                self.assertTrue(command("stop")["stopping"])
+            supervisor.join(5)
+            self.assertFalse(supervisor.is_alive())
+        finally:
+            reset_shutdown()
+
+    def test_status_before_start(self):
+        supervisor = Supervisor(Params())
+        supervisor.control = ControlBlock(1)
+        supervisor.capacities = [1]
+        server = ControlServer(("127.0.0.1", 0), supervisor.handle_command)  # workers aren't started yet
+        server.start()
+        try:
+            with socket.create_connection(server.address) as conn, conn.makefile("rwb") as stream:
+                stream.write(b"status\n")
+                stream.flush()
+                status = json.loads(stream.readline())
+            self.assertIsNone(status["elapsed"])
+            self.assertEqual(1, status["max_vus"])
+        finally:
+            server.close()
+
     def test_setup_teardown_graceful(self):
         error_tests = [os.path.join(RESOURCES_DIR, "setup_teardown_graceful.py")]
 
@@ -115,6 +245,165 @@ class TestLoadGen(TestCase):
         while sup.is_alive():
             time.sleep(1)
 
+    def test_supervisor_threads(self):
+        outfile = tempfile.NamedTemporaryFile()
+        outfile.close()
+        params = Params()
+        params.tests = dummy_tests
+        params.report = outfile.name + "-%s.csv"
+        params.concurrency = 4
+        params.worker_count = 2
+        params.iterations = sys.maxsize
+        params.hold_for = 1
+        sup = Supervisor(params)
+        sup.start()
+        sup.join()
+
+        reports = [outfile.name + "-%s.csv" % idx for idx in range(params.worker_count)]
+        try:
+            for report in reports:
+                with open(report) as fds:
+                    rows = list(csv.DictReader(fds))
+                self.assertEqual(4, max(int(row["allThreads"]) for row in rows))  # VUs of both workers
+                self.assertEqual(4, max(int(row["grpThreads"]) for row in rows))  # the only scenario
+        finally:
+            for report in reports:
+                os.remove(report)
+
+    def test_supervisor_metrics(self):
+        outfile = tempfile.NamedTemporaryFile()
+        params = Params()
+        params.tests = dummy_tests
+        params.report = outfile.name + "%s"
+        params.concurrency = 2
+        params.worker_count = 2
+        params.iterations = sys.maxsize
+        params.hold_for = 5
+        with socket.socket() as sock:  # find free port
+            sock.bind(("127.0.0.1", 0))
+            params.metrics_port = sock.getsockname()[1]
+
+        sup = Supervisor(params)
+        sup.start()
+        snapshot = {}
+        try:
+            while sup.is_alive() and not snapshot.get("labels"):
+                time.sleep(0.5)
+                try:
+                    with urllib.request.urlopen("http://127.0.0.1:%s/" % params.metrics_port) as response:
+                        snapshot = json.loads(response.read().decode("utf-8"))
+                except OSError:
+                    pass  # isn't started yet
+        finally:
+            request_shutdown("test is over")
+            sup.join()
+            reset_shutdown()
+
+        self.assertIn("tran name", snapshot["labels"])
+        self.assertGreater(snapshot["total"]["throughput"], 0)
+        self.assertIn("p99_ms", snapshot["total"])
+
+    def test_capacity_search(self):
+        outfile = tempfile.NamedTemporaryFile()
+        report = outfile.name + ".json"
+        parser = get_option_parser()
+        opts, args = parser.parse_args([
+            "--concurrency", "1", "--search-step", "1", "--search-max", "2", "--search-plateau", "1",
+            "--search-settle", "0", "--search-report", report, "--sla-p95", "10000",
+            "--result-file-template", outfile.name + "%s"] + dummy_tests)
+        params = options_to_params(parser, opts, args)
+        self.assertEqual(2, params.concurrency)
+        self.assertEqual(1, params.target_concurrency)
+
+        sup = Supervisor(params)
+        sup.start()
+        sup.join()
+        try:
+            with open(report) as fds:
+                result = json.load(fds)
+        finally:
+            os.remove(report)
+
+        self.assertEqual(2, result["knee"])
+        self.assertEqual([1, 2], [plateau["level"] for plateau in result["plateaus"]])
+        self.assertTrue(all(plateau["samples"] for plateau in result["plateaus"]))
+
+    def test_isolation_options(self):
+        outfile = tempfile.NamedTemporaryFile()
+        outfile.close()
+        parser = get_option_parser()
+        opts, args = parser.parse_args([
+            "--concurrency", "2", "--workers", "2", "--iterations", "2", "--cpu-affinity", "auto",
+            "--writer-cpu", "0", "--nice", "1", "--memory-limit", "4096",
+            "--result-file-template", outfile.name + "%s"] + dummy_tests)
+        params = options_to_params(parser, opts, args)
+        self.assertEqual(available_cpus(), params.cpus)
+        self.assertEqual(1, params.nice)
+
+        sup = Supervisor(params)
+        sup.start()
+        sup.join()
+        try:
+            self.assertEqual(8, sup.summary.total().count)
+        finally:
+            for idx in range(params.worker_count):
+                os.remove(outfile.name + str(idx))
+
+    def test_rebalance(self):
+        outfile = tempfile.NamedTemporaryFile()
+        outfile.close()
+        parser = get_option_parser()
+        opts, args = parser.parse_args([
+            "--concurrency", "2", "--workers", "2", "--pacing", "0.5", "--hold-for", "1", "--rebalance",
+            "--result-file-template", outfile.name + "%s"] + dummy_tests)
+        params = options_to_params(parser, opts, args)
+        self.assertEqual(4, params.concurrency)  # room for moved VUs
+        self.assertEqual(2, params.target_concurrency)
+
+        sup = Supervisor(params)
+        sup.start()
+        sup.join()
+        try:
+            self.assertIsNotNone(sup.balancer)
+            self.assertEqual(8, sup.summary.total().count)  # 2 VUs, 2 iterations, 2 tests, spare VUs are idle
+        finally:
+            for idx in range(params.worker_count):
+                os.remove(outfile.name + str(idx))
+
+    def test_supervisor_rate(self):
+        outfile = tempfile.NamedTemporaryFile()
+        outfile.close()
+        params = Params()
+        params.tests = dummy_tests
+        params.report = outfile.name + ".ldjson"
+        params.concurrency = 4
+        params.worker_count = 2
+        params.rate = 40
+        params.iterations = 20
+        sup = Supervisor(params)
+        sup.start()
+        sup.join()
+
+        reports = [outfile.name + "-%s.ldjson" % idx for idx in range(params.worker_count)]
+        try:
+            for report in reports:
+                with open(report) as fds:
+                    self.assertEqual(20, len(fds.readlines()))  # half of iterations, two test cases each
+
+            self.assertEqual(40, sup.summary.total().count)  # case + transaction for each iteration
+            self.assertEqual({"tran name", "test_case2"}, set(sup.summary.labels))
+        finally:
+            for report in reports:
+                os.remove(report)
+
+    def test_report_name(self):
+        self.assertEqual("result-1.csv", get_report_name("result-%s.csv", 1, 2))
+        self.assertEqual("result-1.csv", get_report_name("result.csv", 1, 2))
+        self.assertEqual("result.csv", get_report_name("result.csv", 0, 1))
+        self.assertEqual("result-1.ldjson.gz", get_report_name("result.ldjson.gz", 1, 2))
+        self.assertEqual("out-0.arb.zst", get_report_name("out.arb.zst", 0, 2))
+        self.assertEqual("result-1.gz", get_report_name("result.gz", 1, 2))
+
     def test_empty_supervisor(self):
         outfile = tempfile.NamedTemporaryFile()
         params = Params()
@@ -233,6 +522,381 @@ class TestLoadGen(TestCase):
         res1 = [x.delay for x in worker1._get_thread_params()]
         self.assertEquals(params1.concurrency, len(res1))
 
+    def test_rate(self):
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+        params = Params()
+        params.concurrency = 2
+        params.rate = 20
+        params.iterations = 10
+        params.report = outfile.name
+        params.tests = dummy_tests
+
+        worker = Worker(params)
+        start = time.time()
+        worker.start()
+        worker.join()
+        self.assertGreater(time.time() - start, 0.4)  # 10 arrivals with 50ms interval
+
+        with open(outfile.name) as fds:
+            samples = [json.loads(line) for line in fds.readlines()]
+
+        self.assertEqual(20, len(samples))  # two test cases per iteration
+        scheduled = sorted(set(sample["extras"]["scheduledStartTime"] for sample in samples))
+        self.assertEqual(10, len(scheduled))
+        for sample in samples:
+            self.assertGreaterEqual(sample["extras"]["iterationStartTime"], sample["extras"]["scheduledStartTime"])
+            self.assertLessEqual(sample["extras"]["intendedStartTime"], sample["start_time"])
+            for subsample in sample["subsamples"]:
+                self.assertLessEqual(subsample["extras"]["intendedStartTime"], subsample["start_time"])
+
+        self.assertIsNotNone(worker.summary.total().corrected)
+
+    def test_throughput(self):
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+        params = Params()
+        params.concurrency = 2
+        params.throughput = 10
+        params.iterations = sys.maxsize
+        params.hold_for = 1
+        params.report = outfile.name
+        params.tests = dummy_tests
+
+        worker = Worker(params)
+        worker.start()
+        worker.join()
+
+        with open(outfile.name) as fds:
+            samples = [json.loads(line) for line in fds.readlines()]
+
+        self.assertAlmostEqual(20, len(samples), delta=4)  # ~10 iterations, two samples each
+        starts = sorted(set(sample["extras"]["scheduledStartTime"] for sample in samples))
+        self.assertAlmostEqual(10, len(starts), delta=2)
+        self.assertAlmostEqual(0.1, (starts[-1] - starts[0]) / (len(starts) - 1), delta=0.02)
+
+    def test_health_report(self):
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+        health_file = outfile.name + ".health"
+        params = Params()
+        params.concurrency = 2
+        params.rate = 10
+        params.iterations = 15
+        params.report = outfile.name
+        params.health_report = health_file
+        params.tests = dummy_tests
+        params.executor = "direct"
+
+        worker = Worker(params)
+        worker.start()
+        worker.join()
+
+        try:
+            with open(health_file) as fds:
+                records = [json.loads(line) for line in fds]
+        finally:
+            os.remove(health_file)
+
+        self.assertGreaterEqual(len(records), 1)
+        self.assertEqual(15, sum(record["iterations"] or 0 for record in records))
+        self.assertGreater(sum(record["test_cpu"] for record in records), 0)
+        self.assertTrue(all(record["lag_max"] is None or record["lag_max"] < 0.1 for record in records))
+
+    def test_warmup(self):
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+        params = Params()
+        params.concurrency = 1
+        params.pacing = 0.1
+        params.iterations = sys.maxsize
+        params.hold_for = 0.5
+        params.warmup = 0.5
+        params.report = outfile.name
+        params.tests = dummy_tests
+        params.executor = "direct"
+
+        start_time = time.time()
+        worker = Worker(params)
+        worker.start()
+        worker.join()
+        self.assertGreater(time.time() - start_time, 0.85)  # hold-for goes after warm-up (the last pace is skipped)
+
+        with open(outfile.name) as fds:
+            samples = [json.loads(line) for line in fds.readlines()]
+        self.assertAlmostEqual(10, len(samples), delta=2)  # 5 measured iterations, 2 tests each
+        self.assertTrue(all(sample["start_time"] >= start_time + 0.5 for sample in samples))
+        self.assertEqual(len(samples), worker.summary.total().count)
+
+    def test_keep_warmup(self):
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+        params = Params()
+        params.concurrency = 1
+        params.iterations = 3
+        params.warmup = 60  # longer than the test
+        params.keep_warmup = True
+        params.report = outfile.name
+        params.tests = dummy_tests
+
+        worker = Worker(params)
+        worker.start()
+        worker.join()
+
+        with open(outfile.name) as fds:
+            samples = [json.loads(line) for line in fds.readlines()]
+        self.assertEqual(6, len(samples))
+        self.assertTrue(all(sample["extras"]["warmup"] for sample in samples))
+        self.assertEqual(0, worker.summary.total().count)
+
+    def test_rate_thread_params(self):
+        outfile = tempfile.NamedTemporaryFile()
+        params = Params()
+        params.concurrency = 10
+        params.rate = 5
+        params.ramp_up = 60
+        params.report = outfile.name
+        params.tests = dummy_tests
+
+        worker = Worker(params)
+        self.assertEqual([0] * 10, [x.delay for x in worker._get_thread_params()])
+
+    def test_scenario_mix(self):
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+        params = Params()
+        params.concurrency = 4
+        params.iterations = 1
+        params.report = outfile.name
+        params.scenarios = [Scenario(dummy_tests[0], 3), Scenario(os.path.join(RESOURCES_DIR, "test_outcomes.py"))]
+        params.tests = [scenario.script for scenario in params.scenarios]
+        params.executor = "direct"
+
+        worker = Worker(params)
+        self.assertEqual([0, 0, 1, 0], [vu.scenario for vu in worker._get_thread_params()])
+        worker.start()
+        worker.join()
+
+        with open(outfile.name) as fds:
+            samples = [json.loads(line) for line in fds.readlines()]
+        scenarios = [sample["extras"]["scenario"] for sample in samples]
+        self.assertEqual(6, scenarios.count("test_dummy"))  # 3 VUs, 2 tests
+        self.assertEqual(5, scenarios.count("test_outcomes"))  # 1 VU, 5 tests
+        self.assertIn("test_dummy: test_case2", worker.summary.labels)
+        self.assertIn("test_outcomes: tran", worker.summary.labels)
+
+    def test_scenario_ramp_up(self):
+        outfile = tempfile.NamedTemporaryFile()
+        params = Params()
+        params.concurrency = 4
+        params.ramp_up = 2
+        params.hold_for = 1
+        params.report = outfile.name
+        params.scenarios = [Scenario(dummy_tests[0], 3, ramp_up=6), Scenario(dummy_tests[0])]
+        params.tests = [scenario.script for scenario in params.scenarios]
+
+        worker = Worker(params)
+        self.assertEqual(7, params.duration())  # the longest ramp-up
+        self.assertEqual([0, 2, 0, 4], [vu.delay for vu in worker._get_thread_params()])
+
+    def test_scenario_rate(self):
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+        params = Params()
+        params.concurrency = 4
+        params.rate = 40
+        params.iterations = 8
+        params.report = outfile.name
+        params.scenarios = [Scenario(dummy_tests[0], 3), Scenario(os.path.join(RESOURCES_DIR, "test_outcomes.py"))]
+        params.tests = [scenario.script for scenario in params.scenarios]
+        params.executor = "direct"
+
+        worker = Worker(params)
+        self.assertEqual([30, 10], [schedule.rate for schedule in worker.schedules])
+        worker.start()
+        worker.join()
+
+        with open(outfile.name) as fds:
+            scenarios = [json.loads(line)["extras"]["scenario"] for line in fds.readlines()]
+        self.assertEqual(12, scenarios.count("test_dummy"))  # 6 arrivals, 2 tests
+        self.assertEqual(10, scenarios.count("test_outcomes"))  # 2 arrivals, 5 tests
+
+    def test_profile(self):
+        outfile = tempfile.NamedTemporaryFile()
+        params = Params()
+        params.concurrency = 3
+        params.iterations = 0
+        params.report = outfile.name
+        params.tests = dummy_tests
+        params.profile = LoadProfile.from_dict({"segments": [
+            {"type": "hold", "duration": 0.5, "level": 1},
+            {"type": "step", "duration": 0.5, "to": 3}]})
+
+        worker = Worker(params)
+        start = time.time()
+        worker.start()
+        worker.join()
+        self.assertGreater(time.time() - start, 1)
+
+        with open(outfile.name) as fds:
+            threads = [int(row["allThreads"]) for row in csv.DictReader(fds)]
+        self.assertEqual(1, threads[0])
+        self.assertEqual(3, max(threads))
+
+    def test_rate_profile(self):
+        outfile = tempfile.NamedTemporaryFile()
+        params = Params()
+        params.concurrency = 2
+        params.iterations = 0
+        params.report = outfile.name
+        params.tests = dummy_tests
+        params.profile = LoadProfile.from_dict({"target": "rate", "segments": [
+            {"type": "hold", "duration": 1, "level": 10}]})
+
+        worker = Worker(params)
+        worker.start()
+        worker.join()
+
+        with open(outfile.name) as fds:
+            samples = list(csv.DictReader(fds))
+        self.assertAlmostEqual(20, len(samples), delta=4)  # ~10 iterations, two samples each
+
+    def test_reuse_suite(self):
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+        params = Params()
+        params.concurrency = 2
+        params.iterations = 5
+        params.report = outfile.name
+        params.tests = dummy_tests
+        params.reuse_suite = True
+
+        worker = Worker(params)
+        worker.start()
+        worker.join()
+
+        with open(outfile.name) as fds:
+            samples = [json.loads(line) for line in fds.readlines()]
+        self.assertEqual(20, len(samples))
+        self.assertEqual(10, len([sample for sample in samples if sample["test_case"] == "test_case1"]))
+
+    def test_reuse_empty_suite(self):
+        outfile = tempfile.NamedTemporaryFile()
+        params = Params()
+        params.concurrency = 1
+        params.iterations = 2
+        params.report = outfile.name
+        params.tests = [os.path.join(RESOURCES_DIR, "test_invalid.py")]
+        params.reuse_suite = True
+
+        worker = Worker(params)
+        self.assertRaises(RuntimeError, worker.start)
+
+    def test_direct_executor(self):
+        def run(executor):
+            outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+            params = Params()
+            params.concurrency = 2
+            params.iterations = 2
+            params.report = outfile.name
+            params.tests = [os.path.join(RESOURCES_DIR, "test_outcomes.py")]
+            params.executor = executor
+
+            worker = Worker(params)
+            worker.start()
+            worker.join()
+
+            with open(outfile.name) as fds:
+                samples = [json.loads(line) for line in fds.readlines()]
+
+            for sample in samples:  # everything but timing has to be the same
+                del sample["start_time"], sample["duration"]
+                for subsample in sample["subsamples"]:
+                    del subsample["start_time"], subsample["duration"]
+                for assertion in sample["assertions"]:
+                    assertion["error_trace"] = assertion["error_trace"].splitlines()[-1:]
+                sample["error_trace"] = (sample["error_trace"] or "").splitlines()[-1:]
+            return sorted(samples, key=lambda smp: smp["test_case"])
+
+        samples = run("direct")
+        self.assertEqual(run("nose2"), samples)
+        self.assertEqual(20, len(samples))
+        statuses = {sample["test_case"]: sample["status"] for sample in samples}
+        self.assertEqual({"test_1_success": "PASSED", "test_2_failure": "FAILED", "test_3_error": "FAILED",
+                          "test_4_skip": "SKIPPED", "test_function": "PASSED"}, statuses)
+
+    def test_asyncio_executor(self):
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+        params = Params()
+        params.concurrency = 3
+        params.iterations = 2
+        params.report = outfile.name
+        params.tests = [os.path.join(RESOURCES_DIR, "test_async.py")]
+        params.executor = "asyncio"
+
+        worker = Worker(params)
+        worker.start()
+        worker.join()
+
+        with open(outfile.name) as fds:
+            samples = [json.loads(line) for line in fds.readlines()]
+
+        self.assertEqual(12, len(samples))  # two coroutine tests by 3 VUs, 2 iterations each
+        self.assertTrue(all(sample["status"] == "PASSED" for sample in samples))  # VU state is isolated
+        labels = set(sample["test_case"] for sample in samples)
+        self.assertEqual({"test_transactions", "test_function"}, labels)
+
+    def _run_long_iteration(self, executor, script="test_long_iteration.py"):
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+        params = Params()
+        params.concurrency = 2
+        params.iterations = sys.maxsize
+        params.hold_for = 1
+        params.report = outfile.name
+        params.tests = [os.path.join(RESOURCES_DIR, script)]
+        params.executor = executor
+
+        start_time = time.time()
+        worker = Worker(params)
+        worker.start()
+        worker.join()
+        duration = time.time() - start_time
+
+        with open(outfile.name) as fds:
+            samples = [json.loads(line) for line in fds.readlines()]
+
+        return duration, samples
+
+    def test_deadline_interrupts_iteration(self):
+        duration, samples = self._run_long_iteration("nose2")
+        self.assertLess(duration, 3)  # iteration is 10 seconds long
+        self.assertEqual(2, len(samples))  # one cut-off sample per VU
+        self.assertTrue(all(sample["status"] == "INTERRUPTED" for sample in samples))
+        self.assertTrue(all("deadline" in sample["error_msg"] for sample in samples))
+
+    def test_deadline_direct_executor(self):
+        duration, samples = self._run_long_iteration("direct")
+        self.assertLess(duration, 3)
+        self.assertEqual(["INTERRUPTED"] * 2, [sample["status"] for sample in samples])
+
+    def test_deadline_asyncio_executor(self):
+        duration, samples = self._run_long_iteration("asyncio", "test_long_async_iteration.py")
+        self.assertLess(duration, 4)  # VUs are cancelled after abandon delay
+        self.assertEqual(["INTERRUPTED"] * 2, [sample["status"] for sample in samples])
+
+    def test_deadline_grace(self):
+        params = Params()
+        self.assertIsNone(params.deadline(100))  # limited by iterations
+        params.ramp_up = 10
+        params.hold_for = 20
+        self.assertEqual(130, params.deadline(100))
+        params.deadline_grace = 5
+        self.assertEqual(135, params.deadline(100))
+
+    def test_asyncio_nothing_to_test(self):
+        outfile = tempfile.NamedTemporaryFile()
+        params = Params()
+        params.concurrency = 1
+        params.iterations = 1
+        params.report = outfile.name
+        params.tests = dummy_tests
+        params.executor = "asyncio"
+
+        worker = Worker(params)
+        self.assertRaises(RuntimeError, worker.start)
+
     def test_unicode_ldjson(self):
         outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
         params = Params()
@@ -276,6 +940,7 @@ class TestWriter(TestCase):
         outfile.close()
 
         writer = JTLSampleWriter(outfile.name)
+        writer.flush_interval = 0  # every batch goes to disk at once
         sample_generators = [SampleGenerator(writer, i, outfile.name) for i in range(5)]
 
         with writer:
@@ -290,6 +955,178 @@ class TestWriter(TestCase):
         for generator in sample_generators:
             self.assertTrue(len(generator.written_results) > 1)
 
+    def test_buffered_writer(self):
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+        writer = LDJSONSampleWriter(outfile.name)
+        writer.flush_interval = 0.5
+        with writer:
+            start_time = time.time()
+            for idx in range(10):
+                writer.add(Sample(start_time=idx, duration=idx, test_case="label %s" % idx), idx, idx)
+            time.sleep(0.25)
+            with open(outfile.name) as fds:
+                self.assertEqual(0, len(fds.readlines()))  # still buffered
+
+            while time.time() < start_time + 1:
+                with open(outfile.name) as fds:
+                    if len(fds.readlines()) == 10:
+                        break
+                time.sleep(0.05)
+            self.assertLess(time.time() - start_time, 1)  # flushed within interval
+
+            writer.add(Sample(start_time=10, duration=1, test_case="last"), 10, 10)
+
+        with open(outfile.name) as fds:
+            self.assertEqual(11, len(fds.readlines()))  # the rest is flushed on exit
+
+    def test_binary_report(self):
+        outfile = tempfile.NamedTemporaryFile(suffix=".arb")
+        params = Params()
+        params.concurrency = 2
+        params.iterations = 3
+        params.report = outfile.name
+        params.result_blobs = True
+        params.tests = dummy_tests
+
+        worker = Worker(params)
+        worker.start()
+        worker.join()
+
+        samples = [sample for sample, _, _ in read_samples(outfile.name)]
+        self.assertEqual(12, len(samples))  # two test cases per iteration
+        self.assertEqual(12, worker.summary.total().count)
+        for sample in samples:
+            self.assertIn("full_name", sample.extras)
+
+    def test_compressed_report(self):
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson.gz")
+        params = Params()
+        params.concurrency = 2
+        params.iterations = 3
+        params.report = outfile.name
+        params.tests = dummy_tests
+
+        worker = Worker(params)
+        self.assertIsInstance(store.writer, LDJSONSampleWriter)
+        worker.start()
+        worker.join()
+
+        with gzip.open(outfile.name, "rt") as fds:
+            samples = [json.loads(line) for line in fds.readlines()]
+        self.assertEqual(12, len(samples))
+
+    def test_compressed_report_names(self):
+        params = Params()
+        params.concurrency = 2
+        params.worker_count = 2
+        params.tests = dummy_tests
+        for template, writer_class in (("result.ldjson.gz", LDJSONSampleWriter), ("out.arb.zst", ColumnarSampleWriter)):
+            params.report = os.path.join(tempfile.mkdtemp(), template)  # no %s, index goes before format extension
+            for worker_params in Supervisor(params)._concurrency_slicer():
+                Worker(worker_params)
+                self.assertIs(writer_class, type(store.writer))
+
+    def test_compressed_workers(self):
+        tmpdir = tempfile.mkdtemp()
+        params = Params()
+        params.concurrency = 2
+        params.worker_count = 2
+        params.iterations = 3
+        params.report = os.path.join(tmpdir, "result.ldjson.gz")  # workers add their index without %s
+        params.tests = dummy_tests
+
+        supervisor = Supervisor(params)
+        supervisor.start()
+        supervisor.join()
+
+        for idx in range(params.worker_count):
+            with gzip.open(os.path.join(tmpdir, "result-%s.ldjson.gz" % idx), "rt") as fds:
+                samples = [json.loads(line) for line in fds.readlines()]
+            self.assertEqual(6, len(samples))
+
+    def test_aggregating_writer(self):
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+        failures = tempfile.NamedTemporaryFile(suffix=".ldjson")
+        writer = AggregatingSampleWriter(outfile.name, 1, failures.name)
+        with writer:
+            for idx in range(30):
+                status = "FAILED" if idx % 10 == 0 else "PASSED"
+                sample = Sample(test_case="label %s" % (idx % 2), status=status, start_time=100 + idx / 10.0,
+                                duration=0.01 * idx)
+                writer.add(sample, idx, idx)
+
+        buckets = read_buckets(outfile.name)
+        self.assertEqual([100, 101, 102], [timestamp for timestamp, _, _ in buckets])
+        for timestamp, summary, vus in buckets:
+            self.assertEqual(10, summary.total().count)
+            self.assertEqual(1, summary.total().failures)
+            self.assertEqual(["label 0", "label 1"], sorted(summary.labels))
+        self.assertEqual(0, buckets[0][2])  # VUs were zero because there are no counters
+
+        merged = Summary()
+        for _, summary, _ in buckets:
+            merged.merge(summary)
+        self.assertEqual(writer.summary.to_dict(), merged.to_dict())  # the same numbers as from samples
+
+        with open(failures.name) as fds:
+            self.assertEqual([100, 101, 102], [json.loads(line)["start_time"] for line in fds])
+
+    def test_aggregating_writer_idle(self):
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+        writer = AggregatingSampleWriter(outfile.name)
+        writer.flush_interval = 0.1
+        with writer:
+            start_time = time.time() - STATS_DELAY  # bucket is over within a second
+            writer.add(Sample(test_case="label", status="PASSED", start_time=start_time, duration=0.1), 1, 1)
+            for _ in range(40):  # no more samples come, bucket goes to disk anyway
+                time.sleep(0.05)
+                if read_buckets(outfile.name):
+                    break
+            self.assertEqual(1, len(read_buckets(outfile.name)))
+
+    def test_aggregate(self):
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson.gz")
+        params = Params()
+        params.concurrency = 2
+        params.iterations = 3
+        params.report = outfile.name
+        params.aggregate = 1
+        params.tests = dummy_tests
+
+        worker = Worker(params)
+        self.assertIsInstance(store.writer, AggregatingSampleWriter)
+        worker.start()
+        worker.join()
+
+        merged = Summary()
+        for _, summary, vus in read_buckets(outfile.name):
+            merged.merge(summary)
+            self.assertLessEqual(vus, 2)
+        self.assertEqual(12, merged.total().count)
+
+    def test_sample_queue(self):
+        samples = SampleQueue()
+        for idx in range(5):
+            samples.put(idx)
+        self.assertEqual(5, samples.qsize())
+        self.assertEqual([0, 1, 2], samples.get_batch(limit=3))
+        self.assertEqual([3, 4], samples.get_batch())
+        self.assertFalse(samples.join(timeout=0.01))
+        samples.task_done(5)
+        self.assertTrue(samples.join())
+
+        start_time = time.time()
+        self.assertEqual([], samples.get_batch(timeout=0.1))
+        self.assertGreaterEqual(time.time() - start_time, 0.1)
+
+        threading.Timer(0.1, samples.put, args=("late",)).start()
+        self.assertEqual(["late"], samples.get_batch(timeout=5))  # wakes up as soon as sample comes
+
+        threading.Timer(0.1, samples.close).start()
+        start_time = time.time()
+        self.assertEqual([], samples.get_batch())
+        self.assertLess(time.time() - start_time, 1)
+
     def test_writers_x3(self):
         # writers must:
         #   1. be the same for threads of one process
@@ -346,6 +1183,22 @@ def mock_spawn_worker(params):
         time.sleep(0.2)
 
 
+def spawn_limited_worker(params):
+    import resource  # POSIX only
+
+    with open("/proc/self/statm") as fds:
+        address_space = int(fds.read().split()[0]) * resource.getpagesize() / 1024.0 / 1024
+    params.memory_limit = address_space + 64  # not enough for stacks of VU threads
+    errors = []
+    handler = logging.Handler(logging.ERROR)
+    handler.emit = lambda record: errors.append(record.getMessage())
+    logging.getLogger("apiritif").addHandler(handler)
+    try:
+        apiritif.loadgen.spawn_worker(params)
+    except Exception:
+        return errors
+
+
 class TestMultiprocessing(TestCase):
 
     # Each worker should be spawned in separate process
@@ -382,3 +1235,16 @@ class TestMultiprocessing(TestCase):
 
             for i in range(params.worker_count):
                 os.remove(params.report % i)
+
+    @skipUnless(os.path.exists("/proc/self/statm"), "no address space info on this platform")
+    def test_memory_limit(self):
+        outfile = tempfile.NamedTemporaryFile()
+        params = Params()
+        params.concurrency = 100
+        params.iterations = 1
+        params.report = outfile.name
+        params.tests = dummy_tests
+        with multiprocessing.Pool(1) as pool:  # limit can't be undone, so apply it to another process
+            errors = pool.apply(spawn_limited_worker, (params,))
+        self.assertEqual(1, len(errors))
+        self.assertIn("--memory-limit", errors[0])
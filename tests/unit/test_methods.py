@@ -1,4 +1,8 @@
+import time
+
 from apiritif import http
+from apiritif.http import _limit_timeout
+from apiritif.utils import set_deadline
 from unittest import TestCase
 
 
@@ -52,3 +56,22 @@ class TestTargetMethods(TestCase):
 
     def test_connect(self):
         self.target.connect('/echo.php?echo=connect')
+
+
+class TestLimitTimeout(TestCase):
+    def tearDown(self):
+        set_deadline(None)
+
+    def test_limit_timeout(self):
+        self.assertEqual(30, _limit_timeout(30))
+        self.assertEqual((3.05, 27), _limit_timeout((3.05, 27)))
+
+        set_deadline(time.time() + 10)
+        self.assertEqual(5, _limit_timeout(5))
+        self.assertLessEqual(_limit_timeout(30), 10)
+        self.assertLessEqual(_limit_timeout(None), 10)
+
+        connect, read = _limit_timeout((3.05, 27))  # requests accepts (connect, read) tuple
+        self.assertEqual(3.05, connect)
+        self.assertLessEqual(read, 10)
+        self.assertTrue(all(part <= 10 for part in _limit_timeout((None, None))))
@@ -0,0 +1,52 @@
+import json
+import urllib.request
+from unittest import TestCase
+
+from apiritif.metrics import LiveMetrics, MetricsServer
+from apiritif.stats import Summary
+
+
+def _second(*samples):
+    summary = Summary()
+    for label, start_time, elapsed, success in samples:
+        summary.add(label, start_time, elapsed, success)
+    return summary
+
+
+class TestLiveMetrics(TestCase):
+    def test_window(self):
+        metrics = LiveMetrics(window=2)
+        metrics.add(100, _second(("login", 100.1, 1.0, True), ("login", 100.5, 2.0, False)))
+        metrics.add(101, _second(("login", 101.1, 0.1, True), ("logout", 101.2, 0.2, True)))
+        metrics.add(102, _second(("login", 102.1, 0.1, True)))
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(2, snapshot["window"])  # second 100 is out of window
+        self.assertEqual(102, snapshot["last_second"])
+        login = snapshot["labels"]["login"]
+        self.assertEqual(4, login["count"])  # since start
+        self.assertEqual(1, login["failures"])
+        self.assertEqual(1.0, login["throughput"])
+        self.assertEqual(0.0, login["error_rate"])
+        self.assertAlmostEqual(100, login["p50_ms"], delta=1)
+        self.assertEqual(1.5, snapshot["total"]["throughput"])
+
+        metrics.add(110, _second(("login", 110.1, 0.1, True)))
+        self.assertEqual(0.0, metrics.snapshot()["labels"]["logout"]["throughput"])
+
+    def test_server(self):
+        metrics = LiveMetrics()
+        metrics.add(100, _second(("login", 100.1, 0.5, True)))
+        server = MetricsServer(("127.0.0.1", 0), metrics)
+        server.start()
+        try:
+            url = "http://%s:%s/metrics" % server.address
+            with urllib.request.urlopen(url) as response:
+                self.assertEqual("application/json", response.headers["Content-Type"])
+                snapshot = json.loads(response.read().decode("utf-8"))
+            self.assertEqual(1, snapshot["labels"]["login"]["count"])
+
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(url + "/wrong")
+        finally:
+            server.close()
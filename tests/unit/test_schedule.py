@@ -0,0 +1,164 @@
+import time
+from unittest import TestCase
+
+from apiritif.schedule import ArrivalSchedule, LoadProfile, Pacer, Scenario, POISSON, CONCURRENCY, RATE
+from apiritif.schedule import mix_scenarios
+
+
+class TestArrivalSchedule(TestCase):
+    def test_constant(self):
+        schedule = ArrivalSchedule(rate=10)
+        schedule.start(start_time=100)
+        arrivals = [schedule.next_arrival() for _ in range(5)]
+        for expected, arrival in zip([100, 100.1, 100.2, 100.3, 100.4], arrivals):
+            self.assertAlmostEqual(expected, arrival)
+
+    def test_limit(self):
+        schedule = ArrivalSchedule(rate=10, limit=3)
+        arrivals = [schedule.next_arrival() for _ in range(5)]
+        self.assertEqual(3, len([arrival for arrival in arrivals if arrival]))
+        self.assertEqual(3, schedule.issued())
+
+    def test_duration(self):
+        schedule = ArrivalSchedule(rate=10, duration=2)
+        schedule.start(start_time=100)
+        arrivals = []
+        while True:
+            arrival = schedule.next_arrival()
+            if arrival is None:
+                break
+            arrivals.append(arrival)
+        self.assertAlmostEqual(20, len(arrivals), delta=1)
+        self.assertTrue(all(100 <= arrival < 102 for arrival in arrivals))
+
+    def test_ramp_up(self):
+        schedule = ArrivalSchedule(rate=10, ramp_up=10, duration=20)
+        schedule.start(start_time=0)
+        arrivals = []
+        while True:
+            arrival = schedule.next_arrival()
+            if arrival is None:
+                break
+            arrivals.append(arrival)
+
+        # half of the rate in average during ramp-up
+        self.assertAlmostEqual(50, len([arrival for arrival in arrivals if arrival < 10]), delta=1)
+        self.assertAlmostEqual(100, len([arrival for arrival in arrivals if arrival >= 10]), delta=1)
+
+    def test_poisson(self):
+        schedule = ArrivalSchedule(rate=100, distribution=POISSON, duration=100, seed=1)
+        schedule.start(start_time=0)
+        count = 0
+        while schedule.next_arrival() is not None:
+            count += 1
+        self.assertAlmostEqual(10000, count, delta=500)
+
+    def test_unknown_distribution(self):
+        self.assertRaises(ValueError, ArrivalSchedule, rate=1, distribution="gauss")
+
+    def test_default_start(self):
+        schedule = ArrivalSchedule(rate=1)
+        before = time.time()
+        arrival = schedule.next_arrival()
+        self.assertTrue(before <= arrival <= time.time())
+
+
+class TestPacer(TestCase):
+    def test_interval(self):
+        pacer = Pacer(interval=2)
+        before = time.time()
+        self.assertTrue(before <= pacer.next_start(None) <= time.time())
+        self.assertEqual(12, pacer.next_start(10))
+
+    def test_throughput(self):
+        active = [4]
+        pacer = Pacer(throughput=2, active_source=lambda: active[0])
+        self.assertEqual(12, pacer.next_start(10))  # 4 VUs make 2 iterations per second together
+        active[0] = 1
+        self.assertEqual(10.5, pacer.next_start(10))
+        active[0] = 0
+        self.assertEqual(10.5, pacer.next_start(10))
+
+
+class TestLoadProfile(TestCase):
+    def test_segments(self):
+        profile = LoadProfile.from_dict({"segments": [
+            {"type": "ramp", "duration": 10, "to": 10},
+            {"type": "hold", "duration": 10},
+            {"type": "spike", "duration": 5, "to": 50},
+            {"type": "sine", "duration": 20, "amplitude": 5, "period": 20},
+            {"type": "step", "duration": 30, "to": 4, "steps": 3},
+        ]})
+
+        self.assertEqual(CONCURRENCY, profile.target)
+        self.assertEqual(75, profile.duration())
+        self.assertEqual(50, profile.max_level())
+
+        self.assertEqual(0, profile.level_at(0))
+        self.assertEqual(5, profile.level_at(5))
+        self.assertEqual(10, profile.level_at(15))
+        self.assertEqual(50, profile.level_at(21))
+        self.assertAlmostEqual(15, profile.level_at(30))  # top of sine
+        self.assertAlmostEqual(5, profile.level_at(40))  # bottom of sine
+        self.assertEqual(8, profile.level_at(45))
+        self.assertEqual(6, profile.level_at(55))
+        self.assertEqual(4, profile.level_at(74))
+        self.assertIsNone(profile.level_at(75))
+
+    def test_explicit_levels(self):
+        profile = LoadProfile.from_dict({"target": "rate", "start": 2, "segments": [
+            {"type": "ramp", "duration": 10, "from": 5, "to": 15},
+            {"type": "hold", "duration": 10, "level": 1},
+        ]})
+        self.assertEqual(RATE, profile.target)
+        self.assertEqual(5, profile.level_at(0))
+        self.assertEqual(1, profile.level_at(10))
+        self.assertEqual(15, profile.max_level())
+
+    def test_wrong_profiles(self):
+        self.assertRaises(ValueError, LoadProfile.from_dict, {"segments": []})
+        self.assertRaises(ValueError, LoadProfile.from_dict, {"segments": [{"type": "jump", "duration": 1}]})
+        self.assertRaises(ValueError, LoadProfile.from_dict, {"segments": [{"type": "hold", "duration": 0}]})
+        self.assertRaises(ValueError, LoadProfile.from_dict, {"segments": [{"type": "ramp", "duration": 1}]})
+        self.assertRaises(ValueError, LoadProfile.from_dict, {"target": "hits", "segments": [
+            {"type": "hold", "duration": 1}]})
+
+    def test_rate_source(self):
+        profile = LoadProfile.from_dict({"target": "rate", "segments": [
+            {"type": "hold", "duration": 1, "level": 10},
+            {"type": "hold", "duration": 1, "level": 0},
+            {"type": "hold", "duration": 1, "level": 20},
+        ]})
+        schedule = ArrivalSchedule(rate=0, rate_source=lambda timestamp: profile.level_at(timestamp))
+        schedule.start(start_time=0)
+        arrivals = []
+        while True:
+            arrival = schedule.next_arrival()
+            if arrival is None:
+                break
+            arrivals.append(arrival)
+
+        self.assertAlmostEqual(10, len([arrival for arrival in arrivals if arrival < 1]), delta=1)
+        self.assertEqual(0, len([arrival for arrival in arrivals if 1.15 < arrival < 2]))
+        self.assertAlmostEqual(20, len([arrival for arrival in arrivals if arrival >= 2]), delta=1)
+
+
+class TestScenarios(TestCase):
+    def test_parse(self):
+        scenario = Scenario.parse("tests/browse.py:70")
+        self.assertEqual(("tests/browse.py", 70, None, "browse"),
+                         (scenario.script, scenario.weight, scenario.ramp_up, scenario.label))
+        scenario = Scenario.parse("checkout.py:5:60")
+        self.assertEqual(("checkout.py", 5, 60), (scenario.script, scenario.weight, scenario.ramp_up))
+        scenario = Scenario.parse("C:\\tests\\search.py")
+        self.assertEqual(("C:\\tests\\search.py", 1.0), (scenario.script, scenario.weight))
+        self.assertRaises(ValueError, Scenario.parse, "search.py:0")
+
+        copy = Scenario.from_dict(scenario.to_dict())
+        self.assertEqual(scenario.to_dict(), copy.to_dict())
+
+    def test_mix(self):
+        mix = mix_scenarios([70, 25, 5], 20)
+        self.assertEqual([14, 5, 1], [mix.count(idx) for idx in range(3)])
+        self.assertEqual([0, 1, 0], mix[:3])  # every prefix is close to the weights
+        self.assertEqual([0, 1, 0] * 2, mix_scenarios([2, 1], 6))
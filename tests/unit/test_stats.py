@@ -0,0 +1,104 @@
+import json
+from unittest import TestCase
+
+from apiritif.stats import Histogram, Summary, Timeline
+
+
+class TestSummary(TestCase):
+    def test_merge(self):
+        first = Summary()
+        first.add("login", 100, 0.5, True, 10)
+        first.add("login", 101, 1.5, False, 10)
+
+        second = Summary()
+        second.add("login", 99, 0.25, True)
+        second.add("logout", 102, 1.0, True)
+
+        first.merge(second)
+
+        self.assertEqual(99, first.start_time)
+        self.assertEqual(103, first.end_time)
+        login = first.labels["login"]
+        self.assertEqual(3, login.count)
+        self.assertEqual(1, login.failures)
+        self.assertEqual(20, login.bytes)
+        self.assertEqual(0.25, login.elapsed_min)
+        self.assertEqual(1.5, login.elapsed_max)
+        self.assertAlmostEqual(0.75, login.elapsed_avg())
+
+        total = first.total()
+        self.assertEqual(4, total.count)
+        self.assertEqual(1, total.failures)
+
+        lines = first.report()
+        self.assertEqual(4, len(lines))
+        self.assertTrue(lines[-1].startswith("TOTAL"))
+
+    def test_empty(self):
+        summary = Summary()
+        self.assertEqual(0, summary.duration())
+        self.assertEqual(2, len(summary.report()))
+
+    def test_serialization(self):
+        summary = Summary()
+        summary.add("login", 100, 0.5, True, 10)
+        summary.add("login", 101, 1.5, False, 10)
+
+        restored = Summary.from_dict(summary.to_dict())
+        self.assertEqual(summary.report(), restored.report())
+        self.assertEqual(1.5, restored.labels["login"].elapsed_max)
+
+    def test_corrected_latency(self):
+        summary = Summary()
+        summary.add("login", 100, 0.1, True)
+        summary.add("login", 101, 0.1, True, corrected=2.1)  # iteration has started 2 seconds late
+
+        restored = Summary.from_dict(json.loads(json.dumps(summary.to_dict())))
+        login = restored.labels["login"]
+        self.assertAlmostEqual(0.1, login.histogram.percentile(99), delta=0.001)
+        self.assertAlmostEqual(2.1, login.corrected.percentile(99), delta=0.021)
+        self.assertIn("cor.p99", restored.report()[0])
+        self.assertNotIn("cor.p99", Summary().report()[0])
+
+
+class TestHistogram(TestCase):
+    def test_percentiles(self):
+        histogram = Histogram()
+        self.assertIsNone(histogram.percentile(50))
+        for value in range(1, 1001):
+            histogram.add(value / 1000.0)
+
+        self.assertEqual(1000, histogram.count())
+        self.assertAlmostEqual(0.5, histogram.percentile(50), delta=0.005)
+        self.assertAlmostEqual(0.99, histogram.percentile(99), delta=0.01)
+        self.assertAlmostEqual(1.0, histogram.percentile(100), delta=0.01)
+        self.assertAlmostEqual(0.001, histogram.percentile(0), delta=0.00001)
+
+    def test_merge(self):
+        first = Histogram()
+        first.add(0.1)
+        second = Histogram()
+        second.add(0)
+        second.add(10)
+        first.merge(Histogram.from_dict(second.to_dict()))
+        self.assertEqual(3, first.count())
+        self.assertAlmostEqual(0.1, first.percentile(50), delta=0.001)
+        self.assertAlmostEqual(10, first.percentile(100), delta=0.1)
+
+
+class TestTimeline(TestCase):
+    def test_pop(self):
+        timeline = Timeline()
+        timeline.add("login", 100.2, 0.5, True)
+        timeline.add("login", 100.7, 0.5, True)
+        timeline.add("login", 102.1, 0.5, False)
+
+        seconds = timeline.pop(before=102)
+        self.assertEqual([100], [second for second, _ in seconds])
+        self.assertEqual(2, seconds[0][1].total().count)
+
+        other = Summary()
+        other.add("logout", 103, 0.1, True)
+        timeline.merge(103, other)
+        self.assertEqual([102, 103], [second for second, _ in timeline.pop()])
+        self.assertEqual([], timeline.pop())